@@ -0,0 +1,69 @@
+"""
+Benchmarks how long the CLI takes to import before it can show the prompt.
+
+Imports a module in fresh interpreters with `python -X importtime` and reports the
+median cumulative import time and the modules that cost the most on their own. With
+`--max-ms`, exits with status 1 when the median exceeds the limit, so it can guard
+against heavy imports creeping back into the startup path.
+
+    python benchmarks/startup.py [--module chaingpt.cli.app] [--runs N] [--top N] [--max-ms MS]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(module: str) -> dict:
+    """
+    Imports `module` in a new interpreter. Returns the self and cumulative
+    import time in microseconds of every module it loaded, keyed by name.
+    """
+    env = dict(os.environ)
+    # chaingpt.api.llm and friends need a key to build their clients, but never call OpenAI here
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="chaingpt.cli.app",
+                        help="The module imported before the prompt appears")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of most expensive modules to list")
+    parser.add_argument("--max-ms", type=float,
+                        help="Fail if the median import time exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [run[args.module][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+    print(f"{args.module}: median {median:.1f}ms over {args.runs} runs "
+          f"(min {min(totals):.1f}ms, max {max(totals):.1f}ms), {len(runs[-1])} modules")
+
+    slowest = sorted(runs[-1].items(), key=lambda item: -item[1][0])[:args.top]
+    print(f"{'self ms':>8} {'cumulative ms':>14}  module")
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{self_us / 1000:8.1f} {cumulative_us / 1000:14.1f}  {name}")
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: {median:.1f}ms exceeds the limit of {args.max_ms:.1f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
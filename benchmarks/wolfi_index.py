@@ -0,0 +1,126 @@
+"""
+Benchmarks a full build of the Wolfi package index.
+
+Compares the original pipeline (serial `yaml.safe_load` of every file into a single
+whoosh writer) with `chaingpt.api.wolfi.build_index` and reports files/sec for each.
+Runs against an existing Wolfi OS checkout, or a synthetic one when none is given.
+
+    python benchmarks/wolfi_index.py [--os-dir PATH] [--files N] [--procs N]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+from whoosh.index import create_in
+
+from chaingpt.api import wolfi
+
+
+PACKAGE_TEMPLATE = """package:
+  name: {name}
+  version: 1.2.{i}
+  epoch: 0
+  description: Synthetic package number {i} used to benchmark index builds
+  copyright:
+    - license: Apache-2.0
+
+environment:
+  contents:
+    packages:
+      - build-base
+      - busybox
+      - ca-certificates-bundle
+
+pipeline:
+  - uses: fetch
+    with:
+      uri: https://example.com/{name}-${{{{package.version}}}}.tar.gz
+      expected-sha256: {sha}
+  - uses: autoconf/configure
+  - uses: autoconf/make
+  - uses: autoconf/make-install
+  - uses: strip
+
+subpackages:
+  - name: {name}-dev
+    pipeline:
+      - uses: split/dev
+    description: {name} dev
+
+update:
+  enabled: true
+  release-monitor:
+    identifier: {i}
+"""
+
+
+def make_synthetic_os(path: str, n: int):
+    os.makedirs(path)
+    for i in range(n):
+        name = f"pkg{i}"
+        with open(os.path.join(path, f"{name}.yaml"), "w", encoding="utf-8") as f:
+            f.write(PACKAGE_TEMPLATE.format(name=name, i=i, sha=f"{i:064x}"))
+
+
+def build_index_baseline(os_path: str, index_path: str):
+    """
+    The index build as it was before parsing was parallelized.
+    """
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.makedirs(index_path)
+    index = create_in(index_path, wolfi.SCHEMA)
+    writer = index.writer()
+    for name in os.listdir(os_path):
+        if not wolfi._is_package_file(name):
+            continue
+        with open(os.path.join(os_path, name), "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+        if not isinstance(data, dict) or "package" not in data.keys():
+            continue
+        try:
+            writer.add_document(package_file=name,
+                                package_name=data["package"]["name"],
+                                package_desc=data["package"]["description"])
+        except KeyError:
+            continue
+    writer.commit()
+
+
+def timed(label: str, n_files: int, fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:8.2f}s {n_files / elapsed:10.1f} files/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--os-dir", help="An existing Wolfi OS checkout")
+    parser.add_argument("--files", type=int, default=3000,
+                        help="Number of synthetic package files (without --os-dir)")
+    parser.add_argument("--procs", type=int, default=wolfi.INDEX_PROCS)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="wolfi-bench-")
+    try:
+        os_path = args.os_dir
+        if os_path is None:
+            os_path = os.path.join(tmp_dir, "os")
+            make_synthetic_os(os_path, args.files)
+        n_files = sum(1 for name in os.listdir(os_path) if wolfi._is_package_file(name))
+        index_path = os.path.join(tmp_dir, "index")
+
+        print(f"{n_files} package files, {args.procs} procs, loader {wolfi.YAML_LOADER.__name__}")
+        timed("before", n_files, build_index_baseline, os_path, index_path)
+        timed("after", n_files, wolfi.build_index, os_path, index_path, args.procs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
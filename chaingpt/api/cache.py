@@ -0,0 +1,142 @@
+# Standard lib
+from typing import Optional, Any
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+
+# 3rd party
+
+# Local
+
+
+READ_BLOCK_SZ = 1 << 20
+
+
+def git_blob_sha(file_path: str) -> str:
+    """
+    Computes the git blob SHA of the file at `file_path` without
+    shelling out to git. Matches the output of `git hash-object`.
+
+    Args:
+        file_path (str): The path of the file to hash.
+
+    Returns:
+        The hex digest of the blob SHA.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    sha = hashlib.sha1()
+    sha.update(b"blob %d\0" % os.path.getsize(file_path))
+    with open(file_path, "rb") as f:
+        while block := f.read(READ_BLOCK_SZ):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Builds a cache key from JSON serializable `parts`. The same
+    parts always produce the same key.
+    """
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class LLMCache():
+    """
+    A persistent, size bounded key-value store for LLM outputs backed by SQLite.
+    When the stored values exceed `max_size` bytes, the least recently used
+    entries are evicted. Safe to share between threads and processes.
+
+    hits (int): The number of successful lookups made through this object.
+    misses (int): The number of failed lookups made through this object.
+    """
+    def __init__(self, path: str, max_size: int):
+        if max_size <= 0:
+            raise ValueError(f"`max_size` must be positive. Got {max_size}")
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the value stored under `key` or `None` if there is no
+        such entry. A hit marks the entry as recently used.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?",
+                               (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """
+        Stores `value` under `key`, replacing any existing entry, then evicts
+        least recently used entries until the cache fits in `max_size` bytes.
+        Values larger than `max_size` are not stored.
+        """
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                   (key, value, size, time.time()))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def size(self) -> int:
+        """
+        Returns the total size in bytes of the stored entries.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the total size
+        is at most `max_size`. Must be called inside a transaction.
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access")
+        evict = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evict.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", evict)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
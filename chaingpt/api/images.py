@@ -0,0 +1,165 @@
+# Standard lib
+from typing import Callable, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+import abc
+import time
+import threading
+
+# 3rd party
+
+# Local
+from chaingpt.api.cache import make_key
+from chaingpt.api.scheduler import Scheduler
+
+
+IMAGE_REPOSITORY = "chaingpt-deps"
+
+
+@dataclass
+class CachedImage:
+    tag: str
+    deps: List[str]
+    size: int  # Bytes on top of the base image
+    last_used: float
+
+
+class ImageBackend(abc.ABC):
+    """
+    The container runtime that builds and stores the images of an `ImageCache`.
+    """
+    @abc.abstractmethod
+    def build(self, base_image: str, deps: List[str], tag: str) -> int:
+        """
+        Builds `tag` from `base_image` with `deps` installed and
+        returns the disk space it adds to the base image in bytes.
+        """
+
+    @abc.abstractmethod
+    def list(self, base_image: str) -> List[CachedImage]:
+        """
+        Returns the images previously built from `base_image`.
+        """
+
+    @abc.abstractmethod
+    def remove(self, tag: str):
+        """
+        Deletes the image `tag`.
+        """
+
+
+def canonical_deps(deps: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Returns `deps` sorted and without duplicates or blanks, so that the
+    same set of dependencies always maps to the same image.
+    """
+    return tuple(sorted(set(d.strip() for d in deps if d.strip())))
+
+
+def image_tag(base_image: str, deps: Iterable[str]) -> str:
+    """
+    Returns the tag of the image derived from `base_image` with `deps` installed.
+    """
+    return f"{IMAGE_REPOSITORY}:{make_key(base_image, canonical_deps(deps))[:16]}"
+
+
+class ImageCache():
+    """
+    Keeps images derived from `base_image` with a set of dependencies
+    preinstalled, so scripts with the same dependencies skip `apk add`.
+    Images are built in the background the first time a dependency set is
+    requested. When their total size exceeds `max_size` bytes, the least
+    recently used images are removed and `on_evict` is called with their tag.
+    Builds wait for a slot of `scheduler`, if any, like scripts do.
+    """
+    def __init__(self, backend: ImageBackend, base_image: str, max_size: int,
+                 on_evict: Callable[[str], None]=None, scheduler: Scheduler=None):
+        if max_size <= 0:
+            raise ValueError(f"`max_size` must be positive. Got {max_size}")
+        self.backend = backend
+        self.base_image = base_image
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._building = set()
+        self._workers = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-cache")
+        self._images = OrderedDict()
+        for image in sorted(backend.list(base_image), key=lambda i: i.last_used):
+            self._images[image.tag] = image
+
+    def get(self, deps: Iterable[str]) -> Optional[str]:
+        """
+        Returns the tag of the image with `deps` preinstalled, or `None` if it
+        has not been built yet.
+        """
+        tag = image_tag(self.base_image, deps)
+        with self._lock:
+            image = self._images.get(tag)
+            if image is None:
+                return None
+            image.last_used = time.time()
+            self._images.move_to_end(tag)
+            return tag
+
+    def request(self, deps: Iterable[str]):
+        """
+        Builds the image with `deps` preinstalled in the background,
+        unless it exists or is being built.
+        """
+        deps = canonical_deps(deps)
+        tag = image_tag(self.base_image, deps)
+        with self._lock:
+            if not deps or tag in self._images or tag in self._building:
+                return
+            self._building.add(tag)
+        self._workers.submit(self._build, list(deps), tag)
+
+    def _build(self, deps: List[str], tag: str):
+        try:
+            with self.scheduler.slot() if self.scheduler is not None else nullcontext():
+                size = self.backend.build(self.base_image, deps, tag)
+        except Exception:
+            # Scripts keep installing these deps at run time
+            with self._lock:
+                self._building.discard(tag)
+            return
+        with self._lock:
+            self._building.discard(tag)
+            self._images[tag] = CachedImage(tag, deps, size, time.time())
+            evicted = self._evict()
+        for image in evicted:
+            if self.on_evict is not None:
+                self.on_evict(image.tag)
+            self.backend.remove(image.tag)
+
+    def _evict(self) -> List[CachedImage]:
+        """
+        Drops the least recently used images until the cache fits in
+        `max_size`. The newest image is always kept. Must hold `_lock`.
+        """
+        evicted = []
+        total = sum(image.size for image in self._images.values())
+        while total > self.max_size and len(self._images) > 1:
+            image = self._images.popitem(last=False)[1]
+            total -= image.size
+            evicted.append(image)
+        return evicted
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cached images in bytes.
+        """
+        with self._lock:
+            return sum(image.size for image in self._images.values())
+
+    def wait(self):
+        """
+        Blocks until the builds requested so far are done.
+        """
+        self._workers.submit(lambda: None).result()
+
+    def close(self):
+        self._workers.shutdown(wait=False, cancel_futures=True)
@@ -1,22 +1,67 @@
 # Standard lib
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Set, Tuple
 from operator import itemgetter
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
+import contextvars
+import functools
+import itertools
+import math
+import re
+import threading
 
 # 3rd party
-from tqdm import tqdm
-import openai
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.output_parsers import StrOutputParser
 from langchain_community.callbacks import get_openai_callback
+from langchain_core.runnables import Runnable
 
 # Local
+from chaingpt.api.cache import LLMCache, make_key
+from chaingpt.api.tokens import context_window, count_tokens, iter_token_chunks
 from chaingpt.utils import config
 
 
-openai.api_key = config.config["secrets"]["openai_api_key"]
 LLM_MODEL = config.config["llm"]["file_qa_model"]
+MAX_OUTPUT_TOKENS = config.config["llm"]["max_output_tokens"]
+MAP_REDUCE_STRATEGY = config.config["llm"]["map_reduce"]["strategy"]
+MAP_REDUCE_CHUNK_TOKENS = config.config["llm"]["map_reduce"]["chunk_tokens"]
+MAP_REDUCE_CHUNK_OVERLAP = config.config["llm"]["map_reduce"]["chunk_overlap"]
+PREFILTER_ENABLED = config.config["llm"]["prefilter"]["enabled"]
+PREFILTER_TOP_K = config.config["llm"]["prefilter"]["top_k"]
+PREFILTER_MIN_SCORE = config.config["llm"]["prefilter"]["min_score"]
+PREFILTER_NEIGHBOURS = config.config["llm"]["prefilter"]["neighbours"]
+PREFILTER_MIN_CHUNKS = config.config["llm"]["prefilter"]["min_chunks"]
+MAP_REDUCE_MAX_CONCURRENCY = config.config["llm"]["map_reduce"]["max_concurrency"]
+MAP_REDUCE_REDUCE_FANOUT = config.config["llm"]["map_reduce"]["reduce_fanout"]
+
+STRATEGY_REFINE = "refine"
+STRATEGY_MAP_REDUCE = "map_reduce"
+
+# Called with a stage (`"refine"`, `"map"` or `"reduce"`), the number of LLM calls of that
+# stage done so far and their total, which is `None` while chunks are still being read
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+# Stands in for a chunk when measuring the overhead of a prompt in `prompt_overhead`
+BUDGET_SAMPLE_TEXT = "def main():\n    print('hello')\n"
+
+# Bump whenever a prompt changes so cached outputs of the old prompts are not reused
+PROMPT_VERSION = 1
+
+# BM25 parameters used to rank chunks against a question
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words too common in questions to say anything about which chunk is relevant
+STOPWORDS = frozenset("""
+    a about an and are as at be by can do does file for from how i in is it me of
+    on or the this that to used uses what when where which who why with you
+    """.split())
+
+# Terms of questions about the file as a whole, which every chunk is relevant to
+BROAD_TERMS = frozenset("""
+    all code contents content describe does entire everything explain overview
+    purpose summarise summarize summary whole
+    """.split())
 
 
 # Used to summarize of file chunk
@@ -54,26 +99,166 @@ read_summary_prompt = """
     </summary>
     """
 
-llm = ChatOpenAI(model=LLM_MODEL, temperature=0)
+# Used to summarize a single chunk independently of the others (map step)
+map_chunk_prompt = """
+    You are scanning the contents of a large file from a GitHub repository
+    located at the path {file_path}. The file has been split into chunks that are
+    analyzed independently in order to answer the question '{question}'.
+
+    Summarize the chunk provided below. Only include information relevant to the
+    query. Respond with only the resulting summary. If the chunk contains no relevant
+    information, respond with only "No relevant information."
+
+    <chunk>
+    {chunk}
+    </chunk>
+    """
+
+# Used to merge several partial summaries into one (reduce step)
+combine_summaries_prompt = """
+    You are scanning the contents of a large file from a GitHub repository
+    located at the path {file_path}. You summarized consecutive parts of the file
+    independently in order to answer the question '{question}'. Merge the partial
+    summaries below into a single summary. Only include information relevant to the
+    query and preserve the order in which it appears in the file. Respond with only
+    the resulting summary. If none of the summaries contain relevant information,
+    respond with only "No relevant information."
+
+    {summaries}
+    """
+
+# Used to fold turns that no longer fit the agent's memory budget into a rolling summary
+summarize_conversation_prompt = """
+    You are maintaining a running summary of a conversation between an engineer and an
+    assistant investigating a GitHub repository. The summary of the conversation so far
+    is given below, followed by the turns that happened since.
+
+    <summary>
+    {summary}
+    </summary>
+
+    <turns>
+    {turns}
+    </turns>
+
+    Update the summary with the new turns. Keep the facts, findings, file paths, commands
+    and package names that may matter later and drop chit-chat. Respond with only the
+    resulting summary.
+    """
+
+CHAIN_NAMES = ("llm", "summarize_chunk_chain", "read_summary_chain", "map_chunk_chain",
+               "combine_summaries_chain", "summarize_conversation_chain", "qa_chain")
+
+_chains_lock = threading.Lock()
 
-summarize_chunk_chain = ({
-    "file_path": itemgetter("file_path"),
-    "question": itemgetter("question"),
-    "chunk": itemgetter("chunk"),
-    "summary": itemgetter("summary")}
-    | PromptTemplate.from_template(summarize_chunk_prompt)
-    | llm
-    | StrOutputParser()
-)
 
-read_summary_chain = ({
-    "file_path": itemgetter("file_path"),
-    "question": itemgetter("question"),
-    "summary": itemgetter("summary")}
-    | PromptTemplate.from_template(read_summary_prompt)
-    | llm
-    | StrOutputParser()
-)
+def _format_summaries(summaries: List[str]) -> str:
+    """
+    Wraps each partial summary in numbered tags for the combine prompt.
+    """
+    return "\n\n".join(f"<summary {i + 1}>\n{s}\n</summary {i + 1}>"
+                       for i, s in enumerate(summaries))
+
+
+@functools.lru_cache(maxsize=None)
+def _prompt_chains() -> Dict[str, Runnable]:
+    """
+    Creates the runnables that render the prompt of each chain from its inputs. They
+    do not need the LLM client, so `chunk_token_budget` measures the prompts exactly
+    as the chains send them.
+    """
+    from langchain_core.prompts import PromptTemplate
+
+    summarize_chunk = ({
+        "file_path": itemgetter("file_path"),
+        "question": itemgetter("question"),
+        "chunk": itemgetter("chunk"),
+        "summary": itemgetter("summary")}
+        | PromptTemplate.from_template(summarize_chunk_prompt)
+    )
+
+    read_summary = ({
+        "file_path": itemgetter("file_path"),
+        "question": itemgetter("question"),
+        "summary": itemgetter("summary")}
+        | PromptTemplate.from_template(read_summary_prompt)
+    )
+
+    map_chunk = ({
+        "file_path": itemgetter("file_path"),
+        "question": itemgetter("question"),
+        "chunk": itemgetter("chunk")}
+        | PromptTemplate.from_template(map_chunk_prompt)
+    )
+
+    combine_summaries = ({
+        "file_path": itemgetter("file_path"),
+        "question": itemgetter("question"),
+        "summaries": lambda x: _format_summaries(x["summaries"])}
+        | PromptTemplate.from_template(combine_summaries_prompt)
+    )
+
+    summarize_conversation = ({
+        "summary": itemgetter("summary"),
+        "turns": itemgetter("turns")}
+        | PromptTemplate.from_template(summarize_conversation_prompt)
+    )
+
+    qa = ({
+        "file_path": itemgetter("file_path"),
+        "question": itemgetter("question"),
+        "content": itemgetter("content")}
+        | PromptTemplate.from_template(qa_prompt)
+    )
+
+    return {"summarize_chunk_chain": summarize_chunk,
+            "read_summary_chain": read_summary,
+            "map_chunk_chain": map_chunk,
+            "combine_summaries_chain": combine_summaries,
+            "summarize_conversation_chain": summarize_conversation,
+            "qa_chain": qa}
+
+
+def _build_chains() -> Dict[str, Runnable]:
+    """
+    Creates the LLM client and the chains built on it. Deferred until a chain is first
+    used, so that importing this module does not pay for importing the OpenAI clients.
+    """
+    import openai
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_openai import ChatOpenAI
+
+    openai.api_key = config.config["secrets"]["openai_api_key"]
+    llm = ChatOpenAI(model=LLM_MODEL, temperature=0, max_tokens=MAX_OUTPUT_TOKENS)
+
+    chains = {name: prompt | llm | StrOutputParser()
+              for name, prompt in _prompt_chains().items()}
+    chains["llm"] = llm
+    return chains
+
+
+def get_chain(name: str) -> Runnable:
+    """
+    Returns the chain `name` from `CHAIN_NAMES`, building the chains on first use.
+    Chains assigned to the module, e.g. by tests, take precedence.
+    """
+    if name not in CHAIN_NAMES:
+        raise ValueError(f"Unknown chain '{name}'")
+    chain = globals().get(name)
+    if chain is None:
+        with _chains_lock:
+            if name not in globals():
+                for key, value in _build_chains().items():
+                    globals().setdefault(key, value)
+            chain = globals()[name]
+    return chain
+
+
+def __getattr__(name: str) -> Runnable:
+    # Keeps `llm.map_chunk_chain` and friends working as module attributes
+    if name in CHAIN_NAMES:
+        return get_chain(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @dataclass
@@ -85,52 +270,360 @@ class LLMResponse():
     model (str): The model used.
     input_tokens (str): The number of input tokens sent.
     output_tokens (str): The number of output token generated.
+    cache_hits (int): The number of LLM calls answered from the cache.
+    cache_misses (int): The number of LLM calls that missed the cache.
+    truncated (bool): Whether the analyzed text was truncated.
+    skipped_chunks (int): The number of chunks skipped as irrelevant to the question.
     """
     output: str
     model: str
     input_tokens: int
     output_tokens: int
+    cache_hits: int = 0
+    cache_misses: int = 0
+    truncated: bool = False
+    skipped_chunks: int = 0
 
 
-def text_qa_map_reduce(question: str, text: str,
-                       file_path: str="unknown",
-                       chunk_size: int=10000,
-                       chunk_overlap: int=500) -> LLMResponse:
+def _cache_key(name: str, inputs: Dict) -> str:
+    """
+    Returns the cache key of the output of chain `name` for `inputs`.
+    """
+    return make_key(name, PROMPT_VERSION, LLM_MODEL, inputs)
+
+
+def _cached_batch(chain: Runnable, name: str, inputs: List[Dict],
+                  cache: Optional[LLMCache], stats: Counter,
+                  max_concurrency: int=1) -> List[str]:
+    """
+    Runs `chain` over every element of `inputs`, reusing outputs stored in
+    `cache` for identical inputs. Only the misses are sent to the LLM. Hits
+    and misses are tallied in `stats`.
+    """
+    if cache is None:
+        return chain.batch(inputs, config={"max_concurrency": max_concurrency})
+
+    keys = [_cache_key(name, x) for x in inputs]
+    outputs = [cache.get(k) for k in keys]
+    missing = [i for i, o in enumerate(outputs) if o is None]
+    stats["hits"] += len(inputs) - len(missing)
+    stats["misses"] += len(missing)
+
+    results = chain.batch([inputs[i] for i in missing],
+                          config={"max_concurrency": max_concurrency})
+    for i, r in zip(missing, results):
+        cache.put(keys[i], r)
+        outputs[i] = r
+    return outputs
+
+
+def prompt_overhead(name: str, question: str, file_path: str="unknown") -> int:
+    """
+    Returns the number of tokens the prompt of chain `name` adds around a chunk.
+    The prompt is rendered with sample text through the chain's real template, so
+    anything the chain does to a chunk on its way into the prompt is counted too.
+
+    Args:
+        name (str): One of `"summarize_chunk_chain"`, `"map_chunk_chain"` or `"qa_chain"`.
+        question (str): The question that will be asked.
+        file_path (str, optional): The file path that will be included in the prompt.
+
+    Returns:
+        The number of prompt tokens beyond those of the chunk.
+    """
+    inputs = {"file_path": file_path, "question": question, "summary": "",
+              "chunk": BUDGET_SAMPLE_TEXT, "content": BUDGET_SAMPLE_TEXT}
+    prompt = _prompt_chains()[name].invoke(inputs).to_string()
+    return count_tokens(prompt, LLM_MODEL) - count_tokens(BUDGET_SAMPLE_TEXT, LLM_MODEL)
+
+
+def chunk_token_budget(question: str, file_path: str="unknown") -> int:
+    """
+    Returns the number of tokens a single chunk may use so that any chunk prompt
+    fits in the context window of `LLM_MODEL`. The budget reserves room for the
+    prompt itself, a running summary and the response, each of which are bounded by
+    `MAX_OUTPUT_TOKENS`. A smaller `llm.map_reduce.chunk_tokens` config takes precedence.
+
+    Args:
+        question (str): The question that will be asked.
+        file_path (str, optional): The file path that will be included in the prompt.
+
+    Returns:
+        The maximum number of tokens per chunk.
+    """
+    overhead = max(prompt_overhead(name, question, file_path)
+                   for name in ("summarize_chunk_chain", "map_chunk_chain", "qa_chain"))
+    budget = context_window(LLM_MODEL) - overhead - 2 * MAX_OUTPUT_TOKENS
+    if MAP_REDUCE_CHUNK_TOKENS:
+        budget = min(budget, MAP_REDUCE_CHUNK_TOKENS)
+    return budget
+
+
+def _report(on_progress: Optional[ProgressCallback], stage: str, done: int,
+            total: Optional[int]):
+    if on_progress is not None:
+        on_progress(stage, done, total)
+
+
+def _refine(question: str, chunks: Iterable[str], file_path: str,
+            cache: Optional[LLMCache], stats: Counter,
+            on_progress: Optional[ProgressCallback]=None) -> str:
+    """
+    Builds a running summary by visiting each chunk in order. Every
+    chunk waits on the summary produced for the previous one.
     """
-    Uses an LLM to analyze a body of text according to a question. Text
-    is split into chunks and analyzed using in-place map reduce.
+    summary = "[No summary (This is the first chunk) - Replace me]"
+    done = 0
+    for chunk in chunks:
+        inputs = {
+            "file_path": file_path,
+            "question": question,
+            "chunk": chunk,
+            "summary": summary
+        }
+        summary = _cached_batch(get_chain("summarize_chunk_chain"), "summarize_chunk",
+                                [inputs], cache, stats)[0]
+        done += 1
+        _report(on_progress, "refine", done, None)
+    _report(on_progress, "refine", done, done)
+    return summary
+
+
+def _map(question: str, chunks: Iterable[str], file_path: str,
+         max_concurrency: int, cache: Optional[LLMCache], stats: Counter,
+         on_progress: Optional[ProgressCallback]=None) -> List[str]:
+    """
+    Summarizes `chunks` concurrently as they are produced, so the first LLM call
+    goes out before the last chunk is read. At most `2 * max_concurrency` chunks
+    are held in memory at once. Summaries are returned in chunk order.
+    """
+    summaries = []
+    pending = deque()
+
+    def collect():
+        key, future = pending.popleft()
+        summary = future.result()
+        if key is not None:
+            cache.put(key, summary)
+        summaries.append(summary)
+        _report(on_progress, "map", len(summaries), total)
+
+    total = None
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for chunk in chunks:
+            if len(pending) >= 2 * max_concurrency:
+                collect()
+            inputs = {
+                "file_path": file_path,
+                "question": question,
+                "chunk": chunk
+            }
+            key = None
+            summary = None
+            if cache is not None:
+                key = _cache_key("map_chunk", inputs)
+                summary = cache.get(key)
+                stats["misses" if summary is None else "hits"] += 1
+
+            if summary is None:
+                # Copy the context so the token counting callback sees the call
+                future = executor.submit(contextvars.copy_context().run,
+                                         get_chain("map_chunk_chain").invoke, inputs)
+            else:
+                key = None
+                future = Future()
+                future.set_result(summary)
+            pending.append((key, future))
+
+        total = len(summaries) + len(pending)
+        while pending:
+            collect()
+    return summaries
+
+
+def _count_merges(n: int, reduce_fanout: int) -> int:
+    """
+    Returns the number of combine calls `_reduce` makes for `n` summaries.
+    """
+    merges = 0
+    while n > 1:
+        merges += n // reduce_fanout + (1 if n % reduce_fanout > 1 else 0)
+        n = math.ceil(n / reduce_fanout)
+    return merges
+
+
+def _reduce(question: str, summaries: List[str], file_path: str,
+            max_concurrency: int, reduce_fanout: int,
+            cache: Optional[LLMCache], stats: Counter,
+            on_progress: Optional[ProgressCallback]=None) -> str:
+    """
+    Merges the partial summaries `reduce_fanout` at a time
+    until one summary remains.
+    """
+    total = _count_merges(len(summaries), reduce_fanout)
+    done = 0
+    while len(summaries) > 1:
+        groups = [summaries[i:i + reduce_fanout]
+                  for i in range(0, len(summaries), reduce_fanout)]
+        # A trailing group of one has nothing to merge with
+        merged = _cached_batch(get_chain("combine_summaries_chain"), "combine_summaries", [{
+            "file_path": file_path,
+            "question": question,
+            "summaries": g
+        } for g in groups if len(g) > 1], cache, stats, max_concurrency)
+        done += len(merged)
+        _report(on_progress, "reduce", done, total)
+        if len(groups[-1]) == 1:
+            merged.append(groups[-1][0])
+        summaries = merged
+    return summaries[0]
+
+
+def _terms(text: str) -> List[str]:
+    """
+    Splits `text` into lowercase word terms without stopwords.
+    """
+    return [t for t in re.findall(r"[a-z0-9_]+", text.lower()) if t not in STOPWORDS]
+
+
+def is_selective(question: str) -> bool:
+    """
+    Checks whether `question` has any terms that could single out some chunks of a
+    file over others, unlike broad questions such as "summarize this file".
+    """
+    return any(t not in BROAD_TERMS for t in _terms(question))
+
+
+def prefilter_chunks(question: str, make_chunks: Callable[[], Iterable[str]],
+                     chunks: Iterator[str],
+                     min_chunks: int=PREFILTER_MIN_CHUNKS) -> Tuple[Iterator[str], int]:
+    """
+    Applies `filter_relevant_chunks` only where it can pay for its extra pass over the
+    file. `chunks` are passed through unchanged when the question is not selective or
+    the file has fewer than `min_chunks` chunks, so the first LLM call is not held up
+    by scoring and broad questions still see every chunk.
+
+    Args:
+        question (str): The question to rank chunks against.
+        make_chunks (Callable[[], Iterable[str]]): Returns a fresh iterable over the same chunks each time it is called.
+        chunks (Iterator[str]): An iterator over the chunks that is already being read.
+        min_chunks (int, optional): The number of chunks a file needs to be filtered.
+
+    Returns:
+        A Tuple of an `Iterator` over the kept chunks, in order, and the number of skipped chunks.
+    """
+    if not is_selective(question):
+        return chunks, 0
+    head = list(itertools.islice(chunks, min_chunks))
+    if len(head) < min_chunks:
+        return iter(head), 0
+    return filter_relevant_chunks(question, make_chunks)
+
+
+def filter_relevant_chunks(question: str, make_chunks: Callable[[], Iterable[str]],
+                           top_k: int=PREFILTER_TOP_K,
+                           min_score: float=PREFILTER_MIN_SCORE,
+                           neighbours: int=PREFILTER_NEIGHBOURS) -> Tuple[Iterator[str], int]:
+    """
+    Ranks chunks against `question` with BM25 and keeps only the `top_k` best chunks
+    scoring above `min_score`, along with `neighbours` chunks on either side of each
+    and the first chunk of the file. Scoring is done locally in a first pass over
+    `make_chunks()` that only keeps per-chunk counts of the question's terms, so the
+    chunks never need to be held in memory. If no chunk scores above `min_score`, the
+    question carries no lexical signal and every chunk is kept.
+
+    Args:
+        question (str): The question to rank chunks against.
+        make_chunks (Callable[[], Iterable[str]]): Returns a fresh iterable over the same chunks each time it is called.
+        top_k (int, optional): The maximum number of chunks selected by score.
+        min_score (float, optional): The score a chunk must exceed to be selected.
+        neighbours (int, optional): The number of adjacent chunks kept around each selected chunk.
+
+    Returns:
+        A Tuple of an `Iterator` over the kept chunks, in order, and the number of skipped chunks.
+    """
+    query = set(_terms(question)) - BROAD_TERMS
+    counts = []
+    lengths = []
+    for chunk in make_chunks():
+        terms = _terms(chunk)
+        lengths.append(len(terms))
+        counts.append(Counter(t for t in terms if t in query))
+
+    n = len(counts)
+    avg_length = sum(lengths) / n if n else 0
+    doc_freq = Counter(t for c in counts for t in c)
+    scores = []
+    for tf, length in zip(counts, lengths):
+        score = 0.0
+        for term, f in tf.items():
+            idf = math.log((n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5) + 1)
+            norm = 1 - BM25_B + BM25_B * length / avg_length if avg_length else 1
+            score += idf * f * (BM25_K1 + 1) / (f + BM25_K1 * norm)
+        scores.append(score)
+
+    ranked = [i for i in sorted(range(n), key=lambda i: -scores[i])
+              if scores[i] > min_score][:top_k]
+    if not ranked:
+        return iter(make_chunks()), 0
+
+    keep: Set[int] = {0}
+    for i in ranked:
+        keep.update(range(max(i - neighbours, 0), min(i + neighbours + 1, n)))
+    chunks = (c for i, c in enumerate(make_chunks()) if i in keep)
+    return chunks, n - len(keep)
+
+
+def chunks_qa_map_reduce(question: str, chunks: Iterable[str],
+                         file_path: str="unknown",
+                         strategy: str=MAP_REDUCE_STRATEGY,
+                         max_concurrency: int=MAP_REDUCE_MAX_CONCURRENCY,
+                         reduce_fanout: int=MAP_REDUCE_REDUCE_FANOUT,
+                         cache: LLMCache=None,
+                         on_progress: ProgressCallback=None) -> LLMResponse:
+    """
+    Uses an LLM to analyze pre-split chunks of text according to a question.
+    Chunks are consumed lazily, so they may be streamed from a file. Each chunk must
+    fit in the prompt (see `chunk_token_budget`). Chunks are analyzed with one of two strategies:
+
+    - `"refine"`: Chunks are visited one at a time, updating a running summary.
+    - `"map_reduce"`: Chunks are summarized concurrently and the partial summaries
+      are merged in a tree of depth log(`reduce_fanout`) of the number of chunks.
 
     Args:
         question (str): The question to ask.
-        text (str): The text to analyze.
+        chunks (Iterable[str]): The chunks of text to analyze.
         file_path (str, optional): The file path that the text originates from. Provides the LLM with additional context.
-        chunk_size (int, optional): The chunk size to use when splitting the text.
-        chunk_overlap (int, optional): The size of the overlap between chunks.
+        strategy (str, optional): Either `"refine"` or `"map_reduce"`. Defaults to the `llm.map_reduce.strategy` config.
+        max_concurrency (int, optional): The maximum number of concurrent LLM calls in the `"map_reduce"` strategy.
+        reduce_fanout (int, optional): The number of summaries merged by each reduce call in the `"map_reduce"` strategy.
+        cache (LLMCache, optional): A cache used to store and reuse the summaries produced for each chunk.
+        on_progress (ProgressCallback, optional): Called after each chunk and merge is summarized.
     
     Returns:
         An `LLMResponse` object containing the response from the LLM.
     
     Raises:
-        ValueError: If the `chunk_size` is not smaller than the length of `text`.
+        ValueError: If `chunks` is empty, `strategy` is unknown or `reduce_fanout` is less than 2.
     """
-    if len(text) <= chunk_size:
-        raise ValueError(f"The length of `text` must be greater than `chunk_size`. {len(text)} is not > {chunk_size}")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
-                                              chunk_overlap=chunk_overlap)
-    docs = splitter.split_text(text)
-    
+    if strategy not in (STRATEGY_REFINE, STRATEGY_MAP_REDUCE):
+        raise ValueError(f"Unknown strategy '{strategy}'. Expected '{STRATEGY_REFINE}' or '{STRATEGY_MAP_REDUCE}'")
+    if reduce_fanout < 2:
+        raise ValueError(f"`reduce_fanout` must be at least 2. Got {reduce_fanout}")
+
+    stats = Counter()
     with get_openai_callback() as cb:
-        summary = "[No summary (This is the first chunk) - Replace me]"
-        for doc in tqdm(docs, desc="Processing large file in chunks"):
-            inputs = {
-                "file_path": file_path,
-                "question": question,
-                "chunk": doc,
-                "summary": summary
-            }
-            summary = summarize_chunk_chain.invoke(inputs)
+        if strategy == STRATEGY_REFINE:
+            summary = _refine(question, chunks, file_path, cache, stats, on_progress)
+        else:
+            summaries = _map(question, chunks, file_path, max_concurrency, cache, stats,
+                             on_progress)
+            if not summaries:
+                raise ValueError("`chunks` must not be empty")
+            summary = _reduce(question, summaries, file_path,
+                              max_concurrency, reduce_fanout, cache, stats, on_progress)
     
-        output = read_summary_chain.invoke({
+        output = get_chain("read_summary_chain").invoke({
             "file_path": file_path,
             "question": question,
             "summary": summary
@@ -139,7 +632,63 @@ def text_qa_map_reduce(question: str, text: str,
         return LLMResponse(output=output,
                            model=LLM_MODEL,
                            input_tokens=cb.prompt_tokens,
-                           output_tokens=cb.completion_tokens)
+                           output_tokens=cb.completion_tokens,
+                           cache_hits=stats["hits"],
+                           cache_misses=stats["misses"])
+
+
+def text_qa_map_reduce(question: str, text: str,
+                       file_path: str="unknown",
+                       chunk_size: int=None,
+                       chunk_overlap: int=MAP_REDUCE_CHUNK_OVERLAP,
+                       strategy: str=MAP_REDUCE_STRATEGY,
+                       max_concurrency: int=MAP_REDUCE_MAX_CONCURRENCY,
+                       reduce_fanout: int=MAP_REDUCE_REDUCE_FANOUT,
+                       cache: LLMCache=None,
+                       prefilter: bool=PREFILTER_ENABLED,
+                       on_progress: ProgressCallback=None) -> LLMResponse:
+    """
+    Uses an LLM to analyze a body of text according to a question. Text is split
+    into chunks measured in `LLM_MODEL` tokens and analyzed with `chunks_qa_map_reduce`.
+    When `prefilter` is set, only the chunks selected by `prefilter_chunks` are analyzed.
+
+    Args:
+        question (str): The question to ask.
+        text (str): The text to analyze.
+        file_path (str, optional): The file path that the text originates from. Provides the LLM with additional context.
+        chunk_size (int, optional): The chunk size in tokens. Defaults to `chunk_token_budget`.
+        chunk_overlap (int, optional): The size of the overlap between chunks in tokens.
+        strategy (str, optional): Either `"refine"` or `"map_reduce"`. Defaults to the `llm.map_reduce.strategy` config.
+        max_concurrency (int, optional): The maximum number of concurrent LLM calls in the `"map_reduce"` strategy.
+        reduce_fanout (int, optional): The number of summaries merged by each reduce call in the `"map_reduce"` strategy.
+        cache (LLMCache, optional): A cache used to store and reuse the summaries produced for each chunk.
+        prefilter (bool, optional): Whether to skip chunks irrelevant to the question. Defaults to the `llm.prefilter.enabled` config.
+        on_progress (ProgressCallback, optional): Called after each chunk and merge is summarized.
+    
+    Returns:
+        An `LLMResponse` object containing the response from the LLM.
+    
+    Raises:
+        ValueError: If the `chunk_size` is not smaller than the number of tokens in `text`,
+                    `strategy` is unknown or `reduce_fanout` is less than 2.
+    """
+    if chunk_size is None:
+        chunk_size = chunk_token_budget(question, file_path)
+    n_tokens = count_tokens(text, LLM_MODEL)
+    if n_tokens <= chunk_size:
+        raise ValueError(f"The number of tokens in `text` must be greater than `chunk_size`. {n_tokens} is not > {chunk_size}")
+    make_chunks = lambda: iter_token_chunks([text], chunk_size, chunk_overlap, LLM_MODEL)
+    skipped = 0
+    if prefilter:
+        chunks, skipped = prefilter_chunks(question, make_chunks, make_chunks())
+    else:
+        chunks = make_chunks()
+    response = chunks_qa_map_reduce(question, chunks, file_path=file_path,
+                                    strategy=strategy, max_concurrency=max_concurrency,
+                                    reduce_fanout=reduce_fanout, cache=cache,
+                                    on_progress=on_progress)
+    response.skipped_chunks = skipped
+    return response
 
 
 """
@@ -162,16 +711,6 @@ qa_prompt = """
     """
 
 
-qa_chain = ({
-    "file_path": itemgetter("file_path"),
-    "question": itemgetter("question"),
-    "content": lambda x: "\n\n".join(x["content"])}
-    | PromptTemplate.from_template(qa_prompt)
-    | llm
-    | StrOutputParser()
-)
-
-
 def text_qa(question: str, text: str,
             file_path: str="unknown") -> LLMResponse:
     """
@@ -192,7 +731,7 @@ def text_qa(question: str, text: str,
     }
 
     with get_openai_callback() as cb:
-        output = qa_chain.invoke(inputs)
+        output = get_chain("qa_chain").invoke(inputs)
         return LLMResponse(output=output,
                            model=LLM_MODEL,
                            input_tokens=cb.prompt_tokens,
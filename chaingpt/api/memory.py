@@ -0,0 +1,175 @@
+# Standard lib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+import threading
+
+# 3rd party
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.pydantic_v1 import PrivateAttr
+
+# Local
+from chaingpt.api.llm import get_chain
+from chaingpt.api.tokens import count_tokens, iter_token_chunks
+from chaingpt.utils import config
+
+
+AGENT_MODEL = config.config["llm"]["agent_model"]
+MEMORY_BUDGET_TOKENS = config.config["llm"]["memory"]["budget_tokens"]
+TOOL_OUTPUT_TOKENS = config.config["llm"]["memory"]["tool_output_tokens"]
+MAX_STORED_OUTPUTS = config.config["llm"]["memory"]["max_stored_outputs"]
+
+HANDLE_PREFIX = "output-"
+
+
+def _format_turns(turns: List[Tuple[BaseMessage, BaseMessage]]) -> str:
+    return "\n\n".join(f"Engineer: {human.content}\nAssistant: {ai.content}"
+                       for human, ai in turns)
+
+
+def _summarize(summary: str, turns: List[Tuple[BaseMessage, BaseMessage]]) -> str:
+    return get_chain("summarize_conversation_chain").invoke({"summary": summary or "(empty)",
+                                                "turns": _format_turns(turns)})
+
+
+class TokenBudgetMemory(BaseMemory):
+    """
+    Conversation memory that replays at most `budget_tokens` tokens of recent turns
+    verbatim. Older turns are folded into a rolling summary by `summarize` on a
+    background thread, so answering is never blocked on summarization. Until a turn
+    is folded in, it is still replayed verbatim.
+    """
+    memory_key: str = "chat_history"
+    budget_tokens: int = MEMORY_BUDGET_TOKENS
+    model: str = AGENT_MODEL  # Whose tokenizer counts the budget
+    summarize: Callable[[str, List[Tuple[BaseMessage, BaseMessage]]], str] = _summarize
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _turns: List[Tuple[BaseMessage, BaseMessage, int]] = PrivateAttr(default_factory=list)
+    _evicted: List[Tuple[BaseMessage, BaseMessage]] = PrivateAttr(default_factory=list)
+    _summary: str = PrivateAttr(default="")
+    _workers: Any = PrivateAttr(default=None)
+    _future: Optional[Future] = PrivateAttr(default=None)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def summary(self) -> str:
+        with self._lock:
+            return self._summary
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, List[BaseMessage]]:
+        with self._lock:
+            messages = []
+            if self._summary:
+                messages.append(SystemMessage(
+                    content=f"Summary of the earlier conversation:\n{self._summary}"))
+            for human, ai in self._evicted:
+                messages += [human, ai]
+            for human, ai, _ in self._turns:
+                messages += [human, ai]
+        return {self.memory_key: messages}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]):
+        human = HumanMessage(content=inputs["input"])
+        ai = AIMessage(content=outputs["output"])
+        tokens = count_tokens(human.content, self.model) + count_tokens(ai.content, self.model)
+        with self._lock:
+            self._turns.append((human, ai, tokens))
+            total = sum(n for _, _, n in self._turns)
+            # The latest turn is always kept, even when it alone exceeds the budget
+            while total > self.budget_tokens and len(self._turns) > 1:
+                human, ai, n = self._turns.pop(0)
+                self._evicted.append((human, ai))
+                total -= n
+            if self._evicted and (self._future is None or self._future.done()):
+                if self._workers is None:
+                    self._workers = ThreadPoolExecutor(max_workers=1,
+                                                       thread_name_prefix="memory")
+                self._future = self._workers.submit(self._fold)
+
+    def _fold(self):
+        """
+        Folds the evicted turns into the summary until none are left.
+        """
+        while True:
+            with self._lock:
+                summary = self._summary
+                turns = list(self._evicted)
+            if not turns:
+                return
+            # Left for the next turn to retry if this fails
+            summary = self.summarize(summary, turns)
+            with self._lock:
+                self._summary = summary
+                del self._evicted[:len(turns)]
+
+    def wait(self):
+        """
+        Blocks until the evicted turns are folded into the summary.
+        """
+        future = self._future
+        if future is not None:
+            future.result()
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._evicted.clear()
+            self._summary = ""
+
+
+class OutputStore():
+    """
+    Keeps large tool outputs out of the agent's prompt. Outputs longer than
+    `preview_tokens` tokens are stored under a handle and replaced by their first
+    `preview_tokens` tokens, so the agent can page through the rest with `read`.
+    The oldest of more than `max_outputs` outputs are dropped.
+    """
+    def __init__(self, preview_tokens: int=TOOL_OUTPUT_TOKENS,
+                 max_outputs: int=MAX_STORED_OUTPUTS, model: str=AGENT_MODEL):
+        if preview_tokens <= 0:
+            raise ValueError(f"`preview_tokens` must be positive. Got {preview_tokens}")
+        self.preview_tokens = preview_tokens
+        self.max_outputs = max_outputs
+        self.model = model
+        self._outputs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def offload(self, text: str) -> str:
+        """
+        Returns `text` unchanged if it is short. Otherwise stores it and returns its
+        first page followed by a note with its handle.
+        """
+        if count_tokens(text, self.model) <= self.preview_tokens:
+            return text
+        # Pages end on line boundaries where possible
+        pages = list(iter_token_chunks([text], self.preview_tokens, 0, self.model))
+        with self._lock:
+            handle = f"{HANDLE_PREFIX}{next(self._ids)}"
+            self._outputs[handle] = pages
+            while len(self._outputs) > self.max_outputs:
+                self._outputs.popitem(last=False)
+        return (f"{pages[0]}\n[Output truncated after page 1 of {len(pages)}. "
+                f"Call read_output with handle \"{handle}\" and a page number to read more.]")
+
+    def read(self, handle: str, page: int) -> str:
+        """
+        Returns page `page` (starting at 1) of the output stored under `handle`.
+
+        Raises:
+            KeyError: If `handle` is unknown or was dropped.
+            ValueError: If `page` is out of range.
+        """
+        with self._lock:
+            pages = self._outputs.get(handle)
+        if pages is None:
+            raise KeyError(f"No stored output with handle {handle}")
+        if not 1 <= page <= len(pages):
+            raise ValueError(f"`page` must be between 1 and {len(pages)}. Got {page}")
+        return f"{pages[page - 1]}\n[Page {page} of {len(pages)}]"
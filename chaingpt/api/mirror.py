@@ -0,0 +1,259 @@
+# Standard lib
+from typing import Callable, Iterable
+from contextlib import contextmanager
+import os
+import fcntl
+import shutil
+import stat
+import hashlib
+import tempfile
+
+# 3rd party
+from sh import git, ErrorReturnCode
+
+# Local
+
+
+MIRRORS_DIR_NAME = "mirrors"
+BASES_DIR_NAME = "bases"
+
+
+def _cache_name(url: str) -> str:
+    """
+    Returns the name `url` is cached under. The repository name is kept for
+    readability and a hash of the URL keeps repositories with the same name apart.
+    """
+    name = os.path.basename(url.rstrip("/"))
+    if name.endswith(".git"):
+        name = name[:-4]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return f"{name}-{digest}"
+
+
+def mirror_path(url: str, cache_dir: str) -> str:
+    """
+    Returns the path of the bare mirror of `url` inside `cache_dir`.
+    """
+    return os.path.join(cache_dir, MIRRORS_DIR_NAME, f"{_cache_name(url)}.git")
+
+
+def bases_path(url: str, cache_dir: str) -> str:
+    """
+    Returns the directory holding the base checkouts of `url` inside
+    `cache_dir`, one per commit.
+    """
+    return os.path.join(cache_dir, BASES_DIR_NAME, _cache_name(url))
+
+
+@contextmanager
+def _locked(path: str, exclusive: bool):
+    """
+    Holds an advisory file lock next to `path` for the duration of the
+    context. Locks are shared between processes on the same host.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def update_mirror(url: str, cache_dir: str) -> str:
+    """
+    Creates a bare mirror of `url` in `cache_dir` on first use and fetches
+    new commits into it on later uses.
+
+    Args:
+        url (str): The repository URL.
+        cache_dir (str): The directory holding the mirrors.
+
+    Returns:
+        The path of the mirror.
+
+    Raises:
+        ValueError: If `url` cannot be cloned.
+    """
+    path = mirror_path(url, cache_dir)
+    with _locked(path, exclusive=True):
+        if os.path.exists(path):
+            try:
+                git("--git-dir", path, "fetch", "--prune", "--quiet", "origin")
+                return path
+            except ErrorReturnCode:
+                # A broken mirror is recreated below
+                shutil.rmtree(path)
+
+        # Clone next to the final location and rename so a failed
+        # clone never leaves a partial mirror behind
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            git.clone("--mirror", "--quiet", url, tmp_path)
+            os.rename(tmp_path, path)
+        except ErrorReturnCode:
+            raise ValueError(f"Error cloning {url}. Is the URL valid?")
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+    return path
+
+
+def clone_from_mirror(url: str, dest: str, cache_dir: str):
+    """
+    Clones `url` into `dest` using the mirror in `cache_dir`. The mirror is
+    created or updated first, then the working copy is cloned locally from it,
+    which hardlinks the object files instead of downloading them again. The
+    `origin` remote of the working copy points at `url`.
+
+    Args:
+        url (str): The repository URL.
+        dest (str): The directory to clone into.
+        cache_dir (str): The directory holding the mirrors.
+
+    Raises:
+        ValueError: If `url` cannot be cloned.
+    """
+    path = update_mirror(url, cache_dir)
+    # A shared lock keeps fetches from rewriting the mirror mid-clone
+    with _locked(path, exclusive=False):
+        git.clone("--quiet", path, dest)
+    git("-C", dest, "remote", "set-url", "origin", url)
+
+
+def _is_shared(base: str, path: str) -> bool:
+    """
+    Returns whether `path` in the base checkout `base` is hardlinked into the checkouts
+    made from it. Git updates its metadata in place, so of the `.git` directory only
+    the objects, which never change, are shared.
+    """
+    rel_path = os.path.relpath(path, base)
+    return rel_path.split(os.sep)[0] != ".git" or \
+        rel_path.startswith(os.path.join(".git", "objects") + os.sep)
+
+
+def _make_read_only(base: str):
+    """
+    Removes the write permission of the shared files under `base`. Directories stay
+    writable so that checkouts linked to the files can add and replace files.
+    """
+    for dir_path, _, file_names in os.walk(base):
+        for name in file_names:
+            file_path = os.path.join(dir_path, name)
+            if not os.path.islink(file_path) and _is_shared(base, file_path):
+                mode = os.stat(file_path).st_mode
+                os.chmod(file_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _create_base(url: str, mirror: str, commit: str, base: str):
+    """
+    Checks out `commit` from `mirror` into `base` and makes its shared files read-only.
+    """
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(base), prefix=".tmp-")
+    try:
+        with _locked(mirror, exclusive=False):
+            git.clone("--quiet", mirror, tmp_path)
+        git("-C", tmp_path, "reset", "--hard", "--quiet", commit)
+        git("-C", tmp_path, "remote", "set-url", "origin", url)
+        _make_read_only(tmp_path)
+        os.rename(tmp_path, base)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+def link_checkout(url: str, dest: str, cache_dir: str):
+    """
+    Checks out `url` into `dest` as a farm of hardlinks to a read-only base
+    checkout in `cache_dir`. Checkouts of the same commit share one base, so
+    each costs only its directories, its git metadata and the files it replaces,
+    and takes no longer to create than linking its files. The base of the mirror's latest
+    commit is created on first use and the bases of older commits are removed.
+    Checkouts made from them keep their files, which are shared until the
+    last link goes away.
+
+    Linked files are read-only. Files must be replaced rather than modified in
+    place, as git does, or given their own copy with `unshare` first. Permissions do
+    not stop a root process from writing through a link into the base and every
+    checkout of it, so root must `unshare` a file before writing to it as well.
+    Scripts run by `chaingpt.api.system` get an archived copy of the checkout and
+    never see the links. When `dest`
+    is on another filesystem than `cache_dir`, `url` is cloned with
+    `clone_from_mirror` instead.
+
+    Args:
+        url (str): The repository URL.
+        dest (str): The directory to check out into.
+        cache_dir (str): The directory holding the mirrors and base checkouts.
+
+    Raises:
+        ValueError: If `url` cannot be cloned.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.stat(cache_dir).st_dev != os.stat(os.path.dirname(dest)).st_dev:
+        clone_from_mirror(url, dest, cache_dir)
+        return
+
+    mirror = update_mirror(url, cache_dir)
+    with _locked(mirror, exclusive=False):
+        commit = str(git("--git-dir", mirror, "rev-parse", "HEAD")).strip()
+    bases = bases_path(url, cache_dir)
+    base = os.path.join(bases, commit)
+    os.makedirs(bases, exist_ok=True)
+    with _locked(bases, exclusive=True):
+        if not os.path.exists(base):
+            _create_base(url, mirror, commit, base)
+            for name in os.listdir(bases):
+                if name != commit:
+                    shutil.rmtree(os.path.join(bases, name), ignore_errors=True)
+        def link_or_copy(src: str, dst: str):
+            if _is_shared(base, src):
+                os.link(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        shutil.copytree(base, dest, symlinks=True, copy_function=link_or_copy)
+
+
+def prune(cache_dir: str, live_urls: Callable[[], Iterable[str]]):
+    """
+    Removes the mirrors and base checkouts in `cache_dir` of the repositories not
+    returned by `live_urls`. Each is removed under its own lock and `live_urls` is
+    called after the lock is taken, so a URL that becomes live meanwhile is either
+    kept or cloned again by `update_mirror` and `link_checkout` once the lock is free.
+    Checkouts linked to a removed base keep their files.
+
+    Args:
+        cache_dir (str): The directory holding the mirrors and base checkouts.
+        live_urls (Callable): Returns the URLs of the repositories still in use.
+    """
+    for dir_name, suffix in ((MIRRORS_DIR_NAME, ".git"), (BASES_DIR_NAME, "")):
+        parent = os.path.join(cache_dir, dir_name)
+        if not os.path.isdir(parent):
+            continue
+        for name in os.listdir(parent):
+            # Skips lock files and the clones still being created
+            if name.startswith(".") or name.endswith(".lock") or not name.endswith(suffix):
+                continue
+            path = os.path.join(parent, name)
+            with _locked(path, exclusive=True):
+                if name[:len(name) - len(suffix)] in {_cache_name(url) for url in live_urls()}:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def unshare(path: str):
+    """
+    Replaces a file linked to a base checkout with a writable copy of
+    its own, so that it can be modified in place. Does nothing to files
+    that are not shared.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode) or st.st_nlink == 1:
+        return
+    tmp_path = f"{path}.unshare-{os.getpid()}"
+    shutil.copyfile(path, tmp_path)
+    os.chmod(tmp_path, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+    os.replace(tmp_path, path)
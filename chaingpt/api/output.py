@@ -0,0 +1,75 @@
+# Standard lib
+from collections import deque
+import codecs
+
+# 3rd party
+
+# Local
+
+
+class OutputBuffer():
+    """
+    Captures a stream of bytes as text in bounded memory. Only the first
+    `head_chars` and the last `tail_chars` characters are kept. Multibyte
+    characters split across writes are decoded correctly.
+
+    total_chars (int): The number of characters written so far.
+    """
+    def __init__(self, head_chars: int, tail_chars: int):
+        if head_chars < 0 or tail_chars < 0:
+            raise ValueError("`head_chars` and `tail_chars` must not be negative")
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.total_chars = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._head = []
+        self._head_len = 0
+        self._tail = deque()
+        self._tail_len = 0
+
+    def _append(self, text: str):
+        self.total_chars += len(text)
+        if self._head_len < self.head_chars:
+            kept = text[:self.head_chars - self._head_len]
+            self._head.append(kept)
+            self._head_len += len(kept)
+            text = text[len(kept):]
+        if not text or self.tail_chars == 0:
+            return
+        text = text[-self.tail_chars:]
+        self._tail.append(text)
+        self._tail_len += len(text)
+        # Drop whole chunks once the rest still covers the tail window
+        while self._tail_len - len(self._tail[0]) >= self.tail_chars:
+            self._tail_len -= len(self._tail.popleft())
+
+    def write(self, data: bytes) -> str:
+        """
+        Decodes and captures `data`. Returns the decoded text, which may end
+        before a multibyte character that is completed by the next write.
+        """
+        text = self._decoder.decode(data)
+        self._append(text)
+        return text
+
+    def close(self) -> str:
+        """
+        Flushes the decoder. Returns any text left in it.
+        """
+        text = self._decoder.decode(b"", final=True)
+        self._append(text)
+        return text
+
+    @property
+    def omitted_chars(self) -> int:
+        return self.total_chars - self._head_len - min(self._tail_len, self.tail_chars)
+
+    def getvalue(self) -> str:
+        """
+        Returns the captured text. Omitted characters are replaced by a marker.
+        """
+        head = "".join(self._head)
+        tail = "".join(self._tail)[-self.tail_chars:] if self.tail_chars else ""
+        if self.omitted_chars:
+            return f"{head}\n[... {self.omitted_chars} characters omitted ...]\n{tail}"
+        return head + tail
@@ -0,0 +1,252 @@
+# Standard lib
+from typing import Iterable, List, Optional, Pattern, Tuple
+from collections import Counter
+import os
+import posixpath
+import re
+import bisect
+import threading
+
+# 3rd party
+from sh import git
+
+# Local
+
+
+MAGIC_CHARS = "*?["
+
+
+def _has_magic(pattern: str) -> bool:
+    return any(c in pattern for c in MAGIC_CHARS)
+
+
+def _literal_prefix(pattern: str) -> str:
+    """
+    Returns the part of `pattern` before its first wildcard.
+    """
+    for i, c in enumerate(pattern):
+        if c in MAGIC_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def _translate_component(component: str) -> str:
+    """
+    Translates a single glob path component into a regex that never
+    crosses a `/`. As with `glob.glob`, wildcards do not match names starting
+    with `.` unless the component itself starts with `.`.
+    """
+    regex = ""
+    i = 0
+    while i < len(component):
+        c = component[i]
+        i += 1
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = component.find("]", i + 1 if component[i:i + 1] in ("!", "]") else i)
+            if end == -1:
+                regex += re.escape(c)
+                continue
+            body = component[i:end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex += f"[{body}]"
+            i = end + 1
+        else:
+            regex += re.escape(c)
+    if _has_magic(component) and not component.startswith("."):
+        regex = r"(?!\.)" + regex
+    return regex
+
+
+def compile_glob(pattern: str) -> Pattern:
+    """
+    Compiles a glob `pattern` relative to the repository root into a regex
+    matching paths with the semantics of `glob.glob(..., recursive=True)`.
+    A `**` component matches any number of nested directories. A trailing
+    `**` also matches the directory it follows.
+    """
+    components = pattern.split("/")
+    regex = ""
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+        if component == "**":
+            # Hidden directories are skipped, as with glob.glob
+            if not last:
+                regex += r"(?:[^/.][^/]*/)*"
+            elif i == 0:
+                regex += r"[^/.][^/]*(?:/[^/.][^/]*)*"
+            else:
+                regex = regex[:-1] + r"(?:/[^/.][^/]*)*"
+        else:
+            regex += _translate_component(component) + ("" if last else "/")
+    return re.compile(regex)
+
+
+def _normalize(pattern: str) -> Tuple[str, bool]:
+    """
+    Normalizes a path or pattern like `os.path.normpath`, so the root is `.`.
+    Returns it along with whether it only matches directories, which is
+    the case when it ends with `/`.
+    """
+    return posixpath.normpath(pattern), pattern.endswith("/")
+
+
+def _parents(path: str) -> Iterable[str]:
+    """
+    Yields every parent directory of `path`, excluding the root.
+    """
+    parent = os.path.dirname(path)
+    while parent:
+        yield parent
+        parent = os.path.dirname(parent)
+
+
+class PathIndex():
+    """
+    An in-memory index of the files and directories of a git working tree.
+    Paths are kept in one sorted list so that glob patterns only scan the
+    range of paths sharing their literal prefix. The index is built from
+    `git ls-files`, so the `.git` directory is never walked.
+
+    The index rebuilds itself when the git index changes (e.g. after a checkout
+    or a pull). Files created or deleted outside of git should be reported
+    with `refresh`. Safe to share between threads.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._paths: List[str] = []
+        self._files = set()
+        self._dir_counts = Counter()
+        self._signature = None
+        self.refresh()
+
+    def _git_signature(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns a cheap fingerprint of the git index file, which
+        git rewrites whenever tracked files change.
+        """
+        try:
+            st = os.stat(os.path.join(self.root, ".git", "index"))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _add(self, path: str):
+        if path in self._files or path in self._dir_counts:
+            return
+        self._files.add(path)
+        bisect.insort(self._paths, path)
+        for parent in _parents(path):
+            if self._dir_counts[parent] == 0:
+                bisect.insort(self._paths, parent)
+            self._dir_counts[parent] += 1
+
+    def _remove(self, path: str):
+        if path not in self._files:
+            return
+        self._files.remove(path)
+        del self._paths[bisect.bisect_left(self._paths, path)]
+        for parent in _parents(path):
+            self._dir_counts[parent] -= 1
+            if self._dir_counts[parent] == 0:
+                del self._dir_counts[parent]
+                del self._paths[bisect.bisect_left(self._paths, parent)]
+
+    def refresh(self, paths: Iterable[str]=None):
+        """
+        Updates the index. With `paths`, only those files are checked against
+        the working tree and added or removed. Otherwise the index is rebuilt
+        from `git ls-files`, including untracked files.
+
+        Args:
+            paths (Iterable[str], optional): Paths relative to the root that changed.
+        """
+        with self._lock:
+            self._refresh(paths)
+
+    def _refresh(self, paths: Optional[Iterable[str]]):
+        """
+        Updates the index as described in `refresh`. Must hold `_lock`.
+        """
+        if paths is not None:
+            for path in paths:
+                path, _ = _normalize(path)
+                full_path = os.path.join(self.root, path)
+                if os.path.isfile(full_path) or os.path.islink(full_path):
+                    self._add(path)
+                else:
+                    self._remove(path)
+            return
+
+        self._signature = self._git_signature()
+        output = git("-C", self.root, "ls-files", "-z", "--cached", "--others")
+        files = set(p for p in str(output).split("\0") if p)
+        dir_counts = Counter(parent for path in files for parent in _parents(path))
+        self._files = files
+        self._dir_counts = dir_counts
+        self._paths = sorted(files.union(dir_counts))
+
+    def files(self) -> List[str]:
+        """
+        Returns the sorted paths of every indexed file.
+        """
+        with self._lock:
+            return sorted(self._files)
+
+    def search(self, pattern: str) -> Tuple[List[str], List[str]]:
+        """
+        Searches the index for files and directories matching the glob `pattern`.
+
+        Args:
+            pattern (str): The glob pattern, relative to the root.
+
+        Returns:
+            A Tuple of two sorted `List` objects. The first `List` contains the directory
+            names. The second `List` contains the file names.
+        """
+        pattern, dirs_only = _normalize(pattern)
+        with self._lock:
+            if self._git_signature() != self._signature:
+                self._refresh(None)
+            dirs, files = self._search(pattern)
+        return dirs, [] if dirs_only else files
+
+    def _search(self, pattern: str) -> Tuple[List[str], List[str]]:
+        """
+        Searches for a normalized `pattern`. Must hold `_lock`.
+        """
+        if pattern == ".":
+            return ["."], []
+        if not _has_magic(pattern):
+            if pattern in self._dir_counts:
+                return [pattern], []
+            if pattern in self._files:
+                return [], [pattern]
+            return [], []
+
+        regex = compile_glob(pattern)
+        # A trailing `**` matches the directory before it, which lacks the final `/`
+        prefix = _literal_prefix(pattern).rstrip("/")
+        parent = compile_glob(pattern[:-3]) if pattern.endswith("/**") else None
+        dirs = []
+        files = []
+        for i in range(bisect.bisect_left(self._paths, prefix), len(self._paths)):
+            path = self._paths[i]
+            if not path.startswith(prefix):
+                break
+            if not regex.fullmatch(path):
+                continue
+            if path in self._dir_counts:
+                dirs.append(path)
+            elif parent is None or not parent.fullmatch(path):
+                # Only a directory can stand in for the part before the `/**`
+                files.append(path)
+        if pattern == "**":
+            # As with the `/**` of other patterns, the directory itself matches
+            dirs.insert(0, ".")
+        return dirs, files
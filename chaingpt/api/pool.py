@@ -0,0 +1,398 @@
+# Standard lib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+import abc
+import time
+import threading
+
+# 3rd party
+
+# Local
+
+
+STDOUT = 1
+STDERR = 2
+
+POLICY_WAIT = "wait"
+POLICY_FAIL = "fail"
+POLICY_OVERFLOW = "overflow"
+POLICIES = (POLICY_WAIT, POLICY_FAIL, POLICY_OVERFLOW)
+
+
+class PoolExhaustedError(RuntimeError):
+    pass
+
+
+@dataclass
+class PooledContainer:
+    id: str
+    created_at: float
+    uses: int = 0
+
+
+@dataclass
+class PoolStats:
+    idle: int
+    total: int
+    created: int
+    reused: int
+    discarded: int
+    waited: int
+
+
+class ContainerBackend(abc.ABC):
+    """
+    The container runtime behind a `ContainerPool`. Containers are created
+    idle and scripts are executed inside them.
+    """
+    @abc.abstractmethod
+    def create(self) -> str:
+        """
+        Starts a new idle container and returns its ID.
+        """
+
+    @abc.abstractmethod
+    def exec(self, container_id: str, cmd: List[str],
+             workdir: Optional[str]=None) -> Tuple[str, Iterator[Tuple[int, bytes]]]:
+        """
+        Runs `cmd` in the container. Returns an ID for the run and an `Iterator`
+        over its output as `(stream, data)` pairs, where stream is `STDOUT` or `STDERR`.
+        """
+
+    @abc.abstractmethod
+    def exit_code(self, exec_id: str) -> Optional[int]:
+        """
+        Returns the exit code of a finished `exec` run.
+        """
+
+    @abc.abstractmethod
+    def copy_in(self, container_id: str, archive_path: str):
+        """
+        Extracts the tar archive at `archive_path` into the root of the container.
+        """
+
+    @abc.abstractmethod
+    def is_healthy(self, container_id: str) -> bool:
+        """
+        Returns whether the container is still running and usable.
+        """
+
+    @abc.abstractmethod
+    def remove(self, container_id: str):
+        """
+        Stops and deletes the container.
+        """
+
+
+class ContainerPool():
+    """
+    Keeps up to `size` started containers ready so that scripts skip container
+    creation. Containers are checked for health and age when they are leased.
+    With `recycle`, a container is discarded after each use and replaced in the
+    background, so scripts never see each other's side effects.
+
+    When every container is leased, `policy` decides what happens: `wait` blocks
+    for up to `acquire_timeout` seconds, `fail` raises a `PoolExhaustedError`
+    right away and `overflow` creates a temporary container outside the pool.
+    """
+    def __init__(self, backend: ContainerBackend, size: int, ttl: Optional[float]=None,
+                 recycle: bool=True, policy: str=POLICY_WAIT,
+                 acquire_timeout: Optional[float]=None):
+        if size < 1:
+            raise ValueError(f"`size` must be positive. Got {size}")
+        if policy not in POLICIES:
+            raise ValueError(f"`policy` must be one of {POLICIES}. Got {policy}")
+        self.backend = backend
+        self.size = size
+        self.ttl = ttl
+        self.recycle = recycle
+        self.policy = policy
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._count = 0  # Containers idle, leased or being created
+        self._closed = False
+        self._workers = ThreadPoolExecutor(max_workers=size,
+                                           thread_name_prefix="container-pool")
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._waited = 0
+
+    def start(self):
+        """
+        Creates containers in the background until the pool is full.
+        """
+        with self._cond:
+            missing = self.size - self._count
+            self._count += missing
+        for _ in range(missing):
+            self._submit(self._fill)
+
+    def _create(self) -> PooledContainer:
+        container = PooledContainer(self.backend.create(), time.monotonic())
+        with self._cond:
+            self._created += 1
+        return container
+
+    def _fill(self):
+        """
+        Creates one container for a slot that was already counted.
+        """
+        try:
+            container = self._create()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append(container)
+                self._cond.notify()
+                return
+            self._count -= 1
+        self.backend.remove(container.id)
+
+    def _submit(self, fn, *args):
+        """
+        Runs `fn` on a worker thread, or right away once the pool is shut down.
+        """
+        try:
+            self._workers.submit(fn, *args)
+        except RuntimeError:
+            fn(*args)
+
+    def _discard(self, container: PooledContainer, refill: bool):
+        """
+        Removes `container` in the background. With `refill`, its slot is
+        kept and filled by a new container, otherwise the slot is freed.
+        """
+        with self._cond:
+            self._discarded += 1
+            if not refill or self._closed:
+                self._count -= 1
+                refill = False
+                self._cond.notify()
+
+        def run():
+            self.backend.remove(container.id)
+            if refill:
+                self._fill()
+        self._submit(run)
+
+    def _expired(self, container: PooledContainer) -> bool:
+        return self.ttl is not None and time.monotonic() - container.created_at > self.ttl
+
+    def _acquire(self) -> Tuple[PooledContainer, bool]:
+        """
+        Returns a ready container and whether it is an overflow container.
+        """
+        deadline = None if self.acquire_timeout is None \
+            else time.monotonic() + self.acquire_timeout
+        waited = False
+        while True:
+            container = None
+            overflow = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("The container pool is closed")
+                    if self._idle:
+                        container = self._idle.popleft()
+                        break
+                    if self._count < self.size:
+                        self._count += 1
+                        break
+                    if self.policy == POLICY_FAIL:
+                        raise PoolExhaustedError(f"All {self.size} containers are in use")
+                    if self.policy == POLICY_OVERFLOW:
+                        overflow = True
+                        break
+                    if not waited:
+                        self._waited += 1
+                        waited = True
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhaustedError(f"No container became available within "
+                                                 f"{self.acquire_timeout} seconds")
+                    self._cond.wait(remaining)
+
+            if overflow:
+                return self._create(), True
+            if container is None:
+                # A slot was reserved above, so create the container on the spot
+                try:
+                    return self._create(), False
+                except Exception:
+                    with self._cond:
+                        self._count -= 1
+                        self._cond.notify()
+                    raise
+            if not self._expired(container) and self.backend.is_healthy(container.id):
+                with self._cond:
+                    self._reused += 1
+                return container, False
+            self._discard(container, refill=False)
+
+    def _release(self, container: PooledContainer, overflow: bool):
+        if overflow:
+            self._submit(self.backend.remove, container.id)
+            return
+        if self.recycle or self._expired(container):
+            self._discard(container, refill=True)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append(container)
+                self._cond.notify()
+                return
+        self._discard(container, refill=False)
+
+    @contextmanager
+    def lease(self) -> Iterator[PooledContainer]:
+        """
+        Leases a ready container for the duration of the context.
+
+        Returns:
+            A context manager yielding a `PooledContainer`.
+
+        Raises:
+            PoolExhaustedError: If no container is available under the pool's policy.
+        """
+        container, overflow = self._acquire()
+        container.uses += 1
+        try:
+            yield container
+        finally:
+            self._release(container, overflow)
+
+    def stats(self) -> PoolStats:
+        """
+        Returns counters describing the pool's state and history.
+        """
+        with self._cond:
+            return PoolStats(idle=len(self._idle), total=self._count, created=self._created,
+                             reused=self._reused, discarded=self._discarded,
+                             waited=self._waited)
+
+    def close(self):
+        """
+        Removes the idle containers. Leased containers are removed when released.
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._count -= len(idle)
+            self._cond.notify_all()
+        for container in idle:
+            self.backend.remove(container.id)
+        self._workers.shutdown(wait=True)
+
+
+class PoolGroup():
+    """
+    Lazily creates and starts one `ContainerPool` per image with `make_pool`. With
+    `max_pools`, the least recently used pools beyond `max_pools` are closed, not
+    counting those of the `pinned` images. Pools in use are closed once released.
+    """
+    def __init__(self, make_pool: Callable[[str], ContainerPool],
+                 max_pools: Optional[int]=None, pinned: Iterable[str]=()):
+        if max_pools is not None and max_pools < 1:
+            raise ValueError(f"`max_pools` must be positive. Got {max_pools}")
+        self.make_pool = make_pool
+        self.max_pools = max_pools
+        self.pinned = frozenset(pinned)
+        self._pools: Dict[str, ContainerPool] = OrderedDict()
+        self._users = Counter()
+        self._lock = threading.Lock()
+
+    def _get(self, image: str) -> ContainerPool:
+        """
+        Returns the pool of `image`, creating it on first use, and marks it as the
+        most recently used. Must hold `_lock`.
+        """
+        pool = self._pools.get(image)
+        if pool is None:
+            pool = self.make_pool(image)
+            pool.start()
+            self._pools[image] = pool
+        self._pools.move_to_end(image)
+        return pool
+
+    def _trim(self, keep: str) -> List[ContainerPool]:
+        """
+        Removes the least recently used pools beyond `max_pools`, apart from `keep`
+        and those in use. Must hold `_lock`.
+        """
+        if self.max_pools is None:
+            return []
+        removed = []
+        excess = sum(image not in self.pinned for image in self._pools) - self.max_pools
+        for image in list(self._pools):
+            if excess <= 0:
+                break
+            if image == keep or image in self.pinned or self._users[image] > 0:
+                continue
+            removed.append(self._pools.pop(image))
+            excess -= 1
+        return removed
+
+    def get(self, image: str) -> ContainerPool:
+        """
+        Returns the pool of `image`, creating it on first use. The pool may be
+        closed by later calls, so use `use` to lease containers from it.
+        """
+        with self._lock:
+            pool = self._get(image)
+            removed = self._trim(keep=image)
+        for other in removed:
+            other.close()
+        return pool
+
+    @contextmanager
+    def use(self, image: str) -> Iterator[ContainerPool]:
+        """
+        Holds the pool of `image`, creating it on first use. The pool
+        is not closed to make room for others while it is held.
+
+        Returns:
+            A context manager yielding the `ContainerPool` of `image`.
+        """
+        with self._lock:
+            pool = self._get(image)
+            self._users[image] += 1
+            removed = self._trim(keep=image)
+        for other in removed:
+            other.close()
+        try:
+            yield pool
+        finally:
+            with self._lock:
+                self._users[image] -= 1
+                if self._users[image] == 0:
+                    del self._users[image]
+                removed = self._trim(keep=None)
+            for other in removed:
+                other.close()
+
+    def close(self, image: str):
+        """
+        Closes the pool of `image`, if there is one.
+        """
+        with self._lock:
+            pool = self._pools.pop(image, None)
+        if pool is not None:
+            pool.close()
+
+    def close_all(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
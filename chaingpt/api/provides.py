@@ -0,0 +1,157 @@
+# Standard lib
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, asdict
+import os
+import re
+import json
+
+# 3rd party
+
+# Local
+
+
+FORMAT_VERSION = 1
+VIRTUAL_PREFIXES = ("cmd:", "so:", "pc:", "py3:")
+
+
+@dataclass
+class PackageDefinition:
+    """
+    The parts of a melange YAML file needed to resolve package names.
+    `provides` maps the package and each subpackage to the virtual
+    names (e.g. `cmd:make`, `so:libssl.so.3`) it declares.
+    """
+    name: str
+    description: str
+    version: str
+    subpackages: List[str]
+    provides: Dict[str, List[str]]
+
+
+@dataclass
+class ProvidedPackage:
+    name: str
+    version: str
+    origin: str  # The package whose melange file builds this package
+
+
+def strip_constraint(name: str) -> Tuple[str, str]:
+    """
+    Splits an apk dependency like `python-3.12>=3.12.1` into the
+    package name and its version constraint.
+    """
+    match = re.search(r"[=<>~]", name)
+    if match is None:
+        return name, ""
+    return name[:match.start()], name[match.start():]
+
+
+class ProvidesIndex():
+    """
+    A reverse index from installable package names, subpackage names and
+    provided virtual names to the Wolfi packages behind them. The definitions
+    are stored per package file in a JSON file so that single files can be
+    replaced during incremental index updates. The reverse index is rebuilt
+    in memory on load.
+    """
+    def __init__(self, path: str, files: Dict[str, PackageDefinition]=None):
+        self.path = path
+        self._files: Dict[str, PackageDefinition] = {}
+        self._reverse: Dict[str, Set[Tuple[str, str]]] = {}
+        self._packages = None
+        for file, definition in (files or {}).items():
+            self.set(file, definition)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ProvidesIndex"]:
+        """
+        Loads the index stored at `path`. Returns `None` if it is
+        missing or was written in an older format.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get("version") != FORMAT_VERSION:
+            return None
+        files = {file: PackageDefinition(**d) for file, d in data["files"].items()}
+        return cls(path, files)
+
+    def save(self):
+        """
+        Atomically writes the index to its path.
+        """
+        data = {"version": FORMAT_VERSION,
+                "files": {file: asdict(d) for file, d in self._files.items()}}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _entries(self, file: str) -> List[Tuple[str, Tuple[str, str]]]:
+        """
+        Returns the `(key, (package, file))` reverse index entries of `file`.
+        """
+        definition = self._files[file]
+        entries = []
+        for package in [definition.name] + definition.subpackages:
+            entries.append((package, (package, file)))
+            for provided in definition.provides.get(package, []):
+                entries.append((strip_constraint(provided)[0], (package, file)))
+        return entries
+
+    def set(self, file: str, definition: Optional[PackageDefinition]):
+        """
+        Replaces the definition of the package file `file`. A `definition`
+        of `None` removes the file from the index.
+        """
+        self._packages = None
+        if file in self._files:
+            for key, value in self._entries(file):
+                self._reverse[key].discard(value)
+                if not self._reverse[key]:
+                    del self._reverse[key]
+            del self._files[file]
+        if definition is not None:
+            self._files[file] = definition
+            for key, value in self._entries(file):
+                self._reverse.setdefault(key, set()).add(value)
+
+    def packages(self) -> Dict[str, str]:
+        """
+        Returns every installable package and subpackage name keyed by its lowercase form.
+        """
+        if self._packages is None:
+            self._packages = {key.lower(): key for key, values in self._reverse.items()
+                              if any(package == key for package, _ in values)}
+        return self._packages
+
+    def is_installable(self, name: str) -> bool:
+        """
+        Returns whether `apk add` can install `name` exactly as given, either
+        as a package name or as a name some package provides.
+        """
+        return name in self._reverse
+
+    def lookup(self, name: str) -> List[ProvidedPackage]:
+        """
+        Finds the packages that are named `name` or provide it. Names without
+        a prefix also match the `cmd:`, `so:`, `pc:` and `py3:` names they stand for,
+        so `make` finds the packages providing `cmd:make`.
+
+        Args:
+            name (str): A package name, command, shared library or other virtual name.
+
+        Returns:
+            A sorted `List` of `ProvidedPackage` objects.
+        """
+        keys = [name]
+        if not name.startswith(VIRTUAL_PREFIXES):
+            keys += [prefix + name for prefix in VIRTUAL_PREFIXES]
+        matches = set()
+        for key in keys:
+            matches.update(self._reverse.get(key, ()))
+        results = [ProvidedPackage(package, self._files[file].version, self._files[file].name)
+                   for package, file in matches]
+        return sorted(results, key=lambda p: (p.name, p.origin))
@@ -0,0 +1,61 @@
+# Standard lib
+from typing import Iterator
+import os
+import mmap
+import codecs
+
+# 3rd party
+
+# Local
+
+
+READ_BLOCK_SZ = 1 << 16
+
+
+class TextFileReader():
+    """
+    Lazily decodes a UTF-8 file in blocks through a read-only memory map. Multibyte
+    characters split across blocks are handled by an incremental decoder, and invalid
+    bytes are replaced rather than raising. Memory use is bounded by `block_sz`
+    regardless of the size of the file.
+
+    path (str): The path of the file.
+    max_chars (int): The maximum number of characters to yield or `None` for no limit.
+    truncated (bool): Set once iteration stops early because of `max_chars`.
+    """
+    def __init__(self, path: str, max_chars: int=None, block_sz: int=READ_BLOCK_SZ):
+        if block_sz <= 0:
+            raise ValueError(f"`block_sz` must be positive. Got {block_sz}")
+        self.path = path
+        self.max_chars = max_chars
+        self.block_sz = block_sz
+        self.truncated = False
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Yields decoded blocks of text.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        remaining = self.max_chars
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # Empty files cannot be memory mapped
+            if size == 0:
+                return
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for offset in range(0, size, self.block_sz):
+                    end = offset + self.block_sz
+                    text = decoder.decode(m[offset:end], final=end >= size)
+                    if remaining is not None:
+                        # Reaching the limit with bytes left over also counts as truncation
+                        self.truncated = len(text) > remaining \
+                            or (len(text) == remaining and end < size)
+                        text = text[:remaining]
+                        remaining -= len(text)
+                    if text:
+                        yield text
+                    if self.truncated:
+                        return
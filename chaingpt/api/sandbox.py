@@ -0,0 +1,81 @@
+# Standard lib
+from typing import Iterator, Optional, Set, Tuple
+from contextlib import contextmanager
+import threading
+
+# 3rd party
+
+# Local
+from chaingpt.api.pool import ContainerBackend
+
+
+class Sandbox():
+    """
+    A container that lives for a whole agent session, so that installed
+    packages and files persist between scripts. The container is created on
+    first use and removed after `idle_timeout` seconds without scripts, on
+    `reset` or on `close`. The next script then starts in a new container, as
+    it does when the container stopped on its own.
+
+    installed (Set[str]): The packages installed in the current container.
+    workspaces (Set[str]): The container paths repositories were copied to.
+    """
+    def __init__(self, backend: ContainerBackend, idle_timeout: Optional[float]):
+        self.backend = backend
+        self.idle_timeout = idle_timeout
+        self.installed: Set[str] = set()
+        self.workspaces: Set[str] = set()
+        self._container_id = None
+        self._lock = threading.RLock()
+        self._timer = None
+
+    @contextmanager
+    def acquire(self) -> Iterator[Tuple[str, bool]]:
+        """
+        Holds the sandbox for one script. Scripts in the same sandbox run one at a time.
+
+        Returns:
+            A context manager yielding the container ID and whether the container is new.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._container_id is not None and not self.backend.is_healthy(self._container_id):
+                # e.g. removed for outliving its timeout, so start over
+                self.backend.remove(self._container_id)
+                self._container_id = None
+                self.installed = set()
+                self.workspaces = set()
+            fresh = self._container_id is None
+            if fresh:
+                self._container_id = self.backend.create()
+            try:
+                yield self._container_id, fresh
+            finally:
+                self._schedule_reap()
+
+    def _schedule_reap(self):
+        if self.idle_timeout is None or self._container_id is None:
+            return
+        self._timer = threading.Timer(self.idle_timeout, self.reset)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def reset(self):
+        """
+        Removes the container, discarding everything the scripts changed.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            container_id = self._container_id
+            self._container_id = None
+            self.installed = set()
+            self.workspaces = set()
+        if container_id is not None:
+            self.backend.remove(container_id)
+
+    def close(self):
+        self.reset()
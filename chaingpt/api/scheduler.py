@@ -0,0 +1,131 @@
+# Standard lib
+from typing import Iterator, Optional
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+import time
+import threading
+
+# 3rd party
+
+# Local
+
+
+class QueueTimeoutError(RuntimeError):
+    pass
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Limits applied to every script container. `None` leaves a limit unset.
+    """
+    cpu_shares: Optional[int] = None  # Relative CPU weight, Docker's default is 1024
+    mem_limit: Optional[str] = None  # e.g. "2g"
+    pids_limit: Optional[int] = None
+    timeout: Optional[float] = None  # Seconds before a script is killed
+
+
+@dataclass
+class SchedulerStats:
+    running: int
+    queued: int
+    max_queued: int
+    completed: int
+    waited: int  # Runs that had to queue
+    timed_out: int  # Runs that gave up queueing
+    total_wait: float  # Seconds
+    max_wait: float  # Seconds
+
+    @property
+    def mean_wait(self) -> float:
+        started = self.running + self.completed
+        return self.total_wait / started if started else 0.0
+
+
+class Scheduler():
+    """
+    Lets at most `max_concurrent` scripts run at once. Further scripts queue
+    and are started in the order they arrived. A script that waits longer than
+    `queue_timeout` seconds gives up with a `QueueTimeoutError`.
+    """
+    def __init__(self, max_concurrent: int, queue_timeout: Optional[float]=None):
+        if max_concurrent < 1:
+            raise ValueError(f"`max_concurrent` must be positive. Got {max_concurrent}")
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._waited = 0
+        self._timed_out = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _acquire(self) -> float:
+        """
+        Blocks until it is the caller's turn and returns how long it waited.
+        """
+        start = time.monotonic()
+        deadline = None if self.queue_timeout is None else start + self.queue_timeout
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                if self._queue[0] is not ticket or self._running >= self.max_concurrent:
+                    self._waited += 1
+                    self._max_queued = max(self._max_queued, len(self._queue))
+                while self._queue[0] is not ticket or self._running >= self.max_concurrent:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._timed_out += 1
+                        raise QueueTimeoutError(f"No slot to run the script became available "
+                                                f"within {self.queue_timeout} seconds")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._queue.popleft()
+            self._running += 1
+            wait = time.monotonic() - start
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            # The next script in line may fit as well
+            self._cond.notify_all()
+            return wait
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._completed += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """
+        Holds one of the `max_concurrent` slots for the duration of the context.
+
+        Returns:
+            A context manager yielding the seconds spent in the queue.
+
+        Raises:
+            QueueTimeoutError: If no slot became available within `queue_timeout` seconds.
+        """
+        wait = self._acquire()
+        try:
+            yield wait
+        finally:
+            self._release()
+
+    def stats(self) -> SchedulerStats:
+        """
+        Returns the queue depth and wait time metrics of the scheduler.
+        """
+        with self._cond:
+            return SchedulerStats(running=self._running, queued=len(self._queue),
+                                  max_queued=self._max_queued, completed=self._completed,
+                                  waited=self._waited, timed_out=self._timed_out,
+                                  total_wait=self._total_wait, max_wait=self._max_wait)
@@ -0,0 +1,191 @@
+"""
+A local HTTP service that lets several users work with their own workspaces at once.
+
+    python -m chaingpt.api.server [--host HOST] [--port PORT]
+
+Endpoints take and return JSON:
+
+    POST   /sessions                    {"url": "https://github.com/<owner>/<repo>"} -> {"session_id": ...}
+    DELETE /sessions/<id>
+    POST   /sessions/<id>/fileqa        {"question": ..., "file_path": ...} -> LLMResponse
+    GET    /sessions/<id>/paths?path=   -> {"directories": [...], "files": [...]}
+    GET    /wolfi/search?keyword=&page= -> {"results": [{"name": ..., "description": ...}]}
+    GET    /stats                       -> WorkspaceCacheStats
+"""
+
+
+# Standard lib
+from typing import Any, Dict, Optional, Tuple
+from dataclasses import asdict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import re
+import threading
+
+# 3rd party
+
+# Local
+from chaingpt.api.session import UnknownSessionError, WorkspaceCache
+from chaingpt.api.workspace import REPOSITORY_DIR
+from chaingpt.utils import config
+from chaingpt.utils.deferred import Deferred
+
+
+HOST = config.config["session_service"]["host"]
+PORT = config.config["session_service"]["port"]
+SWEEP_INTERVAL = config.config["session_service"]["sweep_interval"]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class SessionServer(ThreadingHTTPServer):
+    """
+    Serves each request on its own thread. Workspaces are kept in `cache`,
+    whose expired sessions are swept every `sweep_interval` seconds.
+    `wolfi` is a `WolfiClient` (or a `Deferred` one) shared by all sessions.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], cache: WorkspaceCache, wolfi: Any=None,
+                 sweep_interval: Optional[float]=SWEEP_INTERVAL):
+        super().__init__(address, SessionRequestHandler)
+        self.cache = cache
+        self.wolfi = wolfi
+        self._stopped = threading.Event()
+        if sweep_interval:
+            threading.Thread(target=self._sweep, args=(sweep_interval,),
+                             name="session-sweep", daemon=True).start()
+
+    def _sweep(self, interval: float):
+        while not self._stopped.wait(interval):
+            self.cache.sweep()
+
+    def server_close(self):
+        """
+        Stops the sweeper and deletes the workspaces of every session.
+        """
+        self._stopped.set()
+        super().server_close()
+        self.cache.close()
+
+
+class SessionRequestHandler(BaseHTTPRequestHandler):
+    server: SessionServer
+
+    ROUTES = [
+        ("POST", re.compile(r"/sessions"), "_new_session"),
+        ("DELETE", re.compile(r"/sessions/([^/]+)"), "_close_session"),
+        ("POST", re.compile(r"/sessions/([^/]+)/fileqa"), "_fileqa"),
+        ("GET", re.compile(r"/sessions/([^/]+)/paths"), "_search_paths"),
+        ("GET", re.compile(r"/wolfi/search"), "_search_wolfi"),
+        ("GET", re.compile(r"/stats"), "_stats"),
+    ]
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            for route_method, pattern, name in self.ROUTES:
+                match = pattern.fullmatch(url.path)
+                if match and route_method == method:
+                    body = self._read_body() if method == "POST" else {}
+                    status, payload = getattr(self, name)(*match.groups(), query=query, body=body)
+                    break
+            else:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}")
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (UnknownSessionError, FileNotFoundError) as e:
+            status, payload = HTTPStatus.NOT_FOUND, {"error": str(e)}
+        except (ValueError, TypeError) as e:
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            self.log_error("%s %s failed: %r", method, url.path, e)
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+        self._send(status, payload)
+
+    def _read_body(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}")
+        if not isinstance(body, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The JSON body must be an object")
+        return body
+
+    def _send(self, status: HTTPStatus, payload: Dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _new_session(self, query: Dict, body: Dict):
+        session_id = self.server.cache.new_session(body.get("url"))
+        return HTTPStatus.CREATED, {"session_id": session_id}
+
+    def _close_session(self, session_id: str, query: Dict, body: Dict):
+        self.server.cache.close_session(session_id)
+        return HTTPStatus.OK, {}
+
+    def _fileqa(self, session_id: str, query: Dict, body: Dict):
+        with self.server.cache.lease(session_id) as workspace:
+            response = workspace.fileqa(body.get("question"), body.get("file_path"))
+        return HTTPStatus.OK, asdict(response)
+
+    def _search_paths(self, session_id: str, query: Dict, body: Dict):
+        with self.server.cache.lease(session_id) as workspace:
+            directories, files = workspace.search(query.get("path", "*"))
+        return HTTPStatus.OK, {"directories": directories, "files": files}
+
+    def _search_wolfi(self, query: Dict, body: Dict):
+        if self.server.wolfi is None:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Wolfi search is not enabled")
+        page = int(query.get("page", 1))
+        results = self.server.wolfi.search(query.get("keyword"), page=page)
+        return HTTPStatus.OK, {"results": [asdict(r) for r in results]}
+
+    def _stats(self, query: Dict, body: Dict):
+        return HTTPStatus.OK, asdict(self.server.cache.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves chaingpt workspaces over HTTP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    from chaingpt.api.wolfi import WolfiClient  # Slow to import and index, so built in the background
+    server = SessionServer((args.host, args.port), WorkspaceCache(cache_dir=REPOSITORY_DIR),
+                           Deferred(WolfiClient, "wolfi"))
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,326 @@
 """
-TODO: This file was used to mange sessions back when we thought we
-were going to host ChainGPT on Chainguard servers. This is no longer
-the plan and we should remove this file.
+Manages the workspaces of concurrent users of the session service
+(`chaingpt.api.server`). Each session owns one `Workspace`, whose clone is
+deleted from disk when the session is closed or evicted.
 """
 
 
 # Standard lib
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import os
+import shutil
+import threading
+import time
 import uuid
 
 # 3rd party
 
 # Local
-from chaingpt.api.workspace import Workspace
+from chaingpt.api.mirror import bases_path, mirror_path, prune
+from chaingpt.api.workspace import Workspace, REPOSITORY_DIR
+from chaingpt.utils import config
 
 
-# TODO: Temp implementation of workspace management.
-workspace_cache = {}
+MAX_SESSIONS = config.config["session_service"]["max_sessions"]
+MAX_DISK_SZ = config.config["session_service"]["max_disk_mb"] * 1024 * 1024
+SESSION_TTL = config.config["session_service"]["ttl"]
+
+
+class UnknownSessionError(ValueError):
+    pass
+
+
+@dataclass
+class WorkspaceCacheStats:
+    sessions: int
+    disk_size: int  # Bytes, including `shared_disk_size`
+    shared_disk_size: int  # Bytes of mirrors, base checkouts and files linked from them
+    created: int
+    evicted: int
+    expired: int
+
+
+def _file_stats(path: str) -> Iterator[os.stat_result]:
+    """
+    Yields the `lstat` of every file under `path`, skipping files removed meanwhile.
+    """
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                yield os.lstat(os.path.join(dir_path, name))
+            except FileNotFoundError:
+                continue
+
+
+def disk_usage(path: str) -> int:
+    """
+    Returns the total size in bytes of the files under `path` that are not
+    hardlinked elsewhere. Files shared with other workspaces stay on disk when
+    the workspace is deleted, so they are not counted.
+    """
+    return sum(st.st_size for st in _file_stats(path) if st.st_nlink == 1)
+
+
+def shared_disk_usage(url: str, cache_dir: str, workspace_dirs: Iterable[str]) -> int:
+    """
+    Returns the total size in bytes of the mirror and base checkouts of `url` in
+    `cache_dir` and of the hardlinked files of the workspaces in `workspace_dirs`,
+    which are cloned from `url`. Each file is counted once, however many links it has.
+    """
+    seen = set()
+    total = 0
+    paths = [(mirror_path(url, cache_dir), False), (bases_path(url, cache_dir), False)]
+    paths += [(path, True) for path in workspace_dirs]
+    for path, linked_only in paths:
+        for st in _file_stats(path):
+            key = (st.st_dev, st.st_ino)
+            if (linked_only and st.st_nlink == 1) or key in seen:
+                continue
+            seen.add(key)
+            total += st.st_size
+    return total
+
+
+class _Entry():
+    def __init__(self, workspace: Workspace, size: int):
+        self.workspace = workspace
+        self.size = size
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # Serializes the requests of one session
+        self.users = 0
+        self.removed = False
+
+
+class WorkspaceCache():
+    """
+    Keeps the workspaces of up to `max_sessions` sessions using at most `max_disk_size`
+    bytes of disk. When a new session exceeds either bound, the least recently used
+    sessions are evicted. Sessions idle for more than `ttl` seconds expire. The clone
+    of an evicted session is deleted once its last request finishes.
+
+    When `cache_dir` is given, the mirrors and base checkouts that workspaces share in
+    `cache_dir` count towards `max_disk_size` once per repository, and `sweep` removes
+    those of repositories no session uses anymore.
+
+    Requests of the same session run one at a time, while different sessions are
+    served concurrently. Cloning happens outside of any shared lock.
+    """
+    def __init__(self, max_sessions: int=MAX_SESSIONS, max_disk_size: int=MAX_DISK_SZ,
+                 ttl: Optional[float]=SESSION_TTL,
+                 make_workspace: Callable[[str], Workspace]=Workspace,
+                 cache_dir: Optional[str]=None):
+        if max_sessions < 1:
+            raise ValueError(f"`max_sessions` must be positive. Got {max_sessions}")
+        self.max_sessions = max_sessions
+        self.max_disk_size = max_disk_size
+        self.ttl = ttl
+        self.make_workspace = make_workspace
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = OrderedDict()
+        self._shared: Dict[str, int] = {}  # Shared bytes per repository URL
+        self._pending = Counter()  # URLs of sessions being created
+        self._created = 0
+        self._evicted = 0
+        self._expired = 0
+
+    def new_session(self, url: str) -> str:
+        """
+        Creates a workspace for `url` and returns the ID of its session.
+
+        Raises:
+            ValueError: If the URL is not valid.
+        """
+        with self._lock:
+            # Keeps `sweep` from pruning the mirror the workspace is cloned from
+            self._pending[url] += 1
+        try:
+            workspace = self.make_workspace(url)
+            entry = _Entry(workspace, disk_usage(workspace.parent_dir))
+            shared = None
+            if self.cache_dir is not None:
+                shared = shared_disk_usage(url, self.cache_dir, [workspace.parent_dir])
+        finally:
+            with self._lock:
+                self._pending[url] -= 1
+                if self._pending[url] == 0:
+                    del self._pending[url]
+        session_id = str(uuid.uuid4())
+        with self._lock:
+            self._entries[session_id] = entry
+            if shared is not None:
+                self._shared[url] = max(self._shared.get(url, 0), shared)
+            self._created += 1
+            removed = self._expire() + self._evict()
+        self._delete(removed)
+        return session_id
+
+    def _live_urls(self) -> Set[str]:
+        """
+        Returns the URLs of the sessions in the cache or being created. Must hold `_lock`.
+        """
+        return {entry.workspace.url for entry in self._entries.values()} | set(self._pending)
+
+    def _remove(self, session_id: str) -> _Entry:
+        """
+        Takes a session out of the cache. Must hold `_lock`.
+        """
+        entry = self._entries.pop(session_id)
+        entry.removed = True
+        if entry.workspace.url not in self._live_urls():
+            # Freed by the next `sweep`
+            self._shared.pop(entry.workspace.url, None)
+        return entry
+
+    def _expire(self):
+        """
+        Removes the sessions idle for longer than `ttl`. Must hold `_lock`.
+        """
+        if self.ttl is None:
+            return []
+        now = time.monotonic()
+        expired = [session_id for session_id, entry in self._entries.items()
+                   if entry.users == 0 and now - entry.last_used > self.ttl]
+        self._expired += len(expired)
+        return [self._remove(session_id) for session_id in expired]
+
+    def _evict(self):
+        """
+        Removes the least recently used sessions until the cache is within its
+        bounds. The newest session is always kept. Must hold `_lock`.
+        """
+        removed = []
+        while len(self._entries) > 1 and (len(self._entries) > self.max_sessions
+                                          or self._disk_size() > self.max_disk_size):
+            removed.append(self._remove(next(iter(self._entries))))
+        self._evicted += len(removed)
+        return removed
+
+    def _disk_size(self) -> int:
+        """
+        Returns the bytes used by the sessions and what they share. Must hold `_lock`.
+        """
+        return sum(entry.size for entry in self._entries.values()) + sum(self._shared.values())
+
+    def _delete(self, entries):
+        """
+        Deletes the clones of removed sessions that no request is using.
+        The others are deleted when their last request finishes.
+        """
+        for entry in entries:
+            with self._lock:
+                if entry.users > 0:
+                    continue
+            shutil.rmtree(entry.workspace.parent_dir, ignore_errors=True)
+
+    @contextmanager
+    def lease(self, session_id: str) -> Iterator[Workspace]:
+        """
+        Holds the workspace of `session_id` for one request. The workspace
+        is not deleted while it is leased, even if its session is evicted.
+
+        Returns:
+            A context manager yielding the `Workspace` of the session.
+
+        Raises:
+            ValueError: If no workspace is found for `session_id`.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                raise UnknownSessionError(f"{session_id} is not a valid session id")
+            self._entries.move_to_end(session_id)
+            entry.users += 1
+        try:
+            with entry.lock:
+                yield entry.workspace
+        finally:
+            with self._lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                delete = entry.removed and entry.users == 0
+            if delete:
+                shutil.rmtree(entry.workspace.parent_dir, ignore_errors=True)
+
+    def get(self, session_id: str) -> Workspace:
+        """
+        Returns the workspace of `session_id` without leasing it.
+
+        Raises:
+            ValueError: If no workspace is found for `session_id`.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                raise UnknownSessionError(f"{session_id} is not a valid session id")
+            self._entries.move_to_end(session_id)
+            entry.last_used = time.monotonic()
+            return entry.workspace
+
+    def close_session(self, session_id: str):
+        """
+        Ends a session and deletes its clone.
+
+        Raises:
+            ValueError: If no workspace is found for `session_id`.
+        """
+        with self._lock:
+            if session_id not in self._entries:
+                raise UnknownSessionError(f"{session_id} is not a valid session id")
+            entry = self._remove(session_id)
+        self._delete([entry])
+
+    def sweep(self):
+        """
+        Re-measures the disk usage of every session, since requests can grow
+        their clones, then removes the expired sessions and evicts sessions
+        until the cache is within its bounds. Finally removes the mirrors and base
+        checkouts of repositories without sessions. Called periodically by the service.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        # Walking the clones can be slow, so it happens outside of the lock
+        sizes = [disk_usage(entry.workspace.parent_dir) for entry in entries]
+        shared = {}
+        if self.cache_dir is not None:
+            for url in {entry.workspace.url for entry in entries}:
+                dirs = [entry.workspace.parent_dir for entry in entries if entry.workspace.url == url]
+                shared[url] = shared_disk_usage(url, self.cache_dir, dirs)
+        with self._lock:
+            for entry, size in zip(entries, sizes):
+                entry.size = size
+            live = self._live_urls()
+            self._shared.update((url, size) for url, size in shared.items() if url in live)
+            removed = self._expire() + self._evict()
+        self._delete(removed)
+        if self.cache_dir is not None:
+            prune(self.cache_dir, self._locked_live_urls)
+
+    def _locked_live_urls(self) -> Set[str]:
+        with self._lock:
+            return self._live_urls()
+
+    def stats(self) -> WorkspaceCacheStats:
+        with self._lock:
+            return WorkspaceCacheStats(sessions=len(self._entries),
+                                       disk_size=self._disk_size(),
+                                       shared_disk_size=sum(self._shared.values()),
+                                       created=self._created, evicted=self._evicted,
+                                       expired=self._expired)
+
+    def close(self):
+        """
+        Ends every session.
+        """
+        with self._lock:
+            removed = [self._remove(session_id) for session_id in list(self._entries)]
+        self._delete(removed)
+
+
+workspace_cache = WorkspaceCache(cache_dir=REPOSITORY_DIR)
 
 
 def new_session(url: str) -> str:
@@ -26,17 +331,14 @@ def new_session(url: str) -> str:
 
     Args:
         url (string): The GitHub URL.
-    
+
     Returns:
         The session id used to reference the workspace in later requests.
-    
+
     Raises:
         ValueError: If the URL is not valid.
     """
-    workspace = Workspace(url)
-    id = str(uuid.uuid4())
-    workspace_cache[id] = workspace
-    return id
+    return workspace_cache.new_session(url)
 
 
 def get_workspace(session_id: str) -> Workspace:
@@ -45,13 +347,11 @@ def get_workspace(session_id: str) -> Workspace:
 
     Args:
         session_id (str): The session id to lookup.
-    
+
     Returns:
         The `Workspace` object associated with `session_id`.
-    
+
     Raises:
         ValueError: If no workspace is found for `session_id`.
     """
-    if session_id not in workspace_cache.keys():
-        raise ValueError(f"{session_id} is not a valid session id")
-    return workspace_cache[session_id]
+    return workspace_cache.get(session_id)
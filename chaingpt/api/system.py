@@ -1,51 +1,547 @@
 # Standard lib
-from typing import List, Iterator
+from typing import Any, Callable, Dict, List, Iterator, Optional, Tuple
 from dataclasses import dataclass
+import atexit
+import calendar
+import json
+import math
+import os
+import shlex
+import threading
+import time
 
 # 3rd party
 import docker
+from docker.errors import ImageNotFound, NotFound
 
 # Local
+from chaingpt.api.pool import ContainerBackend, ContainerPool, PoolGroup, STDOUT, STDERR
+from chaingpt.api.output import OutputBuffer
+from chaingpt.api.sandbox import Sandbox
+from chaingpt.api.scheduler import Scheduler, SchedulerStats, ResourceLimits
+from chaingpt.api.workspace import Workspace
+from chaingpt.api.images import ImageBackend, ImageCache, CachedImage, IMAGE_REPOSITORY, \
+    canonical_deps
 from chaingpt.utils import config
 
 
 IMAGE_NAME = config.config["docker_shell_environment"]["image"]
 
+POOL_SZ = config.config["docker_shell_environment"]["pool"]["size"]
+POOL_TTL = config.config["docker_shell_environment"]["pool"]["ttl"]
+POOL_RECYCLE = config.config["docker_shell_environment"]["pool"]["recycle"]
+POOL_POLICY = config.config["docker_shell_environment"]["pool"]["exhausted_policy"]
+POOL_ACQUIRE_TIMEOUT = config.config["docker_shell_environment"]["pool"]["acquire_timeout"]
+
+IMAGES_ENABLED = config.config["docker_shell_environment"]["images"]["enabled"]
+IMAGES_MAX_SZ = config.config["docker_shell_environment"]["images"]["max_size_mb"] * 1024 * 1024
+IMAGES_POOL_SZ = config.config["docker_shell_environment"]["images"]["pool_size"]
+IMAGES_MAX_POOLS = config.config["docker_shell_environment"]["images"]["max_pools"]
+OUTPUT_HEAD_CHARS = config.config["docker_shell_environment"]["output"]["head_chars"]
+OUTPUT_TAIL_CHARS = config.config["docker_shell_environment"]["output"]["tail_chars"]
+
+SANDBOX_ENABLED = config.config["docker_shell_environment"]["sandbox"]["enabled"]
+SANDBOX_IDLE_TIMEOUT = config.config["docker_shell_environment"]["sandbox"]["idle_timeout"]
+
+LIMITS = ResourceLimits(**config.config["docker_shell_environment"]["limits"])
+KILL_GRACE = 30  # Seconds before a script that outlives its timeout loses its container
+
+SCHEDULER_MAX_CONCURRENT = config.config["docker_shell_environment"]["scheduler"]["max_concurrent"]
+SCHEDULER_QUEUE_TIMEOUT = config.config["docker_shell_environment"]["scheduler"]["queue_timeout"]
+
+APK_CACHE_VOLUME = config.config["docker_shell_environment"]["apk_cache_volume"]
+APK_CACHE_DIR = "/etc/apk/cache"  # apk caches downloads here when the directory exists
+
+WORKSPACE_ROOT = "/workspace"
+SANDBOX_STATE_DIR = "/tmp/chaingpt-sandbox"  # Where sandboxed scripts save their cwd and env
+
+BASE_IMAGE_LABEL = "chaingpt.base-image"
+DEPS_LABEL = "chaingpt.deps"
+
+_defaults_lock = threading.Lock()
+_default_pools = None
+_default_images = None
+_default_scheduler = None
+
 
 @dataclass
 class RunResult():
-    return_code: str
+    return_code: Optional[int]
     stdout: str
     stderr: str
+    duration: float  # Seconds
+    truncated: bool = False  # Whether the middle of stdout or stderr was omitted
+    timed_out: bool = False  # Whether the script was killed for exceeding its timeout
+
+
+class DockerBackend(ContainerBackend):
+    """
+    Runs pooled containers of `image` on the local Docker daemon. Containers
+    idle on `sleep` until scripts are executed in them and are created with `limits`.
+    """
+    def __init__(self, image: str, client: docker.DockerClient, limits: ResourceLimits=None):
+        self.image = image
+        self.client = client
+        self.limits = limits or ResourceLimits()
+
+    def create(self) -> str:
+        # TODO add better management of the underlying image. Does it exist?
+        container = self.client.containers.run(self.image, command=["sleep", "infinity"],
+                                               detach=True, init=True,
+                                               volumes=_apk_cache_volumes(),
+                                               **_limit_kwargs(self.limits))
+        return container.id
+
+    def exec(self, container_id: str, cmd: List[str],
+             workdir: Optional[str]=None) -> Tuple[str, Iterator[Tuple[int, bytes]]]:
+        # The low-level API saves a round trip to look the container up. Without
+        # a TTY, Docker keeps stdout and stderr apart
+        exec_id = self.client.api.exec_create(container_id, cmd, tty=False, workdir=workdir)["Id"]
+        frames = self.client.api.exec_start(exec_id, stream=True, demux=True)
+
+        def chunks():
+            for stdout, stderr in frames:
+                if stdout:
+                    yield STDOUT, stdout
+                if stderr:
+                    yield STDERR, stderr
+        return exec_id, chunks()
+
+    def exit_code(self, exec_id: str) -> Optional[int]:
+        return self.client.api.exec_inspect(exec_id)["ExitCode"]
+
+    def copy_in(self, container_id: str, archive_path: str):
+        with open(archive_path, "rb") as f:
+            self.client.api.put_archive(container_id, "/", f)
+
+    def is_healthy(self, container_id: str) -> bool:
+        try:
+            return self.client.api.inspect_container(container_id)["State"]["Running"]
+        except NotFound:
+            return False
+
+    def remove(self, container_id: str):
+        try:
+            self.client.api.remove_container(container_id, force=True)
+        except NotFound:
+            pass
+
+
+def workspace_dir(workspace: Workspace) -> str:
+    """
+    Returns where the repository of `workspace` is found inside containers.
+    """
+    return f"{WORKSPACE_ROOT}/{os.path.basename(workspace.repo_dir)}"
+
+
+def _apk_cache_volumes() -> Dict[str, Dict[str, str]]:
+    """
+    Mounts the shared apk cache so packages are downloaded once per host.
+    """
+    if not APK_CACHE_VOLUME:
+        return {}
+    return {APK_CACHE_VOLUME: {"bind": APK_CACHE_DIR, "mode": "rw"}}
+
+
+def _limit_kwargs(limits: ResourceLimits) -> Dict[str, Any]:
+    """
+    Returns the arguments of `containers.run` that apply `limits`.
+    """
+    kwargs = {}
+    if limits.cpu_shares is not None:
+        kwargs["cpu_shares"] = limits.cpu_shares
+    if limits.mem_limit is not None:
+        # Without an equal swap limit, containers could swap past the memory limit
+        kwargs["mem_limit"] = limits.mem_limit
+        kwargs["memswap_limit"] = limits.mem_limit
+    if limits.pids_limit is not None:
+        kwargs["pids_limit"] = limits.pids_limit
+    return kwargs
+
+
+class DockerImageBackend(ImageBackend):
+    """
+    Builds dependency images by installing the deps in a container
+    and committing it. Images are labeled with their base image and deps.
+    Builds are subject to the same `limits` as scripts.
+    """
+    def __init__(self, client: docker.DockerClient, limits: ResourceLimits=None):
+        self.client = client
+        self.limits = limits or ResourceLimits()
+
+    def build(self, base_image: str, deps: List[str], tag: str) -> int:
+        container = self.client.containers.run(base_image, command=["apk", "add", *deps],
+                                               detach=True, volumes=_apk_cache_volumes(),
+                                               **_limit_kwargs(self.limits))
+        try:
+            status = container.wait(timeout=self.limits.timeout)["StatusCode"]
+            if status != 0:
+                raise ValueError(f"Installing {deps} failed with status {status}")
+            labels = {BASE_IMAGE_LABEL: base_image, DEPS_LABEL: json.dumps(deps)}
+            repository, tag_name = tag.split(":")
+            image = container.commit(repository, tag_name,
+                                     conf={"Labels": labels, "Cmd": ["sleep", "infinity"]})
+        finally:
+            container.remove(force=True)
+        return image.attrs["Size"] - self._size(base_image)
+
+    def _size(self, image: str) -> int:
+        """
+        Returns the size of `image`, or 0 if it has not been pulled yet.
+        """
+        try:
+            return self.client.images.get(image).attrs["Size"]
+        except ImageNotFound:
+            return 0
+
+    def list(self, base_image: str) -> List[CachedImage]:
+        base_size = self._size(base_image)
+        images = []
+        for image in self.client.images.list(IMAGE_REPOSITORY,
+                                             filters={"label": f"{BASE_IMAGE_LABEL}={base_image}"}):
+            # Docker does not track when images were last used, so start from their creation time
+            created = calendar.timegm(time.strptime(image.attrs["Created"][:19],
+                                                    "%Y-%m-%dT%H:%M:%S"))
+            for tag in image.tags:
+                images.append(CachedImage(tag, json.loads(image.labels[DEPS_LABEL]),
+                                          image.attrs["Size"] - base_size, created))
+        return images
+
+    def remove(self, tag: str):
+        try:
+            self.client.images.remove(tag, force=True)
+        except NotFound:
+            pass
+
+
+def _make_pool(client: docker.DockerClient, image: str) -> ContainerPool:
+    size = POOL_SZ if image == IMAGE_NAME else IMAGES_POOL_SZ
+    return ContainerPool(DockerBackend(image, client, LIMITS), size, ttl=POOL_TTL,
+                         recycle=POOL_RECYCLE, policy=POOL_POLICY,
+                         acquire_timeout=POOL_ACQUIRE_TIMEOUT)
+
+
+def _init_defaults():
+    """
+    Creates the container pools, image cache and scheduler shared by every
+    `SystemEnvironment` in the process. Must hold `_defaults_lock`. The defaults
+    are only set once all of them were created, so a failure is retried by the
+    next call instead of leaving some of them unset.
+    """
+    global _default_pools, _default_images, _default_scheduler
+    client = docker.from_env()
+    scheduler = Scheduler(SCHEDULER_MAX_CONCURRENT, SCHEDULER_QUEUE_TIMEOUT)
+    pools = PoolGroup(lambda image: _make_pool(client, image), max_pools=IMAGES_MAX_POOLS,
+                      pinned=[IMAGE_NAME])
+    images = None
+    if IMAGES_ENABLED:
+        images = ImageCache(DockerImageBackend(client, LIMITS), IMAGE_NAME, IMAGES_MAX_SZ,
+                            on_evict=pools.close, scheduler=scheduler)
+        atexit.register(images.close)
+    atexit.register(pools.close_all)
+    _default_scheduler, _default_pools, _default_images = scheduler, pools, images
+
+
+def get_default_pools() -> PoolGroup:
+    """
+    Returns the container pools shared by every `SystemEnvironment` in the process.
+    """
+    with _defaults_lock:
+        if _default_pools is None:
+            _init_defaults()
+        return _default_pools
+
+
+def get_default_image_cache() -> ImageCache:
+    """
+    Returns the dependency image cache shared by every `SystemEnvironment` in the
+    process, or `None` if derived images are disabled.
+    """
+    with _defaults_lock:
+        if _default_pools is None:
+            _init_defaults()
+        return _default_images
+
+
+def get_default_scheduler() -> Scheduler:
+    """
+    Returns the scheduler that limits how many scripts run at once in the process.
+    """
+    with _defaults_lock:
+        if _default_pools is None:
+            _init_defaults()
+        return _default_scheduler
+
+
+def get_scheduler_stats() -> Optional[SchedulerStats]:
+    """
+    Returns the stats of the scheduler shared by every `SystemEnvironment` in the
+    process, or `None` if no environment was created yet. Unlike
+    `get_default_scheduler`, this never connects to Docker.
+    """
+    with _defaults_lock:
+        return None if _default_scheduler is None else _default_scheduler.stats()
+
+
+def _drain(backend: ContainerBackend, container_id: str, cmd: List[str]):
+    """
+    Runs `cmd` in the container and waits for it, ignoring its output.
+    """
+    _, chunks = backend.exec(container_id, cmd)
+    for _ in chunks:
+        pass
+
+
+def _exec(backend: ContainerBackend, container_id: str, cmd: List[str], workdir: Optional[str],
+          on_output: Optional[Callable[[int, str], None]],
+          timeout: Optional[float]=None) -> RunResult:
+    """
+    Runs `cmd` in the container and captures its output in bounded buffers.
+    With a `timeout`, `cmd` is killed inside the container once it expires. If
+    it still runs `KILL_GRACE` seconds later, the whole container is removed.
+    """
+    buffers = {STDOUT: OutputBuffer(OUTPUT_HEAD_CHARS, OUTPUT_TAIL_CHARS),
+               STDERR: OutputBuffer(OUTPUT_HEAD_CHARS, OUTPUT_TAIL_CHARS)}
+    watchdog = None
+    killed = threading.Event()
+    if timeout is not None:
+        cmd = ["timeout", "-s", "KILL", str(math.ceil(timeout)), *cmd]
+
+        def kill():
+            killed.set()
+            backend.remove(container_id)
+        watchdog = threading.Timer(timeout + KILL_GRACE, kill)
+        watchdog.daemon = True
+
+    start = time.monotonic()
+    exec_id, chunks = backend.exec(container_id, cmd, workdir=workdir)
+    if watchdog is not None:
+        watchdog.start()
+    try:
+        for stream, data in chunks:
+            text = buffers[stream].write(data)
+            if text and on_output is not None:
+                on_output(stream, text)
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    duration = time.monotonic() - start
+    # The exec is gone along with its container
+    return_code = None if killed.is_set() else backend.exit_code(exec_id)
+    # `timeout` exits with 128 + SIGKILL when it kills the script
+    timed_out = killed.is_set() or (timeout is not None and return_code == 137
+                                    and duration >= timeout)
+
+    for stream, buffer in buffers.items():
+        text = buffer.close()
+        if text and on_output is not None:
+            on_output(stream, text)
+    return RunResult(return_code=return_code,
+                     stdout=buffers[STDOUT].getvalue(),
+                     stderr=buffers[STDERR].getvalue(),
+                     duration=duration,
+                     truncated=any(b.omitted_chars for b in buffers.values()),
+                     timed_out=timed_out)
+
+
+def _apk_add(deps: List[str]) -> str:
+    """
+    Returns the shell command installing `deps`. Each dependency is quoted, since
+    version constraints such as `python-3>3.10` would otherwise be read as redirects.
+    """
+    return "apk add " + " ".join(shlex.quote(dep) for dep in deps)
+
+
+def _sandbox_script(script: str, workdir: Optional[str], deps: List[str]) -> str:
+    """
+    Wraps `script` so that it starts in the directory and with the exported
+    variables the previous sandboxed script ended with, and saves them on exit.
+    """
+    state = SANDBOX_STATE_DIR
+    lines = [f"[ -f {state}/env ] && . {state}/env",
+             f"cd \"$(cat {state}/cwd 2>/dev/null || echo {workdir or '/'})\"",
+             f"trap 'mkdir -p {state}; pwd > {state}/cwd; export -p > {state}/env' EXIT"]
+    if deps:
+        lines.append(f"{_apk_add(deps)} || exit $?")
+    lines.append(script)
+    return "\n".join(lines)
 
 
 class SystemEnvironment():
-    def run(self, script: str, deps: List[str]=None) -> Iterator[str]:
+    """
+    Runs scripts in containers. By default every script gets a fresh container
+    from a pool. With `sandbox`, the scripts of this environment share one
+    container instead, so installed packages, files, the working directory and
+    exported variables carry over from one script to the next, like a shell
+    session. The sandbox is removed after `SANDBOX_IDLE_TIMEOUT` idle seconds,
+    on `reset` or on `close`.
+
+    Scripts wait for a slot of `scheduler`, if any, before they start and are
+    killed after `timeout` seconds.
+    """
+    def __init__(self, pools: PoolGroup=None, images: ImageCache=None,
+                 sandbox: bool=SANDBOX_ENABLED, scheduler: Scheduler=None,
+                 timeout: Optional[float]=LIMITS.timeout):
+        if pools is None:
+            pools = get_default_pools()
+            images = get_default_image_cache()
+            scheduler = get_default_scheduler()
+        self.pools = pools
+        self.images = images
+        self.scheduler = scheduler
+        self.timeout = timeout
+        # Start warming up the base image pool
+        base_pool = self.pools.get(IMAGE_NAME)
+        self.sandbox = Sandbox(base_pool.backend, SANDBOX_IDLE_TIMEOUT) if sandbox else None
+
+    def reset(self):
+        """
+        Discards the sandbox container, if any. The next script starts from a clean state.
+        """
+        if self.sandbox is not None:
+            self.sandbox.reset()
+
+    def close(self):
+        if self.sandbox is not None:
+            self.sandbox.close()
+
+    def run(self, script: str, deps: List[str]=None, workspace: Workspace=None,
+            on_output: Callable[[int, str], None]=None) -> RunResult:
         """
         Runs `script` in an isolated shell. The `deps` `List` contains any
         Wolfi dependencies that should be installed before executing the script.
+        The script is executed in a pre-started container leased from a pool.
+        Scripts with the same set of `deps` reuse an image with them preinstalled
+        once it was built in the background. Until then, `deps` are installed
+        from the shared apk cache. In sandbox mode, the script runs in the
+        session's container instead and only `deps` it lacks are installed.
+
+        If a `workspace` is given, a snapshot of its repository is copied into the
+        container and the script runs from it, so the script can build and test the
+        repository without cloning it. Changes stay inside the container.
+
+        The script waits in a FIFO queue while the scheduler's concurrency limit is
+        reached. Scripts running longer than the environment's `timeout` are killed
+        and their result is marked `timed_out`.
+
+        Output is decoded as it streams in. Only the first `OUTPUT_HEAD_CHARS` and
+        last `OUTPUT_TAIL_CHARS` characters of stdout and stderr are kept, so memory
+        use does not grow with the output.
 
         Args:
             script (str): The shell script to run. (For now this should be written as a shell one-liner with `&&`).
             deps (List[str]): A list of Wolfi dependencies to install prior to script execution.
-
+            workspace (Workspace, optional): The workspace whose repository the script can access.
+            on_output (Callable[[int, str], None], optional): Called with `STDOUT` or `STDERR`
+                                                             and each piece of output as it arrives.
         
         Returns:
-            An `Iterator` over stdout and stderr.
+            A `RunResult` with the exit code, the captured stdout and stderr and the duration.
         
         Raises:
             TypeError: If argument types are invalid.
+            PoolExhaustedError: If no container is available.
+            QueueTimeoutError: If the script waited too long for the scheduler.
         """
-        # TODO add better management of the underlying image. Does it exist?
-        # TODO validate if the provided dependency is valid
-        client = docker.from_env()
-        
-        install_deps = f"apk add {' '.join(deps)}"
-        cmd = f"sh -c '{install_deps} && {script}'"
-        container = client.containers.run(IMAGE_NAME, command=cmd,
-                                          stdout=True, stderr=True, tty=True, detach=True)
-        try:
-            for line in container.logs(stream=True):
-                yield line.decode('utf-8')
-        finally:
-            container.remove()
+        if not isinstance(script, str):
+            raise TypeError("`script` must be a string")
+        # Dependencies are validated against the Wolfi index by the caller
+        deps = canonical_deps(deps or [])
+
+        workdir = None
+        snapshot = None
+        if workspace is not None:
+            snapshot = workspace.snapshot(WORKSPACE_ROOT)
+            workdir = workspace_dir(workspace)
+
+        if self.scheduler is None:
+            return self._run(script, deps, snapshot, workdir, on_output)
+        with self.scheduler.slot():
+            return self._run(script, deps, snapshot, workdir, on_output)
+
+    def _run(self, script: str, deps: Tuple[str, ...], snapshot: Optional[str],
+             workdir: Optional[str],
+             on_output: Optional[Callable[[int, str], None]]) -> RunResult:
+        if self.sandbox is not None:
+            return self._run_sandboxed(script, deps, snapshot, workdir, on_output)
+
+        image = IMAGE_NAME
+        cmd = ["sh", "-c", script]
+        if deps:
+            tag = self.images.get(deps) if self.images is not None else None
+            if tag is not None:
+                image = tag
+            else:
+                if self.images is not None:
+                    self.images.request(deps)
+                cmd = ["sh", "-c", f"{_apk_add(deps)} && {script}"]
+
+        with self.pools.use(image) as pool, pool.lease() as container:
+            if snapshot is not None:
+                if container.uses > 1:
+                    # Drop the copy left behind by an earlier run in this container
+                    _drain(pool.backend, container.id, ["rm", "-rf", WORKSPACE_ROOT])
+                pool.backend.copy_in(container.id, snapshot)
+            return _exec(pool.backend, container.id, cmd, workdir, on_output, self.timeout)
+
+    def _run_sandboxed(self, script: str, deps: Tuple[str, ...], snapshot: Optional[str],
+                       workdir: Optional[str],
+                       on_output: Optional[Callable[[int, str], None]]) -> RunResult:
+        sandbox = self.sandbox
+        with sandbox.acquire() as (container_id, _):
+            # The repository is copied once, so edits made by earlier scripts are kept
+            if snapshot is not None and workdir not in sandbox.workspaces:
+                sandbox.backend.copy_in(container_id, snapshot)
+                sandbox.workspaces.add(workdir)
+            missing = [dep for dep in deps if dep not in sandbox.installed]
+            cmd = ["sh", "-c", _sandbox_script(script, workdir, missing)]
+            result = _exec(sandbox.backend, container_id, cmd, workdir, on_output, self.timeout)
+            if result.return_code == 0:
+                sandbox.installed.update(missing)
+            return result
+
+
+
+class LazyEnvironment():
+    """
+    Creates its `SystemEnvironment` on first use, so that nothing needs Docker
+    until a script runs. If creating it fails, the next use tries again.
+
+    sandboxed (bool): Whether scripts share a sandbox container.
+    """
+    def __init__(self, sandbox: bool=SANDBOX_ENABLED,
+                 make_env: Callable[[], SystemEnvironment]=None):
+        self.sandboxed = sandbox
+        self._make_env = make_env or (lambda: SystemEnvironment(sandbox=sandbox))
+        self._env = None
+        self._lock = threading.Lock()
+
+    def get(self) -> SystemEnvironment:
+        """
+        Returns the environment, creating it if needed.
+
+        Raises:
+            DockerException: If Docker is not available.
+        """
+        with self._lock:
+            if self._env is None:
+                self._env = self._make_env()
+            return self._env
+
+    def run(self, *args, **kwargs) -> RunResult:
+        """
+        Runs a script with `SystemEnvironment.run`.
+        """
+        return self.get().run(*args, **kwargs)
+
+    def reset(self):
+        with self._lock:
+            env = self._env
+        if env is not None:
+            env.reset()
+
+    def close(self):
+        with self._lock:
+            env = self._env
+        if env is not None:
+            env.close()
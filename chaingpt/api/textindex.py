@@ -0,0 +1,234 @@
+# Standard lib
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from dataclasses import dataclass
+import os
+import re
+import string
+import threading
+
+# 3rd party
+
+# Local
+
+
+BINARY_SNIFF_SZ = 8192
+REGEX_META = ".^$*+?{}[]\\|()"
+REGEX_QUANTIFIERS = "*?{"
+REGEX_ESCAPE_ARGS = {"x": 2, "u": 4, "U": 8}  # Characters following these escapes
+
+
+@dataclass
+class ContentMatch:
+    path: str
+    line_number: int
+    line: str
+
+
+def _trigrams(text: str) -> Set[Tuple[str, str, str]]:
+    """
+    Returns the set of case-folded character trigrams in `text`.
+    """
+    text = text.lower()
+    return set(zip(text, text[1:], text[2:]))
+
+
+def _required_literals(pattern: str) -> List[str]:
+    """
+    Conservatively extracts substrings that every match of the regex `pattern`
+    must contain. Only top-level literal runs are used; anything that could make
+    a character optional or introduce alternatives ends the run, as does every
+    escape other than escaped punctuation. Returns an empty `List` when no literal
+    is guaranteed, including for patterns with inline flags or other `(?` groups,
+    which can change how the rest of the pattern matches.
+    """
+    if "|" in pattern or "(?" in pattern:
+        return []
+    literals = []
+    run = ""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if depth == 0 and escaped in string.punctuation:
+                literal = escaped
+            else:
+                # Skip the rest of escapes such as \x64, \144 or \N{name}
+                if escaped in REGEX_ESCAPE_ARGS:
+                    i += REGEX_ESCAPE_ARGS[escaped]
+                elif escaped == "N" and pattern[i:i + 1] == "{":
+                    i = pattern.find("}", i) + 1 or len(pattern)
+                elif escaped.isdigit():
+                    while i < len(pattern) and pattern[i].isdigit():
+                        i += 1
+                literals.append(run)
+                run = ""
+                continue
+        elif c in "([":
+            depth += 1
+            literals.append(run)
+            run = ""
+            i += 1
+            continue
+        elif c in ")]":
+            depth = max(depth - 1, 0)
+            i += 1
+            continue
+        elif depth > 0 or c in REGEX_META:
+            literals.append(run)
+            run = ""
+            i += 1
+            continue
+        else:
+            literal = c
+            i += 1
+        # A quantifier may make the preceding character optional
+        if i < len(pattern) and pattern[i] in REGEX_QUANTIFIERS + "+":
+            if pattern[i] == "+":
+                run += literal
+            literals.append(run)
+            run = ""
+            continue
+        run += literal
+    literals.append(run)
+    return [lit for lit in literals if lit]
+
+
+class TextIndex():
+    """
+    A trigram index over the contents of the text files in a directory. Queries
+    only read the files that contain every trigram of the query's literal parts,
+    then verify matches line by line. Binary files and files larger than
+    `max_file_sz` bytes are skipped.
+
+    The index is built in a background thread. Searches block until it is ready.
+    """
+    def __init__(self, root: str, paths: Iterable[str], max_file_sz: int):
+        self.root = root
+        self.max_file_sz = max_file_sz
+        self._paths: List[Optional[str]] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[Tuple[str, str, str], Set[int]] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._error = None
+        thread = threading.Thread(target=self._build, args=(list(paths),), daemon=True)
+        thread.start()
+
+    def _build(self, paths: List[str]):
+        try:
+            with self._lock:
+                for path in paths:
+                    self._add(path)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
+    def _read(self, path: str) -> Optional[str]:
+        """
+        Returns the contents of `path` or `None` if it is missing,
+        too large or binary.
+        """
+        full_path = os.path.join(self.root, path)
+        try:
+            if os.path.getsize(full_path) > self.max_file_sz:
+                return None
+            with open(full_path, "rb") as f:
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError, PermissionError):
+            return None
+        if b"\0" in data[:BINARY_SNIFF_SZ]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _add(self, path: str):
+        text = self._read(path)
+        if text is None:
+            return
+        id = len(self._paths)
+        self._paths.append(path)
+        self._ids[path] = id
+        for trigram in _trigrams(text):
+            self._postings.setdefault(trigram, set()).add(id)
+
+    def _wait(self):
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def refresh(self, paths: Iterable[str]):
+        """
+        Re-indexes `paths` after they were created, modified or deleted.
+
+        Args:
+            paths (Iterable[str]): Paths relative to the root that changed.
+        """
+        self._wait()
+        with self._lock:
+            for path in paths:
+                # Old postings are left in place but point at a tombstone
+                id = self._ids.pop(path, None)
+                if id is not None:
+                    self._paths[id] = None
+                self._add(path)
+
+    def _candidates(self, literals: List[str]) -> Iterator[str]:
+        """
+        Yields the paths of the files that may contain all of `literals`.
+        """
+        ids = None
+        for literal in literals:
+            for trigram in _trigrams(literal):
+                posting = self._postings.get(trigram, set())
+                ids = posting if ids is None else ids & posting
+        if ids is None:
+            ids = range(len(self._paths))
+        for id in sorted(ids):
+            if self._paths[id] is not None:
+                yield self._paths[id]
+
+    def search(self, query: str, regex: bool=False, ignore_case: bool=False,
+               max_results: int=50) -> List[ContentMatch]:
+        """
+        Searches file contents for lines containing `query`.
+
+        Args:
+            query (str): The substring or regular expression to search for.
+            regex (bool, optional): Whether `query` is a regular expression.
+            ignore_case (bool, optional): Whether to ignore case when matching.
+            max_results (int, optional): The maximum number of matching lines to return.
+
+        Returns:
+            A `List` of `ContentMatch` objects ordered by path and line number.
+
+        Raises:
+            ValueError: If `query` is empty or not a valid regular expression.
+        """
+        if not query:
+            raise ValueError("`query` must not be empty")
+        flags = re.IGNORECASE if ignore_case else 0
+        try:
+            matcher = re.compile(query if regex else re.escape(query), flags)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression '{query}': {e}")
+        literals = _required_literals(query) if regex else [query]
+        literals = [lit for lit in literals if len(lit) >= 3]
+
+        self._wait()
+        with self._lock:
+            candidates = list(self._candidates(literals))
+
+        matches = []
+        for path in candidates:
+            text = self._read(path)
+            if text is None:
+                continue
+            for i, line in enumerate(text.splitlines(), start=1):
+                if matcher.search(line):
+                    matches.append(ContentMatch(path, i, line))
+                    if len(matches) >= max_results:
+                        return matches
+        return matches
@@ -0,0 +1,139 @@
+# Standard lib
+from typing import Iterable, Iterator, Tuple
+from collections import deque
+from functools import lru_cache
+import codecs
+
+# 3rd party
+import tiktoken
+
+# Local
+
+
+# Context window sizes (input + output tokens) of the supported OpenAI models
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4": 8192,
+    "gpt-4-0613": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-turbo-preview": 128000,
+    "gpt-4-0125-preview": 128000,
+    "gpt-4-1106-preview": 128000,
+}
+
+# Used for models missing from `MODEL_CONTEXT_WINDOWS`
+DEFAULT_CONTEXT_WINDOW = 4096
+DEFAULT_ENCODING = "cl100k_base"
+
+
+def context_window(model: str) -> int:
+    """
+    Returns the context window size in tokens of `model`. Unknown
+    models fall back to the conservative `DEFAULT_CONTEXT_WINDOW`.
+    """
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Returns the local tokenizer used by `model`.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Counts the number of tokens `model` would see for `text`.
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def _iter_segments(blocks: Iterable[str], max_chars: int) -> Iterator[str]:
+    """
+    Regroups `blocks` of text into lines, keeping their line endings.
+    Lines longer than `max_chars` are broken into several segments so
+    that memory use stays bounded on files without newlines.
+    """
+    pending = ""
+    for block in blocks:
+        pending += block
+        start = 0
+        while True:
+            end = pending.find("\n", start, start + max_chars)
+            if end == -1:
+                if len(pending) - start < max_chars:
+                    break
+                end = start + max_chars - 1
+            yield pending[start:end + 1]
+            start = end + 1
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+def _split_tokens(segment: str, chunk_tokens: int,
+                  encoding: tiktoken.Encoding) -> Iterator[Tuple[str, int]]:
+    """
+    Splits `segment` into pieces of at most `chunk_tokens` tokens. Multibyte
+    characters cut between two pieces are carried over to the next one.
+    """
+    tokens = encoding.encode(segment, disallowed_special=())
+    if len(tokens) <= chunk_tokens:
+        yield segment, len(tokens)
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for i in range(0, len(tokens), chunk_tokens):
+        piece = tokens[i:i + chunk_tokens]
+        final = i + chunk_tokens >= len(tokens)
+        yield decoder.decode(encoding.decode_bytes(piece), final=final), len(piece)
+
+
+def iter_token_chunks(blocks: Iterable[str], chunk_tokens: int,
+                      chunk_overlap: int, model: str) -> Iterator[str]:
+    """
+    Lazily packs consecutive lines of text into chunks of at most `chunk_tokens`
+    tokens of `model`. Consecutive chunks share up to `chunk_overlap` tokens of
+    whole lines. Lines longer than a chunk are split on token boundaries.
+
+    Args:
+        blocks (Iterable[str]): The text to chunk. May be streamed in blocks of any size.
+        chunk_tokens (int): The maximum number of tokens per chunk.
+        chunk_overlap (int): The maximum number of tokens shared by consecutive chunks.
+        model (str): The model whose tokenizer is used to count tokens.
+
+    Returns:
+        An `Iterator` over the chunks.
+
+    Raises:
+        ValueError: If `chunk_tokens` is not positive or `chunk_overlap` is not smaller than `chunk_tokens`.
+    """
+    if chunk_tokens <= 0:
+        raise ValueError(f"`chunk_tokens` must be positive. Got {chunk_tokens}")
+    if not 0 <= chunk_overlap < chunk_tokens:
+        raise ValueError(f"`chunk_overlap` must be in [0, {chunk_tokens}). Got {chunk_overlap}")
+    encoding = get_encoding(model)
+
+    window = deque()
+    total = 0
+    fresh = False  # Whether the window holds text not yet yielded
+    # Tokens are at least one character long, so capping segments bounds memory on files without newlines
+    for segment in _iter_segments(blocks, max_chars=chunk_tokens * 4):
+        for piece, n in _split_tokens(segment, chunk_tokens, encoding):
+            if total + n > chunk_tokens and window:
+                yield "".join(p for p, _ in window)
+                fresh = False
+                while window and (total > chunk_overlap or total + n > chunk_tokens):
+                    total -= window.popleft()[1]
+            window.append((piece, n))
+            total += n
+            fresh = True
+    if fresh:
+        yield "".join(p for p, _ in window)
@@ -1,30 +1,57 @@
 # Standard lib
-from typing import List
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import difflib
 import os
 import shutil
 from dataclasses import dataclass
 
 # 3rd party
-from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, TEXT
+from whoosh.index import create_in, open_dir, Index
+from whoosh.fields import Schema, ID, TEXT
 from whoosh.qparser import QueryParser
 from whoosh.query import Or
-from sh import git
+from sh import git, ErrorReturnCode
 import yaml
 import tqdm
 
 # Local
+from chaingpt.api.provides import ProvidesIndex, PackageDefinition, ProvidedPackage, \
+    strip_constraint
 from chaingpt.utils import config
 
 
 GIT_TOKEN = config.config["secrets"]["github_personal_access_token"]
+OS_URL = "https://github.com/wolfi-dev/os.git"
 OS_DIR = config.config["wolfi_database"]["os_dir"]
 OS_NAME = "wolfi-os"
 
 INDEX_DIR = config.config["wolfi_database"]["index_dir"]
 INDEX_NAME = "wolfi-index"
+INDEXED_COMMIT_FILE_NAME = "indexed-commit"
+PROVIDES_FILE_NAME = "provides.json"
 
 REBUILD_AT_START = config.config["wolfi_database"]["rebuild_at_start"]
+INCREMENTAL = config.config["wolfi_database"]["incremental"]
+INDEX_PROCS = config.config["wolfi_database"]["index_procs"] or os.cpu_count() or 1
+PARSE_CHUNK_SZ = 64
+
+# Called with the number of package files indexed so far and their total
+IndexProgressCallback = Callable[[int, int], None]
+
+SEARCH_LIMIT = config.config["wolfi_database"]["search_limit"]
+SEARCH_CACHE_SZ = config.config["wolfi_database"]["search_cache_size"]
+MAX_SUGGESTIONS = 3
+
+# libyaml is an order of magnitude faster than the pure Python parser
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+SCHEMA = Schema(package_file=ID(stored=True, unique=True),
+                package_name=TEXT(stored=True),
+                package_desc=TEXT(stored=True))
 
 
 @dataclass
@@ -33,97 +60,451 @@ class WolfiPackageResult:
     description: str
 
 
+@dataclass
+class SearchCacheStats:
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class PackageCheck:
+    name: str
+    package: Optional[str]  # The installable name, or `None` if unknown
+    suggestions: List[str]
+
+
+def _top_level_blocks(f: TextIO, keys: Tuple[str, ...]) -> str:
+    """
+    Returns the text of the top-level `keys` blocks of a YAML file. Reading
+    stops once every block was seen, and only these blocks need to be parsed.
+    """
+    lines = []
+    remaining = set(keys)
+    current = None
+    for line in f:
+        if line.strip() and not line[0].isspace() and line[0] not in "#-":
+            if current is not None:
+                remaining.discard(current)
+                if not remaining:
+                    break
+            key = line.split(":", 1)[0]
+            current = key if key in remaining else None
+        if current is not None:
+            lines.append(line)
+    return "".join(lines)
+
+
+def _substitute(value: str, package: Dict) -> str:
+    """
+    Expands the melange variables that commonly appear in subpackage names.
+    """
+    return value.replace("${{package.name}}", str(package["name"])) \
+                .replace("${{package.version}}", str(package.get("version", "")))
+
+
+def _provides(section: Dict) -> List[str]:
+    dependencies = section.get("dependencies") or {}
+    return [str(p) for p in dependencies.get("provides") or []]
+
+
+def _parse_package(file_path: str) -> Optional[PackageDefinition]:
+    """
+    Reads the package, its version, its subpackages and the names they
+    provide from a melange YAML file. Returns `None` for files that do
+    not describe a package.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        blocks = _top_level_blocks(f, ("package", "subpackages"))
+    try:
+        data = yaml.load(blocks, Loader=YAML_LOADER)
+    except yaml.YAMLError:
+        # The blocks may refer to anchors defined elsewhere in the file
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = yaml.load(f, Loader=YAML_LOADER)
+
+    # TODO: Why do some YAMLs not have a package section ?!
+    if not isinstance(data, dict) or not isinstance(data.get("package"), dict) \
+            or "name" not in data["package"]:
+        return None
+
+    package = data["package"]
+    name = str(package["name"])
+    provides = {name: _provides(package)}
+    subpackages = []
+    for sub in data.get("subpackages") or []:
+        if not isinstance(sub, dict) or "name" not in sub:
+            continue
+        sub_name = _substitute(str(sub["name"]), package)
+        # Names generated from a range cannot be resolved here
+        if "${{" in sub_name:
+            continue
+        subpackages.append(sub_name)
+        provides[sub_name] = _provides(sub)
+
+    return PackageDefinition(name=name,
+                             description=str(package.get("description", "")),
+                             version=str(package.get("version", "")),
+                             subpackages=subpackages,
+                             provides={k: [_substitute(p, package) for p in v]
+                                       for k, v in provides.items() if v})
+
+
+def _parse_packages(os_path: str, names: List[str],
+                    procs: int) -> Iterator[Tuple[str, Optional[PackageDefinition]]]:
+    """
+    Parses the package files `names` in `os_path`, fanning out over
+    `procs` processes. Yields `(name, package)` pairs in order.
+    """
+    paths = [os.path.join(os_path, name) for name in names]
+    if procs <= 1:
+        yield from zip(names, map(_parse_package, paths))
+        return
+    # The index is often built on a background thread, and forking a
+    # multithreaded process can deadlock the children
+    context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=procs, mp_context=context) as pool:
+        yield from zip(names, pool.map(_parse_package, paths, chunksize=PARSE_CHUNK_SZ))
+
+
+def build_index(os_path: str, index_path: str, procs: int=INDEX_PROCS,
+                on_progress: IndexProgressCallback=None) -> Index:
+    """
+    Builds a new whoosh index at `index_path` from every package file in the
+    Wolfi OS checkout at `os_path`, replacing any existing index.
+
+    Args:
+        os_path (str): The Wolfi OS checkout.
+        index_path (str): The directory to create the index in.
+        procs (int, optional): The number of processes used to parse package
+                               files and, on the main thread, write index segments.
+        on_progress (IndexProgressCallback, optional): Called after each package file
+                                                       instead of drawing a progress bar.
+
+    Returns:
+        The new `Index`.
+    """
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.makedirs(index_path)
+
+    index = create_in(index_path, SCHEMA)
+    provides = ProvidesIndex(os.path.join(index_path, PROVIDES_FILE_NAME))
+    # whoosh forks its writer processes, which is only safe from the main thread
+    if procs > 1 and threading.current_thread() is threading.main_thread():
+        writer = index.writer(procs=procs, multisegment=True)
+    else:
+        writer = index.writer()
+
+    names = sorted(name for name in os.listdir(os_path) if _is_package_file(name))
+    packages = _parse_packages(os_path, names, procs)
+    # A bar drawn from a background thread would garble whatever else the terminal shows
+    bar = tqdm.tqdm(packages, total=len(names), desc="Building local Wolfi package index",
+                    disable=on_progress is not None)
+    for done, (name, package) in enumerate(bar, start=1):
+        if on_progress is not None:
+            on_progress(done, len(names))
+        provides.set(name, package)
+        if package is not None:
+            writer.add_document(package_file=name, package_name=package.name,
+                                package_desc=package.description)
+    writer.commit()
+    provides.save()
+    return index
+
+
+def _is_package_file(name: str) -> bool:
+    """
+    Package definitions are the YAML files at the top-level of the Wolfi OS repository.
+    """
+    return name.endswith(".yaml") and "/" not in name
+
+
 class WolfiClient:
-    def __init__(self):
+    def __init__(self, on_progress: IndexProgressCallback=None):
+        """
+        Opens the local Wolfi package index, building or updating it first as
+        configured. `on_progress` reports the progress of full builds instead of
+        a progress bar, e.g. when the client is created in the background.
+        """
+        self.on_progress = on_progress
         self.os_path = os.path.join(OS_DIR, OS_NAME)
         self.index_path = os.path.join(INDEX_DIR, INDEX_NAME)
         
         if REBUILD_AT_START \
                 or (not os.path.exists(self.os_path)) \
                 or (not os.path.exists(self.index_path)):
-            self._init_index()
+            if INCREMENTAL and self._indexed_commit() is not None:
+                self._update_index()
+            else:
+                self._init_index()
         else:
             self.index = open_dir(self.index_path)
-    
+        self.provides = ProvidesIndex.load(os.path.join(self.index_path, PROVIDES_FILE_NAME))
+        if self.provides is None:
+            # Indexes built before the provides index existed lack it
+            self.index = build_index(self.os_path, self.index_path,
+                                     on_progress=self.on_progress)
+            self.provides = ProvidesIndex.load(os.path.join(self.index_path, PROVIDES_FILE_NAME))
+        self._init_search()
+
+    def _head_commit(self) -> str:
+        return str(git("-C", self.os_path, "rev-parse", "HEAD")).strip()
+
+    def _indexed_commit(self) -> Optional[str]:
+        """
+        Returns the Wolfi OS commit the index was built from, or `None` if there is
+        no usable index to update (it is missing or predates the current schema).
+        """
+        path = os.path.join(self.index_path, INDEXED_COMMIT_FILE_NAME)
+        provides_path = os.path.join(self.index_path, PROVIDES_FILE_NAME)
+        if not (os.path.exists(self.os_path) and os.path.exists(path)
+                and os.path.exists(provides_path)):
+            return None
+        if "package_file" not in open_dir(self.index_path).schema.names():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def _write_indexed_commit(self, commit: str):
+        path = os.path.join(self.index_path, INDEXED_COMMIT_FILE_NAME)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(commit)
+
     def _init_index(self):
         """
         Initialize the whoosh index with all of Wolfi.
         """
-        # TODO: Extract clone and index functionality and write tests
+        # TODO: Extract clone functionality and write tests
 
         # Clone Wolfi
         if os.path.exists(self.os_path):
             shutil.rmtree(self.os_path)
-        git.clone("https://github.com/wolfi-dev/os.git", self.os_path)
-        
-        # Build index
-        if os.path.exists(self.index_path):
-            shutil.rmtree(self.index_path)
-        os.makedirs(self.index_path)
+        git.clone(OS_URL, self.os_path)
 
-        schema = Schema(package_name=TEXT(stored=True), package_desc=TEXT(stored=True))
+        self.index = build_index(self.os_path, self.index_path, on_progress=self.on_progress)
+        self._write_indexed_commit(self._head_commit())
 
-        self.index = create_in(self.index_path, schema)
-        writer = self.index.writer()
+    def _update_index(self):
+        """
+        Brings the existing Wolfi checkout and index up to date. Only the package
+        files that changed since the indexed commit are re-parsed. Falls back to
+        a full rebuild if the history cannot be diffed (e.g. after a force push).
+        """
+        old_commit = self._indexed_commit()
+        try:
+            git("-C", self.os_path, "fetch", "--quiet", "origin")
+            git("-C", self.os_path, "reset", "--quiet", "--hard", "origin/HEAD")
+            new_commit = self._head_commit()
+            diff = str(git("-C", self.os_path, "--no-pager", "diff", "-z", "--name-status",
+                           "--no-renames", old_commit, new_commit, _tty_out=False))
+        except ErrorReturnCode:
+            self._init_index()
+            return
+
+        self.index = open_dir(self.index_path)
+        if old_commit == new_commit:
+            return
 
-        # Loop through all Wolfi files and add them to the index
-        # TODO: Ugly code. Take out default use of tqdm
-        file_names = os.listdir(self.os_path)
-        for name in tqdm.tqdm(file_names, desc="Building local Wolfi package index"):
-            if name.endswith(".yaml"):
-                file_path = os.path.join(self.os_path, name)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = yaml.safe_load(f)
-
-                    # TODO: Why do some YAMLs not have a package section ?!
-                    if "package" not in data.keys():
-                        continue
-                    
-                    # TODO: Gracefully handle missing fields
-                    try:
-                        package_name = data["package"]["name"]
-                        package_desc = data["package"]["description"]
-                    except KeyError:
-                        continue
-
-                    writer.add_document(package_name=package_name, package_desc=package_desc)
+        provides = ProvidesIndex.load(os.path.join(self.index_path, PROVIDES_FILE_NAME))
+        if provides is None:
+            self._init_index()
+            return
+
+        writer = self.index.writer()
+        fields = diff.split("\0")
+        for status, name in zip(fields[0::2], fields[1::2]):
+            if not _is_package_file(name):
+                continue
+            writer.delete_by_term("package_file", name)
+            package = None
+            if status != "D":
+                package = _parse_package(os.path.join(self.os_path, name))
+                if package is not None:
+                    writer.add_document(package_file=name, package_name=package.name,
+                                        package_desc=package.description)
+            provides.set(name, package)
         writer.commit()
+        provides.save()
+        self._write_indexed_commit(new_commit)
+
+    def _init_search(self):
+        self._search_lock = threading.Lock()
+        self._searcher = self.index.searcher()
+        self._name_parser = QueryParser("package_name", self.index.schema)
+        self._desc_parser = QueryParser("package_desc", self.index.schema)
+        self._results = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def _refresh_searcher(self):
+        """
+        Reopens the searcher if the index changed. Must hold `_search_lock`.
+        """
+        searcher = self._searcher.refresh()
+        if searcher is not self._searcher:
+            # The index changed, so cached results may be stale
+            self._searcher = searcher
+            self._results.clear()
+
+    def cache_stats(self) -> SearchCacheStats:
+        """
+        Returns the hit and miss counts of the search result cache.
+        """
+        with self._search_lock:
+            return SearchCacheStats(self._hits, self._misses, len(self._results),
+                                    SEARCH_CACHE_SZ)
+
+    def _search(self, keyword: str, limit: int, page: int) -> List[WolfiPackageResult]:
+        """
+        Answers a search from the cache or the index. Must hold `_search_lock`.
+        """
+        key = (" ".join(keyword.split()), limit, page)
+        if key in self._results:
+            self._results.move_to_end(key)
+            self._hits += 1
+            return list(self._results[key])
+        self._misses += 1
+
+        name_query = self._name_parser.parse(keyword)
+        desc_query = self._desc_parser.parse(keyword)
+        combined_query = Or([name_query, desc_query])
+
+        # Only the requested page of hits is materialized
+        results = self._searcher.search_page(combined_query, page, pagelen=limit)
 
-    def search(self, keyword) -> List[WolfiPackageResult]:
+        output = []
+        for r in results:
+            name = r["package_name"]
+            # TODO: Why aren't these keys guaranteed to be present in the result?
+            if "package_desc" in r.keys():
+                desc = r["package_desc"]
+            else:
+                desc = ""
+            output.append(WolfiPackageResult(name, desc))
+
+        if SEARCH_CACHE_SZ > 0:
+            self._results[key] = output
+            if len(self._results) > SEARCH_CACHE_SZ:
+                self._results.popitem(last=False)
+        return list(output)
+
+    def search(self, keyword, limit: int=SEARCH_LIMIT, page: int=1) -> List[WolfiPackageResult]:
         """
-        Searches Wolfi for package names matching `keyword`.
+        Searches Wolfi for package names matching `keyword`. Results are cached by
+        keyword until the index changes, so repeated searches skip the index.
 
         Args:
             keyword: The keyword to search package names for.
+            limit (int, optional): The maximum number of results per page.
+            page (int, optional): The page of results to return, starting at 1.
         
-            Returns: A `List` of `WolfiPackageResult` objects.
+        Returns:
+            A `List` of at most `limit` `WolfiPackageResult` objects.
         
         Raises:
             TypeError: If keyword is not a `str`.
-
-
-        1) Clone wolfi
-        2) Index search files
-        3) perform the search
+            ValueError: If `limit` or `page` is not positive.
         """
         if not isinstance(keyword, str):
             raise TypeError("`keyword` must be a `str`.")
-        
-        with self.index.searcher() as searcher:
-            name_query = QueryParser("package_name", self.index.schema).parse(keyword)
-            desc_query = QueryParser("package_desc", self.index.schema).parse(keyword)
-            combined_query = Or([name_query, desc_query])
-
-            # Perform the search
-            results = searcher.search(combined_query)
-            
-            output = []
-            for r in results:
-                name = r["package_name"]
-                # TODO: Why aren't these keys guaranteed to be present in the result?
-                if "package_desc" in r.keys():
-                    desc = r["package_desc"]
-                else:
-                    desc = ""
-                output.append(WolfiPackageResult(name, desc))
-            return output
+        if limit < 1:
+            raise ValueError(f"`limit` must be positive. Got {limit}")
+        if page < 1:
+            raise ValueError(f"`page` must be positive. Got {page}")
+
+        with self._search_lock:
+            self._refresh_searcher()
+            return self._search(keyword, limit, page)
+
+    def search_many(self, keywords: List[str],
+                    limit: int=SEARCH_LIMIT) -> Dict[str, List[WolfiPackageResult]]:
+        """
+        Searches Wolfi for each of `keywords` against a single snapshot of the index.
+
+        Args:
+            keywords (List[str]): The keywords to search package names for.
+            limit (int, optional): The maximum number of results per keyword.
+
+        Returns:
+            A `Dict` mapping each keyword to a `List` of `WolfiPackageResult` objects.
+
+        Raises:
+            TypeError: If a keyword is not a `str`.
+            ValueError: If `limit` is not positive.
+        """
+        if not all(isinstance(k, str) for k in keywords):
+            raise TypeError("`keywords` must be `str` objects.")
+        if limit < 1:
+            raise ValueError(f"`limit` must be positive. Got {limit}")
+
+        with self._search_lock:
+            self._refresh_searcher()
+            return {keyword: self._search(keyword, limit, 1) for keyword in keywords}
+
+    def check_packages(self, names: List[str]) -> List[PackageCheck]:
+        """
+        Checks that each of `names` is a Wolfi package that `apk add` can install.
+        Names that only differ from a package in case, and names that exactly one
+        package provides (e.g. `make` for `cmd:make`), are corrected. Version
+        constraints (e.g. `python-3.12>3.12.1`) are kept. Virtual names with a
+        prefix like `cmd:` are passed through unchecked, since most are only
+        generated at build time.
+
+        Args:
+            names (List[str]): The package names to check.
+
+        Returns:
+            A `List` of `PackageCheck` objects in the order of `names`.
+
+        Raises:
+            TypeError: If a name is not a `str`.
+        """
+        if not all(isinstance(n, str) for n in names):
+            raise TypeError("`names` must be `str` objects.")
+
+        packages = self.provides.packages()
+        checks = []
+        for name in names:
+            base, constraint = strip_constraint(name)
+            providers = sorted(set(p.name for p in self.provides.lookup(base)))
+            if ":" in base:
+                checks.append(PackageCheck(name, name, []))
+            elif base.lower() in packages:
+                checks.append(PackageCheck(name, packages[base.lower()] + constraint, []))
+            elif self.provides.is_installable(base):
+                checks.append(PackageCheck(name, name, []))
+            elif len(providers) == 1:
+                checks.append(PackageCheck(name, providers[0], []))
+            elif providers:
+                checks.append(PackageCheck(name, None, providers[:MAX_SUGGESTIONS]))
+            else:
+                suggestions = difflib.get_close_matches(base.lower(), packages.keys(),
+                                                        n=MAX_SUGGESTIONS)
+                checks.append(PackageCheck(name, None, [packages[s] for s in suggestions]))
+        return checks
+
+    def lookup(self, name: str) -> List[ProvidedPackage]:
+        """
+        Finds the Wolfi packages and subpackages that are exactly named `name` or
+        declare that they provide it. A bare command or library name also
+        matches its `cmd:`, `so:`, `pc:` and `py3:` forms.
+
+        Args:
+            name (str): A package name, command, shared library or other virtual name.
+
+        Returns:
+            A `List` of `ProvidedPackage` objects sorted by name.
+
+        Raises:
+            TypeError: If `name` is not a `str`.
+        """
+        if not isinstance(name, str):
+            raise TypeError("`name` must be a `str`.")
+        return self.provides.lookup(strip_constraint(name.strip())[0])
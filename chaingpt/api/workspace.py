@@ -1,20 +1,46 @@
 # Standard lib
 from typing import List, Tuple
+import itertools
+import json
+import re
+import shutil
+import tarfile
+import threading
 import uuid
 import os
-import glob
 
 # 3rd party
 from sh import git, ErrorReturnCode_128
 
 # Local
-from chaingpt.api.llm import text_qa, text_qa_map_reduce, LLMResponse
+from chaingpt.api.llm import text_qa, chunks_qa_map_reduce, chunk_token_budget, \
+    prefilter_chunks, LLMResponse, LLM_MODEL, PROMPT_VERSION, MAP_REDUCE_STRATEGY, \
+    MAP_REDUCE_CHUNK_OVERLAP, MAP_REDUCE_REDUCE_FANOUT, PREFILTER_ENABLED, PREFILTER_TOP_K, \
+    PREFILTER_MIN_SCORE, PREFILTER_NEIGHBOURS, PREFILTER_MIN_CHUNKS, ProgressCallback
+from chaingpt.api.cache import LLMCache, git_blob_sha, make_key
+from chaingpt.api.mirror import clone_from_mirror, link_checkout, unshare
+from chaingpt.api.pathindex import PathIndex
+from chaingpt.api.textindex import TextIndex, ContentMatch
+from chaingpt.api.reader import TextFileReader
+from chaingpt.api.tokens import iter_token_chunks
 from chaingpt.utils import config
 
 
 MAX_FILE_SZ = config.config["llm"]["max_file_sz"]
-MAP_REDUCE_CHUNK_SZ = config.config["llm"]["map_reduce"]["chunk_sz"]
-MAP_REDUCE_CHUNK_OVERLAP = config.config["llm"]["map_reduce"]["chunk_overlap"]
+
+REPOSITORY_DIR = config.config["github_repository_cache"]["repository_dir"]
+USE_MIRROR = config.config["github_repository_cache"]["use_mirror"]
+SHARE_CHECKOUTS = config.config["github_repository_cache"]["share_checkouts"]
+QA_CACHE_ENABLED = config.config["llm"]["cache"]["enabled"]
+QA_CACHE_MAX_SZ = config.config["llm"]["cache"]["max_size_mb"] * 1024 * 1024
+QA_CACHE_NAME = "qa-cache.sqlite3"
+
+SNAPSHOT_NAME = "snapshot.tar"
+
+GITHUB_URL = re.compile(r"https://github\.com/[A-Za-z0-9-]+/[A-Za-z0-9_.-]+")
+
+CONTENT_SEARCH_MAX_FILE_SZ = config.config["content_search"]["max_file_sz"]
+CONTENT_SEARCH_MAX_RESULTS = config.config["content_search"]["max_results"]
 
 
 def _random_parent_dir(prefix: str="/tmp") -> str:
@@ -30,16 +56,28 @@ def _validate_path_name(path: str):
     Ensures `path` is properly formed and does
     not contain `..` or other attempts at directory
     traversal. 
+
+    Raises:
+        ValueError: If `path` is absolute or has a `..` component.
     """
-    # TODO
+    if os.path.isabs(path):
+        raise ValueError(f"`{path}` must be relative to the repository")
+    if ".." in path.split(os.sep):
+        raise ValueError(f"`{path}` must not contain `..`")
     
 
 def _validate_git_url(url: str):
     """
     Ensures `url` is a properly formed GitHub repository URL.
+
+    Raises:
+        TypeError: If `url` is not a string.
+        ValueError: If `url` is not an `https://github.com/<owner>/<repo>` URL.
     """
-    # TODO
-    pass
+    if not isinstance(url, str):
+        raise TypeError("`url` must be a string")
+    if not GITHUB_URL.fullmatch(url) or _repo_name(url) in ("", ".", ".."):
+        raise ValueError(f"`{url}` is not a GitHub repository URL")
 
 
 def _repo_name(url: str) -> str:
@@ -52,45 +90,161 @@ def _repo_name(url: str) -> str:
     return repo
 
 
+_qa_caches = {}
+_qa_caches_lock = threading.Lock()
+
+
+def get_qa_cache(path: str) -> LLMCache:
+    """
+    Returns the answer cache stored at `path`. The cache and its database
+    connection are shared by every `Workspace` in the process, so workspaces
+    do not hold connections of their own.
+    """
+    with _qa_caches_lock:
+        cache = _qa_caches.get(path)
+        if cache is None:
+            cache = _qa_caches[path] = LLMCache(path, QA_CACHE_MAX_SZ)
+        return cache
+
+
+def _writable(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    """
+    Restores the owner's write permission of files shared with a read-only checkout.
+    """
+    info.mode |= 0o200
+    return info
+
+
 class Workspace():
     def __init__(self, url: str):
         self.url = url
         self.parent_dir = _random_parent_dir()
         os.makedirs(self.parent_dir, exist_ok=False)
-        self._clone(url)
+        try:
+            self._clone(url)
+        except Exception:
+            # Nothing else owns the directory yet
+            shutil.rmtree(self.parent_dir, ignore_errors=True)
+            raise
+        self.paths = PathIndex(self.repo_dir)
+        self.contents = TextIndex(self.repo_dir, self.paths.files(),
+                                  CONTENT_SEARCH_MAX_FILE_SZ)
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_key = None
+        self.cache = None
+        if QA_CACHE_ENABLED:
+            self.cache = get_qa_cache(os.path.join(REPOSITORY_DIR, QA_CACHE_NAME))
 
     def _clone(self, url: str):
         """
         Clone the repository into the workspace parent directory.
-        Sets `self.repo_dir`.
+        Sets `self.repo_dir`. When `USE_MIRROR` is set, the clone is made
+        from a shared bare mirror under `REPOSITORY_DIR`. When `SHARE_CHECKOUTS`
+        is set as well, the clone hardlinks the files of a read-only checkout
+        shared by the workspaces on the same commit.
         """
         _validate_git_url(url)
         self.repo_dir = os.path.join(self.parent_dir, _repo_name(url))
+        if USE_MIRROR and SHARE_CHECKOUTS:
+            link_checkout(url, self.repo_dir, REPOSITORY_DIR)
+            return
+        if USE_MIRROR:
+            clone_from_mirror(url, self.repo_dir, REPOSITORY_DIR)
+            return
         try:
             git.clone(url, self.repo_dir)
         except ErrorReturnCode_128:
             raise ValueError(f"Error cloning {url}. Is the URL valid?")
 
+    def _git_state(self) -> Tuple:
+        """
+        Returns a fingerprint of the checkout that changes with
+        commits, checkouts and staged changes.
+        """
+        st = os.stat(os.path.join(self.repo_dir, ".git", "index"))
+        head = str(git("-C", self.repo_dir, "rev-parse", "HEAD")).strip()
+        return head, st.st_mtime_ns, st.st_size
+
+    def snapshot(self, root: str) -> str:
+        """
+        Archives the repository for copying into containers. The archive is
+        rebuilt only when the checkout changes, so repeated calls are cheap.
+        Edits to untracked files are not detected.
+
+        Args:
+            root (str): The directory the repository is placed in when the
+                        archive is extracted at `/`.
+
+        Returns:
+            The path of a tar archive of the repository, including its `.git` directory.
+        """
+        key = (root, self._git_state())
+        path = os.path.join(self.parent_dir, SNAPSHOT_NAME)
+        with self._snapshot_lock:
+            if key != self._snapshot_key:
+                tmp_path = path + ".tmp"
+                arcname = os.path.join(root.lstrip("/"), os.path.basename(self.repo_dir))
+                with tarfile.open(tmp_path, "w") as tar:
+                    tar.add(self.repo_dir, arcname=arcname, filter=_writable)
+                # Runs still reading the old archive keep their open file
+                os.replace(tmp_path, path)
+                self._snapshot_key = key
+        return path
+
+    def _full_path(self, file_path: str) -> str:
+        """
+        Returns the full path of `file_path`, which is relative
+        to the top-level directory of the repository.
+
+        Raises:
+            ValueError: If `file_path` is malformed or resolves to a
+                        path outside of the repository, such as through
+                        a symbolic link.
+        """
+        _validate_path_name(file_path)
+        full_path = os.path.join(self.repo_dir, file_path)
+        root = os.path.realpath(self.repo_dir)
+        if os.path.commonpath([root, os.path.realpath(full_path)]) != root:
+            raise ValueError(f"`{file_path}` is outside of the repository")
+        return full_path
+
     def _read_n(self, n: int, file_path: str) -> str:
         """
         Reads `n` characters from `file_path`. The `file_path`
         is relative to the top-level directory of the repository.
         """
-        full_path = os.path.join(self.repo_dir, file_path)
-        with open(full_path, encoding="utf-8") as f:
-            return f.read(n)
+        full_path = self._full_path(file_path)
+        return "".join(TextFileReader(full_path, max_chars=n))
 
-    def fileqa(self, question: str, file_path: str) -> LLMResponse:
+    def unshare(self, file_path: str):
+        """
+        Gives `file_path` a writable copy of its own if it is shared with other
+        workspaces, so that it can be modified in place. The `file_path` is
+        relative to the top-level directory of the repository.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+            ValueError: If `file_path` is outside of the repository.
+        """
+        unshare(self._full_path(file_path))
+
+    def fileqa(self, question: str, file_path: str,
+               on_progress: ProgressCallback=None) -> LLMResponse:
         """
         Analyzes the contents of `file_path` to answer the `question` using an LLM.
-        Files larger than `MAP_REDUCE_CHUNK_SIZE` characters are split into chunks and analyzed
-        via a refine method. Files larger than `MAX_FILE_SZ` are truncated to only the
-        first `MAX_FILE_SZ` characters.
+        The file is streamed through a memory map and split into token-sized chunks
+        lazily, so the first LLM call goes out before the whole file is read. Files with
+        more tokens than fit in a single prompt are analyzed with the configured map reduce
+        strategy, skipping chunks that are lexically irrelevant to selective questions
+        about long files when `PREFILTER_ENABLED` is set. If `MAX_FILE_SZ` is set, only the first `MAX_FILE_SZ` characters are
+        analyzed and the response is marked as truncated. Answers and chunk summaries are
+        cached by the file's git blob SHA so repeated questions about unchanged files skip the LLM.
 
         Args:
             question (str): The question to ask.
             file_path (str): The file to analyze. The path is relative to the
                              top-level directory of the repository.
+            on_progress (ProgressCallback, optional): Reports the progress of files analyzed in chunks.
         
         Returns:
             An `LLMResponse` containing the output from the LLM's analysis.
@@ -98,27 +252,68 @@ class Workspace():
         Raises:
             TypeError: If `question` or `file_path` are not strings.
             FileNotFoundError: If the file does not exist.
+            ValueError: If `file_path` is outside of the repository.
         """
-        # TODO: Add a feature that returns if the file was truncated.
         if not isinstance(question, str):
             raise TypeError("`question` must be a string")
         if not isinstance(file_path, str):
             raise TypeError("`file_path` must be a string")
         
-        _validate_path_name(file_path)
-        text = self._read_n(MAX_FILE_SZ, file_path)
-        if len(text) > MAP_REDUCE_CHUNK_SZ:
-            return text_qa_map_reduce(question, text, file_path=file_path,
-                                      chunk_size=MAP_REDUCE_CHUNK_SZ,
-                                      chunk_overlap=MAP_REDUCE_CHUNK_OVERLAP)
-        return text_qa(question, text, file_path=file_path)
+        full_path = self._full_path(file_path)
+        chunk_tokens = chunk_token_budget(question, file_path)
+
+        key = None
+        if self.cache is not None:
+            blob_sha = git_blob_sha(full_path)
+            key = make_key("fileqa", PROMPT_VERSION, LLM_MODEL, blob_sha, file_path,
+                           question, MAX_FILE_SZ, chunk_tokens,
+                           MAP_REDUCE_CHUNK_OVERLAP, MAP_REDUCE_STRATEGY, MAP_REDUCE_REDUCE_FANOUT,
+                           PREFILTER_ENABLED, PREFILTER_TOP_K, PREFILTER_MIN_SCORE, PREFILTER_NEIGHBOURS,
+                           PREFILTER_MIN_CHUNKS)
+            cached = self.cache.get(key)
+            if cached is not None:
+                cached = json.loads(cached)
+                return LLMResponse(output=cached["output"], model=LLM_MODEL,
+                                   input_tokens=0, output_tokens=0, cache_hits=1,
+                                   truncated=cached["truncated"],
+                                   skipped_chunks=cached["skipped_chunks"])
+
+        readers = []
+        def make_chunks():
+            reader = TextFileReader(full_path, max_chars=MAX_FILE_SZ)
+            readers.append(reader)
+            return iter_token_chunks(reader, chunk_tokens, MAP_REDUCE_CHUNK_OVERLAP, LLM_MODEL)
+
+        chunks = make_chunks()
+        # Peek at the first two chunks to decide whether the file fits in one prompt
+        first = next(chunks, "")
+        second = next(chunks, None)
+        if second is None:
+            response = text_qa(question, first, file_path=file_path)
+        else:
+            skipped = 0
+            chunks = itertools.chain([first, second], chunks)
+            if PREFILTER_ENABLED:
+                chunks, skipped = prefilter_chunks(question, make_chunks, chunks)
+            response = chunks_qa_map_reduce(question, chunks, file_path=file_path,
+                                            cache=self.cache, on_progress=on_progress)
+            response.skipped_chunks = skipped
+        response.truncated = any(r.truncated for r in readers)
+
+        if key is not None:
+            self.cache.put(key, json.dumps({"output": response.output,
+                                            "truncated": response.truncated,
+                                            "skipped_chunks": response.skipped_chunks}))
+            response.cache_misses += 1
+        return response
 
 
     def search(self, path: str) -> Tuple[List[str], List[str]]:
         """
         Searches the repository for files and directories matching `path`, which
         may include wildcard characters. All paths are interpreted as relative to
-        the top-level directory of the repository.
+        the top-level directory of the repository. Searches are answered from an
+        in-memory index of the repository's paths rather than the filesystem.
 
         Args:
             path (str): The path to search.
@@ -129,17 +324,32 @@ class Workspace():
         
         Raises:
             TypeError: If `path` is not a string.
+            ValueError: If `path` is absolute or contains `..`.
         """
         if not isinstance(path, str):
             raise TypeError("`path` must be a string")
         _validate_path_name(path)
-        abs_path = os.path.join(self.repo_dir, path)
-        results = glob.glob(abs_path, recursive=True)
-        files = []
-        dirs = []
-        for r in results:
-            if os.path.isdir(r):
-                dirs.append(os.path.relpath(r, self.repo_dir))
-            else:
-                files.append(os.path.relpath(r, self.repo_dir))
-        return dirs, files
+        return self.paths.search(path)
+
+    def search_content(self, query: str, regex: bool=False,
+                       ignore_case: bool=False) -> List[ContentMatch]:
+        """
+        Searches the contents of the repository's text files for lines matching `query`.
+        Searches are answered from a trigram index built when the workspace is created.
+
+        Args:
+            query (str): The substring or regular expression to search for.
+            regex (bool, optional): Whether `query` is a regular expression.
+            ignore_case (bool, optional): Whether to ignore case when matching.
+
+        Returns:
+            A `List` of at most `CONTENT_SEARCH_MAX_RESULTS` `ContentMatch` objects.
+
+        Raises:
+            TypeError: If `query` is not a string.
+            ValueError: If `query` is empty or not a valid regular expression.
+        """
+        if not isinstance(query, str):
+            raise TypeError("`query` must be a string")
+        return self.contents.search(query, regex=regex, ignore_case=ignore_case,
+                                    max_results=CONTENT_SEARCH_MAX_RESULTS)
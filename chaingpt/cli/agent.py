@@ -3,15 +3,17 @@ from typing import Iterator
 
 # 3rd party
 from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents.agent import AgentExecutor
-from langchain.agents import create_openai_functions_agent
-from langchain.memory import ConversationBufferMemory
+from langchain.agents import create_openai_tools_agent
 from langchain.callbacks.base import BaseCallbackHandler
 
 # Local
 from chaingpt.api.llm import LLMResponse
+from chaingpt.api.memory import TokenBudgetMemory
+from chaingpt.api.system import LazyEnvironment
 from chaingpt.cli.tools import get_tools
+from chaingpt.cli.display import display_progress, record_index_progress
 from chaingpt.utils import config
 
 
@@ -28,10 +30,16 @@ class ChainGPTAgent:
         def callback2(output: str):
             print(output, end="")
 
-        tools = get_tools(self.url, callback2)
-        llm = ChatOpenAI(temperature=0, model=LLM_MODEL)
+        # Owned by the agent so that a sandbox lives exactly as long as the session.
+        # Docker is only needed once a script runs
+        self.env = LazyEnvironment()
+        # The index builds while the prompt is shown, so its progress is kept for `stats`
+        tools = get_tools(self.url, callback2, self.env, on_progress=display_progress,
+                          on_index_progress=record_index_progress)
+        # Streaming lets callbacks print the answer token by token through `on_llm_new_token`
+        llm = ChatOpenAI(temperature=0, model=LLM_MODEL, streaming=True)
 
-        prompt = PromptTemplate.from_template("""
+        instructions = """
         As an AI expert and extremely intelligent engineering assistant focusing on the %s GitHub repository,
         your key role is to engage with engineers, offering precise and reliable
         information about repository-related issues. You are equipped with specialized
@@ -50,15 +58,35 @@ class ChainGPTAgent:
         3) You may be asked to run commands that produce files in the repository. Take care that the files you produce do not clash with
            the names of other files/directories in the repo. I.e, be sure to perform adequate reconnaissance in the repository.
 
-        {chat_history}
-        Question: {input}
-        {agent_scratchpad}
-        """ % self.url)
+        4) Independent tool calls, such as reading several files, should be requested together in one step
+           so that they run in parallel.
+        """ % self.url
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", instructions),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad")
+        ])
 
-        self.agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt)
-        memory = ConversationBufferMemory(memory_key="chat_history")
+        # The tools agent can request several tool calls per step, which `ainvoke` runs concurrently
+        self.agent = create_openai_tools_agent(llm=llm, tools=tools, prompt=prompt)
+        # Replays recent turns up to a token budget and summarizes older ones in the background
+        memory = TokenBudgetMemory(memory_key="chat_history")
         self.agent_executor = AgentExecutor(agent=self.agent, tools=tools, memory=memory)
 
 
     def prompt(self, msg: str, callback: BaseCallbackHandler=None) -> Iterator[LLMResponse]:
         output = self.agent_executor.invoke({"input": msg}, config={"callbacks": [callback]})
+
+    async def aprompt(self, msg: str, callback: BaseCallbackHandler=None):
+        """
+        Answers `msg` like `prompt`, but runs the tool calls of each step concurrently.
+        Should be awaited from the same event loop for the whole session.
+        """
+        await self.agent_executor.ainvoke({"input": msg}, config={"callbacks": [callback]})
+
+    def close(self):
+        """
+        Removes the session's sandbox container, if any.
+        """
+        self.env.close()
@@ -1,41 +1,61 @@
 # Standard lib
-import os
-from typing import Dict, Any
 import argparse
+import asyncio
 
 # 3rd party
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain_core.outputs.llm_result import LLMResult 
-from langchain_core.agents import AgentAction, AgentFinish
 
 # Local
-from chaingpt.cli.agent import ChainGPTAgent
-from chaingpt.cli.display import display_tool_call, display_response
-from chaingpt.utils.config import config
+from chaingpt.utils.deferred import Deferred
 
 
-class ChainGPTAgentCallback(BaseCallbackHandler):
-    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
-        """Run when chain ends running."""
-        output = finish.return_values["output"]
-        display_response(output)
-    
-    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
-        display_tool_call(tool_name=action.tool, tool_input=action.tool_input)
+def _make_agent(url: str):
+    # langchain, docker and the tool clients take seconds to import, so they are
+    # loaded on a background thread while the user types the first prompt
+    from chaingpt.cli.agent import ChainGPTAgent
+    return ChainGPTAgent(url)
 
 
 class ChainGPTApp:
     def __init__(self, url: str):
         self.url = url
-        self.agent = ChainGPTAgent(self.url)
+        self._start_agent()
 
-    def chatloop(self):
-        print("\nWelcome to ChainGPT! Provide a prompt or type `exit` to quit.")
+    def _start_agent(self):
+        self.agent = Deferred(lambda: _make_agent(self.url), "agent")
+
+    async def chatloop(self):
+        print("\nWelcome to ChainGPT! Provide a prompt, type `stats` to see the Wolfi index "
+              "progress and how scripts queued or `exit` to quit.")
         while True:
-            prompt = input("Enter a prompt > ")
+            # Reading stdin on a thread keeps the event loop free
+            prompt = await asyncio.to_thread(input, "Enter a prompt > ")
             if prompt == "exit":
+                # A sandbox only exists once the agent ran a script
+                if self.agent.done() and self.agent.exception() is None:
+                    self.agent.close()
                 return
-            self.agent.prompt(prompt, ChainGPTAgentCallback())
+            if prompt == "stats":
+                from chaingpt.api.system import get_scheduler_stats
+                from chaingpt.cli.display import display_index_progress, display_scheduler_stats
+                display_index_progress()
+                display_scheduler_stats(get_scheduler_stats())
+                continue
+            if not self.agent.done():
+                print("Starting the agent...")
+            from chaingpt.cli.display import display_error
+            try:
+                agent = await asyncio.to_thread(self.agent.result)
+            except Exception as e:
+                display_error(f"The agent could not start: {e}\n"
+                              "Check your OpenAI API key and the repository URL, then try again.")
+                # The next prompt starts the agent again
+                self._start_agent()
+                continue
+            from chaingpt.cli.callbacks import ChainGPTAgentCallback
+            try:
+                await agent.aprompt(prompt, ChainGPTAgentCallback())
+            except Exception as e:
+                display_error(f"The agent failed to answer: {e}")
 
 
 def main():
@@ -44,4 +64,4 @@ def main():
     args = parser.parse_args()
 
     app = ChainGPTApp(args.url)
-    app.chatloop()
+    asyncio.run(app.chatloop())
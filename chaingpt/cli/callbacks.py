@@ -0,0 +1,45 @@
+# Standard lib
+from typing import Dict, Any
+
+# 3rd party
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.agents import AgentAction, AgentFinish
+
+# Local
+from chaingpt.cli.display import display_tool_call, display_response, display_token, \
+    display_response_end
+
+
+class ChainGPTAgentCallback(BaseCallbackHandler):
+    # Async runs would otherwise hand each token to a thread pool, which can reorder them
+    run_inline = True
+
+    def __init__(self):
+        self.streamed = False
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, **kwargs: Any) -> Any:
+        self.streamed = False
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, **kwargs: Any) -> Any:
+        self.streamed = False
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+        # Steps that only call tools stream no content
+        if token:
+            self.streamed = True
+            display_token(token)
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        """Run when chain ends running."""
+        if self.streamed:
+            # The answer was already printed as it was generated
+            display_response_end()
+            return
+        output = finish.return_values["output"]
+        display_response(output)
+    
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        if self.streamed:
+            display_response_end()
+            self.streamed = False
+        display_tool_call(tool_name=action.tool, tool_input=action.tool_input)
@@ -1,10 +1,13 @@
 # Standard lib
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 # 3rd party
 from colorama import Fore, Style
 from emoji import emojize
 
+# Local
+from chaingpt.api.scheduler import SchedulerStats
+
 
 def _display_file_qa(tool_input: str):
     print(emojize(":page_facing_up: " + Fore.BLUE + "Analyzing " + Fore.YELLOW + tool_input["file_path"] + Fore.BLUE + ": " + Fore.YELLOW + tool_input["question"]))
@@ -16,6 +19,10 @@ def _display_search_path(tool_input: str):
     print(Style.RESET_ALL, end="")
 
 
+def _display_search_content(tool_input: str):
+    print(emojize(":magnifying_glass_tilted_left: " + Fore.BLUE + "Searching file contents for " + Fore.YELLOW + tool_input["query"]))
+    print(Style.RESET_ALL, end="")
+
 
 def _display_run_script(tool_input: str):
     deps_list = tool_input["deps"].replace(" ", "").split(",")
@@ -30,16 +37,41 @@ def _display_wolfi_search(tool_input: str):
     print(Style.RESET_ALL, end="")
 
 
+def _display_wolfi_lookup(tool_input: str):
+    print(emojize(":magnifying_glass_tilted_left: " + Fore.BLUE + "Looking up Wolfi packages providing " + Fore.YELLOW + tool_input["name"]))
+    print(Style.RESET_ALL, end="")
+
+
+def _display_reset_sandbox(tool_input: str):
+    print(emojize(":broom: " + Fore.BLUE + "Resetting the sandbox"))
+    print(Style.RESET_ALL, end="")
+
+
+def _display_read_output(tool_input: str):
+    print(emojize(":page_facing_up: " + Fore.BLUE + "Reading page " + Fore.YELLOW + str(tool_input.get("page", 1)) + Fore.BLUE + " of " + Fore.YELLOW + tool_input["handle"]))
+    print(Style.RESET_ALL, end="")
+
+
 # TODO: There is a better way to design the tool calls to scale
 def display_tool_call(tool_name: str, tool_input: Dict[str, str]):
     if tool_name == "file_qa":
         _display_file_qa(tool_input)
     elif tool_name == "search_path":
         _display_search_path(tool_input)
+    elif tool_name == "search_content":
+        _display_search_content(tool_input)
     elif tool_name == "run_script":
         _display_run_script(tool_input)
     elif tool_name == "wolfi_search":
         _display_wolfi_search(tool_input)
+    elif tool_name == "search_wolfi_many":
+        _display_wolfi_search(tool_input)
+    elif tool_name == "lookup_wolfi":
+        _display_wolfi_lookup(tool_input)
+    elif tool_name == "reset_sandbox":
+        _display_reset_sandbox(tool_input)
+    elif tool_name == "read_output":
+        _display_read_output(tool_input)
     else:
         # TODO: Implement an unknown tool case
         pass
@@ -47,4 +79,82 @@ def display_tool_call(tool_name: str, tool_input: Dict[str, str]):
 
 def display_response(response: str):
     print(Fore.GREEN + response)
-    print(Style.RESET_ALL, end="")
\ No newline at end of file
+    print(Style.RESET_ALL, end="")
+
+
+def display_error(message: str):
+    print(Fore.RED + message)
+    print(Style.RESET_ALL, end="")
+
+
+def display_token(token: str):
+    """
+    Prints the next piece of a streamed response without ending the line.
+    """
+    print(Fore.GREEN + token, end="", flush=True)
+
+
+def display_response_end():
+    print(Style.RESET_ALL)
+
+
+PROGRESS_LABELS = {
+    "refine": "Reading file in chunks",
+    "map": "Summarizing file chunks",
+    "reduce": "Merging chunk summaries"
+}
+
+
+def display_progress(stage: str, done: int, total: Optional[int]):
+    """
+    Redraws a single progress line, which ends once `done` reaches `total`.
+    """
+    label = PROGRESS_LABELS.get(stage, stage)
+    print("\r" + Fore.BLUE + label + ": " + Fore.YELLOW + f"{done}/{total if total is not None else '?'}",
+          end="", flush=True)
+    if done == total:
+        print(Style.RESET_ALL)
+
+
+# `(done, total)` package files of the Wolfi index being built in the background
+_index_progress: Optional[Tuple[int, int]] = None
+
+
+def record_index_progress(done: int, total: int):
+    """
+    Keeps the progress of the Wolfi index without printing it, since the index is
+    built while the user types. Shown by `display_index_progress`.
+    """
+    global _index_progress
+    _index_progress = (done, total)
+
+
+def display_index_progress():
+    """
+    Prints how far the local Wolfi package index has been built.
+    """
+    if _index_progress is None:
+        print(Fore.BLUE + "Local Wolfi package index: " + Fore.YELLOW + "preparing")
+    else:
+        done, total = _index_progress
+        state = f"{done}/{total} packages" if done < total else f"ready ({total} packages)"
+        print(Fore.BLUE + "Local Wolfi package index: " + Fore.YELLOW + state)
+    print(Style.RESET_ALL, end="")
+
+
+def display_scheduler_stats(stats: Optional[SchedulerStats]):
+    """
+    Prints how many scripts and image builds ran and how long they queued.
+    """
+    if stats is None:
+        print(Fore.BLUE + "No scripts have run yet.")
+    else:
+        print(Fore.BLUE + "Scripts running: " + Fore.YELLOW + str(stats.running)
+              + Fore.BLUE + ", queued: " + Fore.YELLOW + str(stats.queued)
+              + Fore.BLUE + " (max " + Fore.YELLOW + str(stats.max_queued) + Fore.BLUE + ")"
+              + ", completed: " + Fore.YELLOW + str(stats.completed)
+              + Fore.BLUE + ", gave up queueing: " + Fore.YELLOW + str(stats.timed_out))
+        print(Fore.BLUE + "Queue wait: " + Fore.YELLOW + f"{stats.mean_wait:.1f}s" + Fore.BLUE
+              + " mean, " + Fore.YELLOW + f"{stats.max_wait:.1f}s" + Fore.BLUE + " max, "
+              + Fore.YELLOW + str(stats.waited) + Fore.BLUE + " had to wait")
+    print(Style.RESET_ALL, end="")
@@ -1,20 +1,31 @@
 # Standard lib
-from typing import List
+from typing import Callable, List, Tuple
+import asyncio
 
 # 3rd Party
+from docker.errors import DockerException
 from langchain.tools import StructuredTool
 
 # Local
 from chaingpt.api.workspace import Workspace
-from chaingpt.api.wolfi import WolfiClient
-from chaingpt.api.system import SystemEnvironment
+from chaingpt.api.wolfi import IndexProgressCallback, WolfiClient
+from chaingpt.api.system import LazyEnvironment, RunResult
+from chaingpt.api.pool import PoolExhaustedError
+from chaingpt.api.scheduler import QueueTimeoutError
+from chaingpt.api.memory import OutputStore
+from chaingpt.api.llm import ProgressCallback
+from chaingpt.utils import config
+from chaingpt.utils.deferred import Deferred
+
+
+MAX_PARALLEL_TOOLS = config.config["llm"]["max_parallel_tools"]
 
 
 def _error(msg: str) -> str:
     return f"Error: {msg}"
 
 
-def get_tool_file_qa(workspace: Workspace) -> StructuredTool:
+def get_tool_file_qa(workspace: Workspace, on_progress: ProgressCallback=None) -> StructuredTool:
     def file_qa(question: str, file_path: str) -> str:
         """
         Input a question and a filename. File paths are relative to the top-level
@@ -22,8 +33,8 @@ def get_tool_file_qa(workspace: Workspace) -> StructuredTool:
         provides the answer.
         """
         try:
-            return workspace.fileqa(question, file_path)
-        except FileNotFoundError as e:
+            return workspace.fileqa(question, file_path, on_progress=on_progress).output
+        except (FileNotFoundError, ValueError) as e:
             return _error(str(e))
     
     return StructuredTool.from_function(file_qa)
@@ -38,13 +49,77 @@ def get_tool_search_path(workspace: Workspace) -> StructuredTool:
         cloned repository. For example, to get all of the files in the top-level
         directory, pass * to path.
         """
-        dirs, files = workspace.search(path)
+        try:
+            dirs, files = workspace.search(path)
+        except ValueError as e:
+            return _error(str(e))
         return "Directories: [" + ", ".join(dirs) + "]\nFiles: [" + ", ".join(files) + "]"
 
     return StructuredTool.from_function(search_path)
 
 
-def get_tool_run_script(callback: any) -> StructuredTool:
+def get_tool_search_content(workspace: Workspace) -> StructuredTool:
+    def search_content(query: str, regex: bool=False) -> str:
+        """
+        Searches the contents of every text file in the cloned repository for lines
+        containing query. Set regex to true to treat query as a Python regular expression.
+        Results are returned in [path]:[line number]: [line] format. Much faster and cheaper
+        than file_qa, so use this tool to find where something is defined or used before
+        reading whole files.
+        """
+        try:
+            matches = workspace.search_content(query, regex=regex)
+        except ValueError as e:
+            return _error(str(e))
+        if not matches:
+            return "No matches found."
+        return "\n".join(f"{m.path}:{m.line_number}: {m.line.strip()[:200]}" for m in matches)
+
+    return StructuredTool.from_function(search_content)
+
+
+def _check_deps(client: WolfiClient, deps: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Validates `deps` against the local Wolfi index before a container is started.
+    Returns the corrected deps and a `List` of problems with unknown packages.
+    """
+    checked = []
+    problems = []
+    for check in client.check_packages(deps):
+        if check.package is not None:
+            checked.append(check.package)
+        elif check.suggestions:
+            problems.append(f"{check.name} (did you mean {', '.join(check.suggestions)}?)")
+        else:
+            problems.append(f"{check.name} (no similar packages, try search_wolfi)")
+    return checked, problems
+
+
+def _format_run_result(result: RunResult) -> str:
+    response = f"Exit code: {result.return_code} ({result.duration:.1f}s)\n"
+    if result.timed_out:
+        response += "The script was killed for exceeding its time limit.\n"
+    if result.stdout:
+        response += f"stdout:\n{result.stdout}\n"
+    if result.stderr:
+        response += f"stderr:\n{result.stderr}\n"
+    return response
+
+
+SANDBOX_NOTES = """
+        The environment is a persistent sandbox for this session. Installed packages, files,
+        the working directory and exported variables carry over to later run_script calls,
+        so later scripts can build on earlier ones. Call reset_sandbox to start over from
+        a clean environment.
+"""
+
+
+def get_tool_run_script(callback: any, client: WolfiClient, workspace: Workspace,
+                        env: LazyEnvironment=None) -> StructuredTool:
+    if env is None:
+        # Docker is only needed once a script runs
+        env = LazyEnvironment()
+
     def run_script(script: str, deps: str) -> str:
         """
         Executes the provided script in an isolated Wolfi environment.
@@ -52,34 +127,62 @@ def get_tool_run_script(callback: any) -> StructuredTool:
         Scripts should take the form of one-liner shell scripts. Use && to chain
         together multiple commands.
 
-        The results of stdout and stdin are returned. Any changes the script makes
+        The exit code, the duration and stdout and stderr are returned. The middle of long
+        outputs is omitted. Scripts exceeding the time limit are killed, so avoid commands
+        that never terminate. Any changes the script makes
         to the environment are not persisted. You will have to specify dependencies via the 
         deps argument, a comma separated list of Wolfi packages the script depends on.
         For example, a script requiring git and python 3.10 would pass "python-3.10, git" for deps. All deps
         are specific to Wolfi. Use the search_wolfi tool to lookup the names of these dependencies.
+        Unknown packages are rejected with suggestions before anything is run.
 
-        The environment does not have the repository preinstalled. If you wish to use the environment to test
-        interactions with the repository, be sure to clone the repo first in the commands passed to this tool.
+        A copy of the repository is already in the environment and scripts start in its top-level
+        directory, so do not clone it. Changes the script makes to the copy are discarded afterwards.
 
         Do not use docker within the environment.
         """
         deps_list = deps.split(",")
         deps_list = [d.strip(" \n") for d in deps_list]
+        deps_list, problems = _check_deps(client, [d for d in deps_list if d])
+        if problems:
+            return _error("Unknown Wolfi packages: " + "; ".join(problems)
+                          + ". The script was not run.")
+
+        try:
+            result = env.run(script, deps=deps_list, workspace=workspace,
+                             on_output=lambda _, text: callback(text))
+        except (PoolExhaustedError, QueueTimeoutError) as e:
+            return _error(f"{e}. Try again later.")
+        except DockerException as e:
+            return _error(f"Scripts cannot run because Docker is unavailable: {e}")
+        return _format_run_result(result)
+
+    if not env.sandboxed:
+        return StructuredTool.from_function(run_script)
+    # Scripts share one container, so the notes about discarded changes no longer apply
+    description = run_script.__doc__
+    description = description.replace(" Any changes the script makes\n"
+                                      "        to the environment are not persisted.", "")
+    description = description.replace(" Changes the script makes to the copy "
+                                      "are discarded afterwards.", "")
+    return StructuredTool.from_function(run_script, description=description + SANDBOX_NOTES)
 
-        env = SystemEnvironment()
 
-        response = ""
-        for output in env.run(script, deps=deps_list):
-            callback(output)
-            response += output
-        
-        return response[-1000:]
+def get_tool_reset_sandbox(env: LazyEnvironment) -> StructuredTool:
+    def reset_sandbox() -> str:
+        """
+        Discards the persistent sandbox of run_script, including installed packages, files,
+        variables and changes to the repository copy. The next script starts from a clean
+        environment. Use this when earlier scripts left the environment in a broken state.
+        """
+        env.reset()
+        return "The sandbox was reset."
 
-    return StructuredTool.from_function(run_script)
+    return StructuredTool.from_function(reset_sandbox)
 
 
 def get_tool_wolfi_search(client: WolfiClient) -> StructuredTool:
-    def search_wolfi(keyword: str) -> str:
+    def search_wolfi(keyword: str, page: int=1) -> str:
         """
         Searches Wolfi for packages that match the provided keyword.
         Useful for determining which package names to pass to the deps argument
@@ -91,9 +194,13 @@ def get_tool_wolfi_search(client: WolfiClient) -> StructuredTool:
         python-3.12: The Python 3.12 software library
 
         If the script depends on Python 3.10, you would pass "python-3.10" to deps, along with
-        any other packages you wish to include.
+        any other packages you wish to include. Only the best matches are returned. Increment
+        page to see more results for the same keyword.
         """
-        results = client.search(keyword)
+        try:
+            results = client.search(keyword, page=page)
+        except ValueError as e:
+            return _error(str(e))
         results_str = ""
         for r in results:
             results_str += f"{r.name}: {r.description}\n"
@@ -102,11 +209,109 @@ def get_tool_wolfi_search(client: WolfiClient) -> StructuredTool:
     return StructuredTool.from_function(search_wolfi)
 
 
-def get_tools(url: str, callback: any) -> List[StructuredTool]:
-    wk = Workspace(url)
-    return [
-        get_tool_file_qa(wk),
+def get_tool_wolfi_search_many(client: WolfiClient) -> StructuredTool:
+    def search_wolfi_many(keywords: str) -> str:
+        """
+        Searches Wolfi for several comma separated keywords at once, e.g. "python, git, make".
+        Prefer this tool over repeated search_wolfi calls when the script needs several
+        dependencies. Results are grouped by keyword in [name]: [description] format.
+        """
+        keywords_list = [k.strip(" \n") for k in keywords.split(",")]
+        results = client.search_many([k for k in keywords_list if k])
+        results_str = ""
+        for keyword, matches in results.items():
+            results_str += f"# {keyword}\n"
+            for r in matches:
+                results_str += f"{r.name}: {r.description}\n"
+            if not matches:
+                results_str += "No matches found.\n"
+        return results_str
+
+    return StructuredTool.from_function(search_wolfi_many)
+
+
+def get_tool_wolfi_lookup(client: WolfiClient) -> StructuredTool:
+    def lookup_wolfi(name: str) -> str:
+        """
+        Finds the exact Wolfi packages named name or providing it. Works for package names,
+        commands (e.g. make), shared libraries (e.g. libssl.so.3) and pkg-config names.
+        Results are returned in [package] [version] (from [origin package]) format. Use this
+        before search_wolfi when you know the command or library the script needs.
+        """
+        try:
+            results = client.lookup(name)
+        except TypeError as e:
+            return _error(str(e))
+        if not results:
+            return "No packages found. Try search_wolfi."
+        return "\n".join(f"{r.name} {r.version} (from {r.origin})" for r in results)
+
+    return StructuredTool.from_function(lookup_wolfi)
+
+
+def get_tool_read_output(store: OutputStore) -> StructuredTool:
+    def read_output(handle: str, page: int=1) -> str:
+        """
+        Reads a page of a long tool output that was truncated. Pass the handle and a page
+        number from the note at the end of the truncated output. Pages start at 1.
+        """
+        try:
+            return store.read(handle, page)
+        except (KeyError, ValueError) as e:
+            return _error(str(e))
+
+    return StructuredTool.from_function(read_output)
+
+
+def _offload_output(func: Callable[..., str], store: OutputStore) -> Callable[..., str]:
+    """
+    Returns `func` with long outputs replaced by a preview and a handle into `store`.
+    """
+    def offloaded(*args, **kwargs) -> str:
+        return store.offload(func(*args, **kwargs))
+    return offloaded
+
+
+def _limit_concurrency(func: Callable[..., str],
+                       semaphore: asyncio.Semaphore) -> Callable[..., str]:
+    """
+    Returns a coroutine that runs `func` on a worker thread once `semaphore` admits it,
+    so the tool calls of one agent step run concurrently without blocking the event loop.
+    """
+    async def coroutine(*args, **kwargs) -> str:
+        async with semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+    return coroutine
+
+
+def get_tools(url: str, callback: any, env: LazyEnvironment=None,
+              max_parallel: int=MAX_PARALLEL_TOOLS,
+              on_progress: ProgressCallback=None,
+              on_index_progress: IndexProgressCallback=None) -> List[StructuredTool]:
+    # Cloning the repository and preparing the Wolfi index run concurrently in the
+    # background. Tools only block on them when they are called before they are ready
+    wk = Deferred(lambda: Workspace(url), "workspace")
+    wolfi = Deferred(lambda: WolfiClient(on_progress=on_index_progress), "wolfi")
+    if env is None:
+        env = LazyEnvironment()
+    tools = [
+        get_tool_file_qa(wk, on_progress),
         get_tool_search_path(wk),
-        get_tool_run_script(callback),
-        get_tool_wolfi_search(WolfiClient())
+        get_tool_search_content(wk),
+        get_tool_run_script(callback, wolfi, wk, env),
+        get_tool_wolfi_search(wolfi),
+        get_tool_wolfi_search_many(wolfi),
+        get_tool_wolfi_lookup(wolfi)
     ]
+    if env.sandboxed:
+        tools.append(get_tool_reset_sandbox(env))
+    # Long outputs would otherwise fill the prompt for the rest of the turn
+    store = OutputStore()
+    for tool in tools:
+        tool.func = _offload_output(tool.func, store)
+    tools.append(get_tool_read_output(store))
+    # Shared by every tool, so `max_parallel` caps the calls of a step in total
+    semaphore = asyncio.Semaphore(max_parallel)
+    for tool in tools:
+        tool.coroutine = _limit_concurrency(tool.func, semaphore)
+    return tools
@@ -11,6 +11,20 @@ import yaml
 CONFIG_FILE_NAME = os.path.join(Path.home(), ".chaingpt", "config.yaml")
 
 
+def _check_config(config: Dict):
+    """
+    Rejects settings of older configs whose meaning has changed, rather than
+    silently reading them with their new meaning.
+    """
+    map_reduce = config.get("llm", {}).get("map_reduce") or {}
+    if "chunk_sz" in map_reduce:
+        print("`llm.map_reduce.chunk_sz` is no longer supported. File chunks are now measured "
+              "in tokens: set `chunk_tokens` instead (or `null` to fit the model) and give "
+              "`chunk_overlap` in tokens rather than characters. A token is about 4 characters. "
+              "Running generate_config.py again writes a config with the current defaults.")
+        exit(-1)
+
+
 def _load_config() -> Dict:
     """
     Searches for a file called config.yaml in the current working
@@ -18,10 +32,12 @@ def _load_config() -> Dict:
     """
     try:
         with open(CONFIG_FILE_NAME, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+            config = yaml.safe_load(f)
     except FileNotFoundError:
         print("Missing configuration file. Did you run generate_config.py?")
         exit(-1)
+    _check_config(config)
+    return config
 
 
 config = _load_config()
\ No newline at end of file
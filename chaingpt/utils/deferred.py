@@ -0,0 +1,48 @@
+# Standard lib
+from typing import Any, Callable, Generic, Optional, TypeVar
+from concurrent.futures import Future
+import threading
+
+# 3rd party
+
+# Local
+
+
+T = TypeVar("T")
+
+
+class Deferred(Generic[T]):
+    """
+    Computes `fn()` on a background thread as soon as it is created. Attribute
+    access is forwarded to the result and blocks until it is ready, so a
+    `Deferred` can stand in for the object it computes. Exceptions raised by
+    `fn` are raised again on every access.
+    """
+    def __init__(self, fn: Callable[[], T], name: Optional[str]=None):
+        self._future = Future()
+        threading.Thread(target=self._run, args=(fn,), name=name, daemon=True).start()
+
+    def _run(self, fn: Callable[[], T]):
+        try:
+            self._future.set_result(fn())
+        except BaseException as e:
+            self._future.set_exception(e)
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def exception(self) -> Optional[BaseException]:
+        """
+        Returns the exception raised by `fn`, or `None` if it succeeded.
+        Blocks until `fn` returns.
+        """
+        return self._future.exception()
+
+    def result(self, timeout: Optional[float]=None) -> T:
+        """
+        Blocks until `fn` returns and returns its result.
+        """
+        return self._future.result(timeout)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.result(), name)
@@ -0,0 +1,167 @@
+# Standard lib
+from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+import json
+import os
+import threading
+
+# 3rd party
+import pytest
+from sh import git
+from langchain_core.runnables import RunnableLambda
+
+# Local
+from chaingpt.api import llm, workspace
+from chaingpt.api.server import SessionServer
+from chaingpt.api.session import WorkspaceCache
+from chaingpt.api.wolfi import WolfiPackageResult
+from tests.api.unittests.utils import local_repo, local_repo_url
+
+
+class FakeWolfi():
+    def search(self, keyword, page: int=1):
+        if not isinstance(keyword, str):
+            raise TypeError("`keyword` must be a `str`.")
+        return [WolfiPackageResult(f"{keyword}-{page}", "A package")]
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    Fixture that serves workspaces on a free local port with a fake LLM
+    and a fake Wolfi client. Yields the base URL of the service.
+    """
+    cache_dir = os.path.join(tmp_path, "cache")
+    monkeypatch.setattr(workspace, "REPOSITORY_DIR", cache_dir)
+    # Set directly in the module, since reading the real chain first would build it
+    monkeypatch.setitem(vars(llm), "qa_chain",
+                        RunnableLambda(lambda x: f"{x['file_path']}: {x['question']}"))
+    cache = WorkspaceCache(max_sessions=2, ttl=None, cache_dir=cache_dir)
+    srv = SessionServer(("127.0.0.1", 0), cache, FakeWolfi(), sweep_interval=None)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+    thread.join()
+
+
+def request(url: str, method: str="GET", body: Dict=None) -> Tuple[int, Dict]:
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    req = Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(req) as resp:
+            return resp.status, json.loads(resp.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test__session_lifecycle(server, local_repo_url):
+    """
+    Checks that a session can be created, queried and closed.
+    """
+    status, body = request(f"{server}/sessions", "POST", {"url": local_repo_url})
+    assert status == 201
+    id = body["session_id"]
+
+    status, body = request(f"{server}/sessions/{id}/paths?path=src/*")
+    assert status == 200
+    assert body == {"directories": [], "files": ["src/main.py"]}
+
+    status, body = request(f"{server}/sessions/{id}/fileqa", "POST",
+                           {"question": "What does it print?", "file_path": "src/main.py"})
+    assert status == 200
+    assert body["output"] == "src/main.py: What does it print?"
+
+    status, _ = request(f"{server}/sessions/{id}", "DELETE")
+    assert status == 200
+    status, _ = request(f"{server}/sessions/{id}/paths?path=*")
+    assert status == 404
+
+
+def test__errors(server, local_repo_url):
+    """
+    Checks that bad requests, unknown sessions, missing files
+    and unknown routes are reported with matching status codes.
+    """
+    _, body = request(f"{server}/sessions", "POST", {"url": local_repo_url})
+    id = body["session_id"]
+    assert request(f"{server}/sessions/{id}/fileqa", "POST",
+                   {"question": 1, "file_path": "README.md"})[0] == 400
+    assert request(f"{server}/sessions/{id}/fileqa", "POST",
+                   {"question": "Why?", "file_path": "dne.txt"})[0] == 404
+    assert request(f"{server}/sessions/id-1234/paths?path=*")[0] == 404
+    assert request(f"{server}/sessions", "POST", {})[0] == 400
+    assert request(f"{server}/dne")[0] == 404
+
+
+def test__rejects_traversal(server, local_repo_url):
+    """
+    Checks that absolute paths and paths containing `..` are rejected.
+    """
+    _, body = request(f"{server}/sessions", "POST", {"url": local_repo_url})
+    id = body["session_id"]
+    for path in ["/etc/passwd", "../README.md", "src/../../README.md"]:
+        status, _ = request(f"{server}/sessions/{id}/fileqa", "POST",
+                            {"question": "Why?", "file_path": path})
+        assert status == 400
+    for path in ["/etc/*", "..", "../*", "src/../../*"]:
+        assert request(f"{server}/sessions/{id}/paths?path={quote(path)}")[0] == 400
+
+
+def test__rejects_symlink_escape(server, local_repo, local_repo_url, tmp_path):
+    """
+    Checks that a file that links outside of the repository is rejected.
+    """
+    secret = os.path.join(tmp_path, "secret.txt")
+    with open(secret, "w") as f:
+        f.write("secret\n")
+    os.symlink(secret, os.path.join(local_repo, "leak.txt"))
+    git("-C", local_repo, "add", "leak.txt")
+    git("-C", local_repo, "-c", "user.name=test", "-c", "user.email=test@example.com",
+        "commit", "--quiet", "-m", "Add link")
+
+    _, body = request(f"{server}/sessions", "POST", {"url": local_repo_url})
+    status, _ = request(f"{server}/sessions/{body['session_id']}/fileqa", "POST",
+                        {"question": "Why?", "file_path": "leak.txt"})
+    assert status == 400
+
+
+def test__rejects_non_github_urls(server, local_repo):
+    """
+    Checks that sessions can only be created from https GitHub URLs.
+    """
+    for url in [local_repo, f"file://{local_repo}", "http://github.com/test/project.git",
+                "https://example.com/test/project.git", "git@github.com:test/project.git",
+                "https://github.com/test/.."]:
+        assert request(f"{server}/sessions", "POST", {"url": url})[0] == 400
+    _, stats = request(f"{server}/stats")
+    assert stats["created"] == 0
+
+
+def test__wolfi_search(server):
+    """
+    Checks that Wolfi searches are answered by the shared client.
+    """
+    status, body = request(f"{server}/wolfi/search?keyword=curl&page=2")
+    assert status == 200
+    assert body == {"results": [{"name": "curl-2", "description": "A package"}]}
+    assert request(f"{server}/wolfi/search?keyword=curl&page=x")[0] == 400
+
+
+def test__concurrent_sessions_are_bounded(server, local_repo_url):
+    """
+    Checks that concurrent users each get a session and that
+    the cache evicts down to its bound.
+    """
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: request(f"{server}/sessions", "POST",
+                                                  {"url": local_repo_url}), range(4)))
+    assert all(status == 201 for status, _ in results)
+    _, stats = request(f"{server}/stats")
+    assert stats["sessions"] == 2
+    assert stats["created"] == 4
+    assert stats["evicted"] == 2
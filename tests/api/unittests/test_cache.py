@@ -0,0 +1,98 @@
+# Standard lib
+import os
+import subprocess
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.cache import LLMCache, git_blob_sha, make_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """
+    Fixture that creates an empty cache limited to 100 bytes.
+    """
+    cache = LLMCache(os.path.join(tmp_path, "cache.sqlite3"), max_size=100)
+    yield cache
+    cache.close()
+
+
+def test__git_blob_sha__matches_git(tmp_path):
+    """
+    Checks that the blob SHA matches the output of `git hash-object`.
+    """
+    path = os.path.join(tmp_path, "file.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Hello, world! é\n" * 100)
+    expected = subprocess.check_output(["git", "hash-object", path], text=True).strip()
+    assert git_blob_sha(path) == expected
+
+
+def test__make_key__deterministic():
+    """
+    Checks that equal parts produce equal keys and different parts do not.
+    """
+    assert make_key("a", 1, {"x": 1, "y": 2}) == make_key("a", 1, {"y": 2, "x": 1})
+    assert make_key("a", 1) != make_key("a", 2)
+
+
+class TestLLMCache:
+    def test__get__miss(self, cache):
+        """
+        Checks that a missing key returns `None` and counts a miss.
+        """
+        assert cache.get("key") is None
+        assert cache.misses == 1
+        assert cache.hits == 0
+
+
+    def test__get__hit(self, cache):
+        """
+        Checks that a stored value is returned and counts a hit.
+        """
+        cache.put("key", "value")
+        assert cache.get("key") == "value"
+        assert cache.hits == 1
+
+
+    def test__get__persistent(self, cache):
+        """
+        Checks that values are visible to a new cache opened on the same file.
+        """
+        cache.put("key", "value")
+        other = LLMCache(cache.path, max_size=100)
+        assert other.get("key") == "value"
+        other.close()
+
+
+    def test__put__evicts_least_recently_used(self, cache):
+        """
+        Checks that the least recently used entries are evicted once
+        the cache exceeds its maximum size.
+        """
+        cache.put("a", "A" * 39)
+        cache.put("b", "B" * 39)
+        cache.get("a")
+        cache.put("c", "C" * 39)
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.size() <= 100
+
+
+    def test__put__value_too_large(self, cache):
+        """
+        Checks that values larger than the cache are not stored.
+        """
+        cache.put("key", "V" * 200)
+        assert cache.get("key") is None
+
+
+    def test__init__invalid_max_size(self, tmp_path):
+        """
+        Checks that a `ValueError` is raised for a non-positive `max_size`.
+        """
+        with pytest.raises(ValueError):
+            LLMCache(os.path.join(tmp_path, "cache.sqlite3"), max_size=0)
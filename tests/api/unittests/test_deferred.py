@@ -0,0 +1,58 @@
+# Standard lib
+import threading
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.utils.deferred import Deferred
+
+
+def test__result__computed_in_background():
+    """
+    Checks that the value is computed without waiting for it to be used.
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait()
+        return 42
+    deferred = Deferred(compute)
+    assert started.wait(5)
+    assert not deferred.done()
+    release.set()
+    assert deferred.result(5) == 42
+    assert deferred.done()
+
+
+def test__getattr__forwards_to_result():
+    """
+    Checks that attribute access blocks on and is forwarded to the result.
+    """
+    deferred = Deferred(lambda: "chaingpt")
+    assert deferred.upper() == "CHAINGPT"
+
+
+def test__result__reraises():
+    """
+    Checks that exceptions raised by the computation are raised on every access.
+    """
+    def fail():
+        raise FileNotFoundError("no repository")
+    deferred = Deferred(fail)
+    with pytest.raises(FileNotFoundError):
+        deferred.result()
+    with pytest.raises(FileNotFoundError):
+        deferred.upper()
+
+
+def test__exception():
+    """
+    Checks that the exception of a failed computation is returned, and `None` otherwise.
+    """
+    def fail():
+        raise ValueError("boom")
+    assert isinstance(Deferred(fail).exception(), ValueError)
+    assert Deferred(lambda: 1).exception() is None
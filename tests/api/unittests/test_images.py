@@ -0,0 +1,122 @@
+# Standard lib
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.images import ImageBackend, ImageCache, CachedImage, canonical_deps, image_tag
+from chaingpt.api.scheduler import Scheduler
+from tests.api.unittests.utils import FakeImageBackend
+
+
+BASE = "wolfi-base:latest"
+
+
+def test__canonical_deps():
+    """
+    Checks that dependency sets are sorted and deduplicated.
+    """
+    assert canonical_deps(["make", " git", "make", ""]) == ("git", "make")
+
+
+def test__image_tag__order_independent():
+    """
+    Checks that the same set of deps maps to the same image.
+    """
+    assert image_tag(BASE, ["git", "make"]) == image_tag(BASE, ["make", "git", "git"])
+    assert image_tag(BASE, ["git"]) != image_tag(BASE, ["make"])
+    assert image_tag(BASE, ["git"]) != image_tag("other:latest", ["git"])
+
+
+def test__request__builds_once():
+    """
+    Checks that an image is built on request and then found.
+    """
+    backend = FakeImageBackend()
+    cache = ImageCache(backend, BASE, max_size=1000)
+    assert cache.get(["git"]) is None
+    cache.request(["git"])
+    cache.request(["git"])
+    cache.wait()
+    cache.request(["git"])
+    assert cache.get(["git"]) == image_tag(BASE, ["git"])
+    assert backend.builds == [["git"]]
+
+
+def test__request__waits_for_scheduler():
+    """
+    Checks that builds wait for a slot of the scheduler, like scripts.
+    """
+    backend = FakeImageBackend()
+    scheduler = Scheduler(max_concurrent=1)
+    cache = ImageCache(backend, BASE, max_size=1000, scheduler=scheduler)
+    with scheduler.slot():
+        cache.request(["git"])
+        while scheduler.stats().queued == 0:
+            pass
+        assert backend.builds == []
+    cache.wait()
+    assert backend.builds == [["git"]]
+    assert scheduler.stats().completed == 2
+
+
+def test__request__failed_build():
+    """
+    Checks that a failed build leaves no image behind.
+    """
+    backend = FakeImageBackend()
+    backend.fail = True
+    cache = ImageCache(backend, BASE, max_size=1000)
+    cache.request(["nope"])
+    cache.wait()
+    assert cache.get(["nope"]) is None
+
+
+def test__request__evicts_least_recently_used():
+    """
+    Checks that the least recently used images are removed once the
+    cache grows past its maximum size.
+    """
+    evicted = []
+    backend = FakeImageBackend(size=100)
+    cache = ImageCache(backend, BASE, max_size=250, on_evict=evicted.append)
+    for deps in (["a"], ["b"]):
+        cache.request(deps)
+        cache.wait()
+    cache.get(["a"])
+    cache.request(["c"])
+    cache.wait()
+    assert evicted == [image_tag(BASE, ["b"])]
+    assert backend.removed == evicted
+    assert cache.size() == 200
+
+
+def test__init__loads_existing_images():
+    """
+    Checks that images built by earlier processes are reused.
+    """
+    tag = image_tag(BASE, ["git"])
+    backend = FakeImageBackend(existing=[CachedImage(tag, ["git"], 100, 0)])
+    cache = ImageCache(backend, BASE, max_size=1000)
+    assert cache.get(["git"]) == tag
+    assert cache.size() == 100
+
+
+def test__init__invalid_max_size():
+    """
+    Checks that a `ValueError` is raised if `max_size` is not positive.
+    """
+    with pytest.raises(ValueError):
+        ImageCache(FakeImageBackend(), BASE, max_size=0)
+
+
+def test__image_backend__incomplete_subclass():
+    """
+    Checks that a backend missing part of the interface cannot be created.
+    """
+    class BuildOnly(ImageBackend):
+        def build(self, base_image, deps, tag):
+            return 0
+
+    with pytest.raises(TypeError):
+        BuildOnly()
@@ -0,0 +1,321 @@
+# Standard lib
+import os
+
+# 3rd party
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+# Local
+from chaingpt.api import llm
+from chaingpt.api.cache import LLMCache
+from chaingpt.api.tokens import context_window, count_tokens
+from chaingpt.utils import config
+
+
+@pytest.fixture
+def fake_chains(monkeypatch):
+    """
+    Fixture that replaces the LLM chains with local fakes. Each chunk is
+    summarized as its first character and summaries are merged with `+`.
+    Returns the list of calls made to the fake chains.
+    """
+    calls = []
+
+    def summarize(x):
+        calls.append("summarize")
+        return x["summary"] + x["chunk"][0]
+
+    def map_chunk(x):
+        calls.append("map")
+        return x["chunk"][0]
+
+    def combine(x):
+        calls.append("combine")
+        return "+".join(x["summaries"])
+
+    # Set directly in the module, since reading the real chains first would build them
+    monkeypatch.setitem(vars(llm), "summarize_chunk_chain", RunnableLambda(summarize))
+    monkeypatch.setitem(vars(llm), "map_chunk_chain", RunnableLambda(map_chunk))
+    monkeypatch.setitem(vars(llm), "combine_summaries_chain", RunnableLambda(combine))
+    monkeypatch.setitem(vars(llm), "read_summary_chain", RunnableLambda(lambda x: x["summary"]))
+    return calls
+
+
+@pytest.fixture
+def recorded_prompts(monkeypatch):
+    """
+    Fixture that builds the real chains on a fake chat model, which answers
+    `"answer"`. Returns the list of prompts sent to the model.
+    """
+    import langchain_openai
+    prompts = []
+
+    def chat(prompt):
+        prompts.append(prompt.to_string())
+        return "answer"
+
+    monkeypatch.setattr(langchain_openai, "ChatOpenAI", lambda **kwargs: RunnableLambda(chat))
+    for name, chain in llm._build_chains().items():
+        monkeypatch.setitem(vars(llm), name, chain)
+    return prompts
+
+
+def _chunked_text(n: int) -> str:
+    """
+    Returns text that splits into `n` chunks of 40 tokens
+    when using a chunk size of 50.
+    """
+    return "\n\n".join(" ".join(chr(ord("A") + i) * 40) for i in range(n))
+
+
+def test__text_qa_map_reduce__map_reduce_preserves_order(fake_chains):
+    """
+    Checks that the tree reduce merges partial summaries in file order.
+    """
+    response = llm.text_qa_map_reduce("question", _chunked_text(9),
+                                      chunk_size=50, chunk_overlap=0,
+                                      strategy="map_reduce", reduce_fanout=4)
+    assert response.output == "A+B+C+D+E+F+G+H+I"
+
+
+def test__text_qa_map_reduce__map_reduce_call_count(fake_chains):
+    """
+    Checks that every chunk is mapped once and merged in log depth.
+    """
+    llm.text_qa_map_reduce("question", _chunked_text(9),
+                           chunk_size=50, chunk_overlap=0,
+                           strategy="map_reduce", reduce_fanout=4)
+    assert fake_chains.count("map") == 9
+    # 9 -> 3 (two merges and a carried summary) -> 1
+    assert fake_chains.count("combine") == 3
+
+
+def test__text_qa_map_reduce__refine(fake_chains):
+    """
+    Checks that the refine strategy visits chunks sequentially.
+    """
+    response = llm.text_qa_map_reduce("question", _chunked_text(3),
+                                      chunk_size=50, chunk_overlap=0,
+                                      strategy="refine")
+    assert response.output.endswith("ABC")
+    assert fake_chains == ["summarize"] * 3
+
+
+def test__text_qa_map_reduce__map_reduce_progress(fake_chains):
+    """
+    Checks that every map and merge call is reported and that the totals are exact.
+    """
+    progress = []
+    llm.text_qa_map_reduce("question", _chunked_text(9),
+                           chunk_size=50, chunk_overlap=0, strategy="map_reduce",
+                           reduce_fanout=4, prefilter=False,
+                           on_progress=lambda *p: progress.append(p))
+    maps = [p for p in progress if p[0] == "map"]
+    reduces = [p for p in progress if p[0] == "reduce"]
+    assert [done for _, done, _ in maps] == list(range(1, 10))
+    assert maps[-1] == ("map", 9, 9)
+    assert reduces == [("reduce", 2, 3), ("reduce", 3, 3)]
+
+
+def test__text_qa_map_reduce__refine_progress(fake_chains):
+    """
+    Checks that the refine strategy reports each chunk and ends with the total.
+    """
+    progress = []
+    llm.text_qa_map_reduce("question", _chunked_text(3),
+                           chunk_size=50, chunk_overlap=0, strategy="refine",
+                           prefilter=False, on_progress=lambda *p: progress.append(p))
+    assert progress == [("refine", 1, None), ("refine", 2, None), ("refine", 3, None),
+                        ("refine", 3, 3)]
+
+
+def test__get_chain__patched_chain_takes_precedence(fake_chains):
+    """
+    Checks that chains assigned to the module are used instead of building new ones.
+    """
+    assert llm.get_chain("map_chunk_chain").invoke({"chunk": "xyz"}) == "x"
+
+
+def test__get_chain__unknown_chain():
+    """
+    Checks that a `ValueError` is raised for an unknown chain name.
+    """
+    with pytest.raises(ValueError):
+        llm.get_chain("unknown_chain")
+
+
+def test__text_qa_map_reduce__unknown_strategy(fake_chains):
+    """
+    Checks that a `ValueError` is raised for an unknown strategy.
+    """
+    with pytest.raises(ValueError):
+        llm.text_qa_map_reduce("question", _chunked_text(3),
+                               chunk_size=50, strategy="unknown")
+
+
+def test__text_qa_map_reduce__fanout_too_small(fake_chains):
+    """
+    Checks that a `ValueError` is raised if `reduce_fanout` is less than 2.
+    """
+    with pytest.raises(ValueError):
+        llm.text_qa_map_reduce("question", _chunked_text(3),
+                               chunk_size=50, reduce_fanout=1)
+
+
+def test__text_qa_map_reduce__cached_chunks(fake_chains, tmp_path):
+    """
+    Checks that chunk summaries are reused from the cache on a repeated call.
+    """
+    cache = LLMCache(os.path.join(tmp_path, "cache.sqlite3"), max_size=1 << 20)
+    first = llm.text_qa_map_reduce("question", _chunked_text(4),
+                                   chunk_size=50, chunk_overlap=0,
+                                   strategy="map_reduce", cache=cache)
+    calls = len(fake_chains)
+    second = llm.text_qa_map_reduce("question", _chunked_text(4),
+                                    chunk_size=50, chunk_overlap=0,
+                                    strategy="map_reduce", cache=cache)
+    assert second.output == first.output
+    assert len(fake_chains) == calls
+    assert first.cache_misses == 5
+    assert second.cache_hits == 5
+    assert second.cache_misses == 0
+
+
+def test__text_qa_map_reduce__text_fits_in_chunk(fake_chains):
+    """
+    Checks that a `ValueError` is raised if the text has no more
+    tokens than `chunk_size`.
+    """
+    with pytest.raises(ValueError):
+        llm.text_qa_map_reduce("question", _chunked_text(1), chunk_size=50)
+
+
+def test__text_qa__sends_content_unchanged(recorded_prompts):
+    """
+    Checks that the text of a file that fits in one chunk is sent
+    verbatim inside the QA prompt.
+    """
+    text = "def main():\n    print('hello')\n"
+    response = llm.text_qa("What does it print?", text, "src/main.py")
+    assert response.output == "answer"
+    assert recorded_prompts == [llm.qa_prompt.format(file_path="src/main.py",
+                                                     question="What does it print?",
+                                                     content=text)]
+
+
+def test__chunk_token_budget__fits_context_window():
+    """
+    Checks that the chunk budget leaves room for the prompt and response.
+    """
+    budget = llm.chunk_token_budget("What is this project?", "README.md")
+    assert 0 < budget < context_window(llm.LLM_MODEL) - 2 * llm.MAX_OUTPUT_TOKENS
+
+
+@pytest.mark.parametrize("name, template", [
+    ("summarize_chunk_chain", llm.summarize_chunk_prompt),
+    ("map_chunk_chain", llm.map_chunk_prompt),
+    ("qa_chain", llm.qa_prompt),
+], ids=["summarize_chunk", "map_chunk", "qa"])
+def test__prompt_overhead__matches_template(name, template):
+    """
+    Checks that the overhead counts the prompt around a chunk as the
+    chain renders it, so a chain that inflates chunks is noticed.
+    """
+    sample = llm.BUDGET_SAMPLE_TEXT
+    prompt = template.format(file_path="README.md", question="What is this project?",
+                             summary="", chunk=sample, content=sample)
+    expected = count_tokens(prompt, llm.LLM_MODEL) - count_tokens(sample, llm.LLM_MODEL)
+    assert llm.prompt_overhead(name, "What is this project?", "README.md") == expected
+
+
+def test__check_config__rejects_character_chunk_size():
+    """
+    Checks that configs measuring chunks in characters are rejected.
+    """
+    with pytest.raises(SystemExit):
+        config._check_config({"llm": {"map_reduce": {"chunk_sz": 8000, "chunk_overlap": 500}}})
+    config._check_config({"llm": {"map_reduce": {"chunk_tokens": None, "chunk_overlap": 200}}})
+
+
+def _topic_chunks():
+    """
+    Returns chunks about unrelated topics, one of which mentions the database.
+    """
+    chunks = [f"section {i} describes the logging output format" for i in range(10)]
+    chunks[6] = "section 6 configures the vulnerability database location"
+    return chunks
+
+
+def test__filter_relevant_chunks__keeps_top_chunk_and_neighbours():
+    """
+    Checks that the best matching chunk, its neighbours and the
+    first chunk are kept and the rest are skipped.
+    """
+    chunks = _topic_chunks()
+    kept, skipped = llm.filter_relevant_chunks("Where is the database configured?",
+                                               lambda: iter(chunks), top_k=1, neighbours=1)
+    assert list(kept) == [chunks[0], chunks[5], chunks[6], chunks[7]]
+    assert skipped == 6
+
+
+def test__filter_relevant_chunks__no_signal_keeps_everything():
+    """
+    Checks that every chunk is kept when no chunk matches the question.
+    """
+    chunks = _topic_chunks()
+    kept, skipped = llm.filter_relevant_chunks("What is this project about?",
+                                               lambda: iter(chunks), top_k=1)
+    assert list(kept) == chunks
+    assert skipped == 0
+
+
+def test__text_qa_map_reduce__reports_skipped_chunks(fake_chains):
+    """
+    Checks that chunks skipped by the prefilter are not sent to the
+    LLM and are reported in the response.
+    """
+    text = "\n\n".join(" ".join([word] * 20) for word in
+                       ["red", "blue", "green", "black", "white", "brown",
+                        "pink", "grey", "gold", "teal"])
+    response = llm.text_qa_map_reduce("What about black?", text, chunk_size=30,
+                                      chunk_overlap=0, strategy="map_reduce",
+                                      prefilter=True)
+    assert fake_chains.count("map") == 4
+    assert response.skipped_chunks == 6
+
+
+def test__prefilter_chunks__broad_question_keeps_everything():
+    """
+    Checks that questions about the whole file are not filtered
+    and the file is not read a second time.
+    """
+    chunks = _topic_chunks()
+    make_chunks = lambda: pytest.fail("the chunks were read again")
+    kept, skipped = llm.prefilter_chunks("Summarize the contents of this file",
+                                         make_chunks, iter(chunks), min_chunks=2)
+    assert list(kept) == chunks
+    assert skipped == 0
+
+
+def test__prefilter_chunks__short_file_keeps_everything():
+    """
+    Checks that files with fewer than `min_chunks` chunks are
+    not filtered and the file is not read a second time.
+    """
+    chunks = _topic_chunks()
+    make_chunks = lambda: pytest.fail("the chunks were read again")
+    kept, skipped = llm.prefilter_chunks("Where is the database configured?",
+                                         make_chunks, iter(chunks), min_chunks=11)
+    assert list(kept) == chunks
+    assert skipped == 0
+
+
+def test__prefilter_chunks__filters_long_files():
+    """
+    Checks that selective questions about long files are filtered.
+    """
+    chunks = _topic_chunks()
+    kept, skipped = llm.prefilter_chunks("Where is the database configured?",
+                                         lambda: iter(chunks), iter(chunks), min_chunks=10)
+    assert list(kept) == [chunks[0], chunks[5], chunks[6], chunks[7]]
+    assert skipped == 6
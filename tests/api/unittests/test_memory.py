@@ -0,0 +1,178 @@
+# Standard lib
+import threading
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.memory import TokenBudgetMemory, OutputStore
+
+
+MODEL = "gpt-3.5-turbo"
+
+
+class FakeSummarizer:
+    """
+    Records the turns it is asked to summarize and joins their inputs.
+    """
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, summary, turns):
+        self.release.wait()
+        self.calls.append(len(turns))
+        return " ".join([summary] + [human.content for human, _ in turns]).strip()
+
+
+@pytest.fixture
+def summarizer():
+    """
+    Fixture that creates a fake summarizer.
+    """
+    return FakeSummarizer()
+
+
+def _memory(summarizer, budget_tokens):
+    return TokenBudgetMemory(budget_tokens=budget_tokens, model=MODEL, summarize=summarizer)
+
+
+def _contents(memory):
+    return [m.content for m in memory.load_memory_variables({})["chat_history"]]
+
+
+class TestTokenBudgetMemory:
+    def test__within_budget(self, summarizer):
+        """
+        Checks that turns within the budget are replayed verbatim and nothing is summarized.
+        """
+        memory = _memory(summarizer, budget_tokens=1000)
+        memory.save_context({"input": "q1"}, {"output": "a1"})
+        memory.save_context({"input": "q2"}, {"output": "a2"})
+        assert _contents(memory) == ["q1", "a1", "q2", "a2"]
+        assert summarizer.calls == []
+
+    def test__over_budget_summarizes_oldest(self, summarizer):
+        """
+        Checks that the oldest turns are folded into the summary once over budget.
+        """
+        memory = _memory(summarizer, budget_tokens=10)
+        for i in range(3):
+            memory.save_context({"input": f"question {i} " * 2}, {"output": f"answer {i}"})
+        memory.wait()
+        contents = _contents(memory)
+        assert contents[0].startswith("Summary of the earlier conversation:")
+        assert "question 0" in memory.summary and "question 1" in memory.summary
+        assert contents[1:] == ["question 2 " * 2, "answer 2"]
+
+    def test__latest_turn_always_kept(self, summarizer):
+        """
+        Checks that a single turn larger than the budget is still replayed.
+        """
+        memory = _memory(summarizer, budget_tokens=1)
+        memory.save_context({"input": "a long question"}, {"output": "a long answer"})
+        assert _contents(memory) == ["a long question", "a long answer"]
+
+    def test__evicted_turns_replayed_until_summarized(self, summarizer):
+        """
+        Checks that turns are not lost while the summary is still being written.
+        """
+        summarizer.release.clear()
+        memory = _memory(summarizer, budget_tokens=5)
+        memory.save_context({"input": "question one two"}, {"output": "answer"})
+        memory.save_context({"input": "question three four"}, {"output": "answer"})
+        assert "question one two" in _contents(memory)
+        summarizer.release.set()
+        memory.wait()
+        assert "question one two" not in _contents(memory)
+
+    def test__failed_summary_is_retried(self, summarizer):
+        """
+        Checks that turns whose summarization failed are summarized after the next turn.
+        """
+        calls = []
+
+        def flaky(summary, turns):
+            calls.append(len(turns))
+            if len(calls) == 1:
+                raise RuntimeError("rate limited")
+            return summarizer(summary, turns)
+        memory = _memory(flaky, budget_tokens=5)
+        memory.save_context({"input": "question one two"}, {"output": "answer"})
+        memory.save_context({"input": "question three four"}, {"output": "answer"})
+        with pytest.raises(RuntimeError):
+            memory.wait()
+        memory.save_context({"input": "question five six"}, {"output": "answer"})
+        memory.wait()
+        assert "question one two" in memory.summary
+        assert "question three four" in memory.summary
+
+    def test__clear(self, summarizer):
+        """
+        Checks that clearing drops the turns and the summary.
+        """
+        memory = _memory(summarizer, budget_tokens=10)
+        for i in range(3):
+            memory.save_context({"input": f"question {i} " * 2}, {"output": "answer"})
+        memory.wait()
+        memory.clear()
+        assert _contents(memory) == []
+
+
+class TestOutputStore:
+    def test__offload__short_output_unchanged(self):
+        """
+        Checks that outputs within the preview are returned as is.
+        """
+        assert OutputStore(preview_tokens=100, model=MODEL).offload("short") == "short"
+
+    def test__offload__long_output(self):
+        """
+        Checks that long outputs are replaced by their first page and a handle.
+        """
+        store = OutputStore(preview_tokens=10, model=MODEL)
+        text = "".join(f"line {i}\n" for i in range(20))
+        preview = store.offload(text)
+        assert preview.startswith("line 0\n")
+        assert "line 19" not in preview
+        assert 'handle "output-1"' in preview
+
+    def test__read__pages(self):
+        """
+        Checks that the pages of a stored output add up to the output.
+        """
+        store = OutputStore(preview_tokens=10, model=MODEL)
+        text = "".join(f"line {i}\n" for i in range(20))
+        preview = store.offload(text)
+        n_pages = int(preview.split("page 1 of ")[1].split(".")[0])
+        pages = [store.read("output-1", page).rsplit("\n[Page", 1)[0]
+                 for page in range(1, n_pages + 1)]
+        assert "".join(pages) == text
+
+    def test__read__unknown_handle(self):
+        """
+        Checks that a `KeyError` is raised for unknown handles.
+        """
+        with pytest.raises(KeyError):
+            OutputStore(model=MODEL).read("output-1", 1)
+
+    def test__read__page_out_of_range(self):
+        """
+        Checks that a `ValueError` is raised for pages past the end.
+        """
+        store = OutputStore(preview_tokens=10, model=MODEL)
+        store.offload("word " * 100)
+        with pytest.raises(ValueError):
+            store.read("output-1", 1000)
+
+    def test__offload__drops_oldest(self):
+        """
+        Checks that only the latest `max_outputs` outputs are kept.
+        """
+        store = OutputStore(preview_tokens=10, max_outputs=1, model=MODEL)
+        store.offload("word " * 100)
+        store.offload("word " * 100)
+        with pytest.raises(KeyError):
+            store.read("output-1", 1)
+        assert store.read("output-2", 1)
@@ -0,0 +1,187 @@
+# Standard lib
+import os
+import stat
+
+# 3rd party
+import pytest
+from sh import git
+
+# Local
+from chaingpt.api import mirror
+
+
+def _commit(repo: str, name: str, content: str):
+    """
+    Writes a file to `repo` and commits it.
+    """
+    with open(os.path.join(repo, name), "w") as f:
+        f.write(content)
+    git("-C", repo, "add", name)
+    git("-C", repo, "-c", "user.name=test", "-c", "user.email=test@example.com",
+        "commit", "--quiet", "-m", f"Add {name}")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """
+    Fixture that creates a local repository with one commit
+    to stand in for a remote.
+    """
+    repo = os.path.join(tmp_path, "upstream")
+    git.init("--quiet", repo)
+    _commit(repo, "README.md", "hello")
+    return repo
+
+
+def test__mirror_path__distinct_urls(tmp_path):
+    """
+    Checks that repositories with the same name get different mirrors.
+    """
+    a = mirror.mirror_path("https://github.com/a/project.git", tmp_path)
+    b = mirror.mirror_path("https://github.com/b/project.git", tmp_path)
+    assert a != b
+    assert os.path.basename(a).startswith("project-")
+
+
+def test__update_mirror__creates_bare_mirror(upstream, tmp_path):
+    """
+    Checks that the first update creates a bare mirror.
+    """
+    path = mirror.update_mirror(upstream, os.path.join(tmp_path, "cache"))
+    assert os.path.exists(os.path.join(path, "HEAD"))
+    assert str(git("--git-dir", path, "config", "core.bare")).strip() == "true"
+
+
+def test__update_mirror__invalid_url(tmp_path):
+    """
+    Checks that a `ValueError` is raised and no mirror is left behind
+    for a URL that cannot be cloned.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    with pytest.raises(ValueError):
+        mirror.update_mirror("invalid.url/dne", cache)
+    assert not os.path.exists(mirror.mirror_path("invalid.url/dne", cache))
+
+
+def test__clone_from_mirror__fetches_new_commits(upstream, tmp_path):
+    """
+    Checks that later clones see commits pushed after the mirror was created.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    mirror.clone_from_mirror(upstream, os.path.join(tmp_path, "first"), cache)
+    _commit(upstream, "new.txt", "new")
+
+    dest = os.path.join(tmp_path, "second")
+    mirror.clone_from_mirror(upstream, dest, cache)
+    assert os.path.exists(os.path.join(dest, "new.txt"))
+
+
+def test__clone_from_mirror__origin_is_url(upstream, tmp_path):
+    """
+    Checks that the working copy's origin points at the original URL.
+    """
+    dest = os.path.join(tmp_path, "clone")
+    mirror.clone_from_mirror(upstream, dest, os.path.join(tmp_path, "cache"))
+    origin = str(git("-C", dest, "remote", "get-url", "origin")).strip()
+    assert origin == upstream
+
+
+def test__link_checkout__shares_files(upstream, tmp_path):
+    """
+    Checks that checkouts of the same commit hardlink the
+    read-only files of one base checkout.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    first = os.path.join(tmp_path, "first")
+    second = os.path.join(tmp_path, "second")
+    mirror.link_checkout(upstream, first, cache)
+    mirror.link_checkout(upstream, second, cache)
+
+    a = os.stat(os.path.join(first, "README.md"))
+    b = os.stat(os.path.join(second, "README.md"))
+    assert a.st_ino == b.st_ino
+    assert not a.st_mode & stat.S_IWUSR
+    assert os.listdir(mirror.bases_path(upstream, cache)) == \
+        [str(git("-C", upstream, "rev-parse", "HEAD")).strip()]
+    origin = str(git("-C", second, "remote", "get-url", "origin")).strip()
+    assert origin == upstream
+
+
+def test__link_checkout__new_commit_replaces_base(upstream, tmp_path):
+    """
+    Checks that a new commit gets a new base checkout, and that checkouts
+    of the old base keep their files after it is removed.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    old = os.path.join(tmp_path, "old")
+    mirror.link_checkout(upstream, old, cache)
+    _commit(upstream, "new.txt", "new")
+
+    new = os.path.join(tmp_path, "new")
+    mirror.link_checkout(upstream, new, cache)
+    assert os.path.exists(os.path.join(new, "new.txt"))
+    assert len(os.listdir(mirror.bases_path(upstream, cache))) == 1
+    with open(os.path.join(old, "README.md")) as f:
+        assert f.read() == "hello"
+
+
+def test__unshare__breaks_link(upstream, tmp_path):
+    """
+    Checks that an unshared file can be modified without
+    changing the other checkouts.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    first = os.path.join(tmp_path, "first")
+    second = os.path.join(tmp_path, "second")
+    mirror.link_checkout(upstream, first, cache)
+    mirror.link_checkout(upstream, second, cache)
+
+    path = os.path.join(first, "README.md")
+    mirror.unshare(path)
+    with open(path, "a") as f:
+        f.write(" world")
+    with open(os.path.join(second, "README.md")) as f:
+        assert f.read() == "hello"
+    assert os.stat(path).st_nlink == 1
+
+
+def test__link_checkout__commits_stay_private(upstream, tmp_path):
+    """
+    Checks that committing in a checkout leaves the base
+    and the other checkouts on the original commit.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    first = os.path.join(tmp_path, "first")
+    second = os.path.join(tmp_path, "second")
+    mirror.link_checkout(upstream, first, cache)
+    head = str(git("-C", first, "rev-parse", "HEAD")).strip()
+    _commit(first, "local.txt", "local")
+
+    mirror.link_checkout(upstream, second, cache)
+    assert str(git("-C", second, "rev-parse", "HEAD")).strip() == head
+    assert not os.path.exists(os.path.join(second, "local.txt"))
+    assert str(git("-C", second, "status", "--porcelain")).strip() == ""
+
+
+def test__prune__removes_unused_repositories(upstream, tmp_path):
+    """
+    Checks that the mirror and bases of a repository are removed once
+    it is no longer in use, while those of other repositories are kept.
+    """
+    cache = os.path.join(tmp_path, "cache")
+    other = os.path.join(tmp_path, "other")
+    git.clone("--quiet", upstream, other)
+    mirror.link_checkout(upstream, os.path.join(tmp_path, "first"), cache)
+    mirror.link_checkout(other, os.path.join(tmp_path, "second"), cache)
+
+    mirror.prune(cache, lambda: [other])
+    assert not os.path.exists(mirror.mirror_path(upstream, cache))
+    assert not os.path.exists(mirror.bases_path(upstream, cache))
+    assert os.path.exists(mirror.mirror_path(other, cache))
+    assert os.path.exists(mirror.bases_path(other, cache))
+    with open(os.path.join(tmp_path, "first", "README.md")) as f:
+        assert f.read() == "hello"
+
+    # A pruned repository is cloned again on its next use
+    mirror.link_checkout(upstream, os.path.join(tmp_path, "third"), cache)
+    assert os.path.exists(os.path.join(tmp_path, "third", "README.md"))
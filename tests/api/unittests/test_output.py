@@ -0,0 +1,60 @@
+# Standard lib
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.output import OutputBuffer
+
+
+def test__write__short_output():
+    """
+    Checks that output shorter than the windows is kept whole.
+    """
+    buffer = OutputBuffer(head_chars=10, tail_chars=10)
+    buffer.write(b"hello ")
+    buffer.write(b"world")
+    buffer.close()
+    assert buffer.getvalue() == "hello world"
+    assert buffer.omitted_chars == 0
+
+
+def test__write__keeps_head_and_tail():
+    """
+    Checks that the middle of long output is omitted.
+    """
+    buffer = OutputBuffer(head_chars=4, tail_chars=3)
+    for i in range(100):
+        buffer.write(b"%d," % i)
+    buffer.close()
+    assert buffer.getvalue() == f"0,1,\n[... {buffer.total_chars - 7} characters omitted ...]\n99,"
+
+
+def test__write__bounded_memory():
+    """
+    Checks that the tail window does not grow with the output.
+    """
+    buffer = OutputBuffer(head_chars=0, tail_chars=10)
+    for _ in range(10000):
+        buffer.write(b"x" * 7)
+    assert buffer._tail_len < 20
+    assert buffer.total_chars == 70000
+
+
+def test__write__split_multibyte():
+    """
+    Checks that characters split between writes are decoded once complete.
+    """
+    data = "été".encode("utf-8")
+    buffer = OutputBuffer(head_chars=10, tail_chars=10)
+    texts = [buffer.write(data[i:i + 1]) for i in range(len(data))] + [buffer.close()]
+    assert "".join(texts) == "été"
+    assert buffer.getvalue() == "été"
+
+
+def test__init__negative_window():
+    """
+    Checks that a `ValueError` is raised for negative windows.
+    """
+    with pytest.raises(ValueError):
+        OutputBuffer(head_chars=-1, tail_chars=0)
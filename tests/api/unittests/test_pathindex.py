@@ -0,0 +1,171 @@
+# Standard lib
+import glob
+import os
+import threading
+
+# 3rd party
+import pytest
+from sh import git
+
+# Local
+from chaingpt.api.pathindex import PathIndex, compile_glob
+
+
+FILES = [
+    "README.md",
+    ".gitignore",
+    "grype/lib.go",
+    "grype/db/v5/store.go",
+    "grype/db/v5/schema.go",
+    "cmd/main.go",
+]
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """
+    Fixture that creates a git repository containing `FILES`
+    and returns its path.
+    """
+    root = str(tmp_path)
+    git.init("--quiet", root)
+    for name in FILES:
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+    git("-C", root, "add", ".")
+    return root
+
+
+def test__compile_glob__star_stays_in_component():
+    """
+    Checks that `*` does not match across directories.
+    """
+    assert compile_glob("grype/*").fullmatch("grype/lib.go")
+    assert not compile_glob("grype/*").fullmatch("grype/db/v5/store.go")
+
+
+def test__compile_glob__double_star():
+    """
+    Checks that `**` matches any number of directories.
+    """
+    regex = compile_glob("**/*.go")
+    assert regex.fullmatch("lib.go")
+    assert regex.fullmatch("grype/db/v5/store.go")
+
+
+def test__compile_glob__hidden():
+    """
+    Checks that wildcards only match hidden names when the pattern starts with `.`.
+    """
+    assert not compile_glob("*").fullmatch(".gitignore")
+    assert compile_glob(".*").fullmatch(".gitignore")
+
+
+def _glob_search(root: str, pattern: str):
+    """
+    Searches `root` for `pattern` with `glob.glob`, as `Workspace.search` did
+    before the index, and returns the sorted directories and files.
+    """
+    dirs, files = [], []
+    for path in glob.glob(os.path.join(root, pattern), recursive=True):
+        (dirs if os.path.isdir(path) else files).append(os.path.relpath(path, root))
+    return sorted(dirs), sorted(files)
+
+
+class TestPathIndex:
+    def test__search__no_wildcards_dir(self, repo):
+        """
+        Checks retrieval of a directory with no wildcards.
+        """
+        assert PathIndex(repo).search("grype") == (["grype"], [])
+
+
+    def test__search__no_wildcards_file(self, repo):
+        """
+        Checks retrieval of a file with no wildcards.
+        """
+        assert PathIndex(repo).search("grype/lib.go") == ([], ["grype/lib.go"])
+
+
+    def test__search__wildcards(self, repo):
+        """
+        Checks retrieval of files and directories using wildcards.
+        """
+        assert PathIndex(repo).search("grype/*") == (["grype/db"], ["grype/lib.go"])
+
+
+    def test__search__recursive(self, repo):
+        """
+        Checks that `**` finds files in nested directories without
+        returning anything from `.git`.
+        """
+        dirs, files = PathIndex(repo).search("**/*.go")
+        assert files == ["cmd/main.go", "grype/db/v5/schema.go",
+                         "grype/db/v5/store.go", "grype/lib.go"]
+        assert not any(d.startswith(".git") for d in dirs)
+
+
+    def test__search__no_results(self, repo):
+        """
+        Checks that empty lists are returned for searches with no results.
+        """
+        assert PathIndex(repo).search("internal/*") == ([], [])
+
+
+    def test__refresh__added_and_removed_paths(self, repo):
+        """
+        Checks that reported paths are added or removed incrementally.
+        """
+        index = PathIndex(repo)
+        os.makedirs(os.path.join(repo, "new"))
+        open(os.path.join(repo, "new", "file.txt"), "w").close()
+        os.remove(os.path.join(repo, "cmd", "main.go"))
+        index.refresh(["new/file.txt", "cmd/main.go"])
+        assert index.search("new/*") == ([], ["new/file.txt"])
+        assert index.search("cmd") == ([], [])
+
+
+    def test__search__rebuilds_after_git_index_changes(self, repo):
+        """
+        Checks that the index is rebuilt when git's index changes.
+        """
+        index = PathIndex(repo)
+        open(os.path.join(repo, "added.txt"), "w").close()
+        git("-C", repo, "add", "added.txt")
+        assert index.search("added.txt") == ([], ["added.txt"])
+
+
+    @pytest.mark.parametrize("pattern", ["grype/*/", "*/", "**/", "grype/db/", "README.md/",
+                                         "grype/**", "*/**", "**", "grype/**/*.go",
+                                         ".", "", "./grype/*", "*", "grype/d?"])
+    def test__search__matches_glob(self, repo, pattern):
+        """
+        Checks that the index returns what `glob.glob` finds on disk.
+        """
+        dirs, files = PathIndex(repo).search(pattern)
+        assert (sorted(dirs), sorted(files)) == _glob_search(repo, pattern)
+
+
+    def test__search__concurrent_refresh(self, repo):
+        """
+        Checks that searches running alongside refreshes see a consistent index.
+        """
+        index = PathIndex(repo)
+        errors = []
+        def refresh():
+            for _ in range(50):
+                index.refresh()
+        def search():
+            try:
+                for _ in range(200):
+                    assert index.search("grype/*") == (["grype/db"], ["grype/lib.go"])
+            except AssertionError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=refresh)] + \
+            [threading.Thread(target=search) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
@@ -0,0 +1,193 @@
+# Standard lib
+import threading
+import time
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.pool import ContainerBackend, ContainerPool, PoolExhaustedError, PoolGroup, \
+    POLICY_FAIL, POLICY_OVERFLOW, POLICY_WAIT
+from tests.api.unittests.utils import FakeBackend
+
+
+def _wait_for(condition, timeout: float=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend()
+
+
+def test__start__prewarms(backend):
+    """
+    Checks that starting the pool creates `size` idle containers.
+    """
+    pool = ContainerPool(backend, size=3)
+    pool.start()
+    _wait_for(lambda: pool.stats().idle == 3)
+    assert len(backend.running) == 3
+    pool.close()
+    assert backend.running == set()
+
+
+def test__lease__reuses_without_recycle(backend):
+    """
+    Checks that containers go back to the pool when `recycle` is off.
+    """
+    pool = ContainerPool(backend, size=1, recycle=False)
+    pool.start()
+    _wait_for(lambda: pool.stats().idle == 1)
+    with pool.lease() as first:
+        pass
+    with pool.lease() as second:
+        assert second.id == first.id
+        assert second.uses == 2
+    assert pool.stats().reused == 2
+    pool.close()
+
+
+def test__lease__recycles_after_use(backend):
+    """
+    Checks that a used container is replaced by a fresh one.
+    """
+    pool = ContainerPool(backend, size=1, recycle=True)
+    pool.start()
+    _wait_for(lambda: pool.stats().idle == 1)
+    with pool.lease() as first:
+        pass
+    _wait_for(lambda: pool.stats().idle == 1)
+    assert first.id in backend.removed
+    with pool.lease() as second:
+        assert second.id != first.id
+    pool.close()
+
+
+def test__lease__replaces_unhealthy(backend):
+    """
+    Checks that unhealthy containers are discarded instead of leased.
+    """
+    pool = ContainerPool(backend, size=1, recycle=False)
+    pool.start()
+    _wait_for(lambda: pool.stats().idle == 1)
+    backend.unhealthy.add("c1")
+    with pool.lease() as container:
+        assert container.id == "c2"
+    pool.close()
+
+
+def test__lease__replaces_expired(backend):
+    """
+    Checks that containers older than the TTL are discarded.
+    """
+    pool = ContainerPool(backend, size=1, ttl=0.05, recycle=False)
+    pool.start()
+    _wait_for(lambda: pool.stats().idle == 1)
+    time.sleep(0.1)
+    with pool.lease() as container:
+        assert container.id == "c2"
+    pool.close()
+
+
+def test__lease__exhausted_fail(backend):
+    """
+    Checks that the `fail` policy raises when every container is leased.
+    """
+    pool = ContainerPool(backend, size=1, policy=POLICY_FAIL)
+    with pool.lease():
+        with pytest.raises(PoolExhaustedError):
+            with pool.lease():
+                pass
+    pool.close()
+
+
+def test__lease__exhausted_wait_timeout(backend):
+    """
+    Checks that the `wait` policy gives up after `acquire_timeout`.
+    """
+    pool = ContainerPool(backend, size=1, policy=POLICY_WAIT, acquire_timeout=0.05)
+    with pool.lease():
+        with pytest.raises(PoolExhaustedError):
+            with pool.lease():
+                pass
+    assert pool.stats().waited == 1
+    pool.close()
+
+
+def test__lease__exhausted_wait_released(backend):
+    """
+    Checks that a waiting lease gets the container once it is released.
+    """
+    pool = ContainerPool(backend, size=1, recycle=False, policy=POLICY_WAIT)
+    leased = []
+    with pool.lease() as first:
+        thread = threading.Thread(target=lambda: leased.append(pool.lease().__enter__()))
+        thread.start()
+        _wait_for(lambda: pool.stats().waited == 1)
+    thread.join(5)
+    assert leased[0].id == first.id
+    pool.close()
+
+
+def test__lease__exhausted_overflow(backend):
+    """
+    Checks that the `overflow` policy creates a temporary container
+    that is removed after use.
+    """
+    pool = ContainerPool(backend, size=1, recycle=False, policy=POLICY_OVERFLOW)
+    with pool.lease():
+        with pool.lease() as extra:
+            pass
+    _wait_for(lambda: extra.id in backend.removed)
+    assert pool.stats().total == 1
+    pool.close()
+
+
+def test__init__invalid(backend):
+    """
+    Checks that a `ValueError` is raised for an invalid size or policy.
+    """
+    with pytest.raises(ValueError):
+        ContainerPool(backend, size=0)
+    with pytest.raises(ValueError):
+        ContainerPool(backend, size=1, policy="nope")
+
+
+def test__container_backend__incomplete_subclass():
+    """
+    Checks that a backend missing part of the interface cannot be created.
+    """
+    class CreateOnly(ContainerBackend):
+        def create(self) -> str:
+            return "c1"
+
+    with pytest.raises(TypeError):
+        CreateOnly()
+
+
+def test__pool_group__closes_least_recently_used():
+    """
+    Checks that pools beyond `max_pools` are closed least recently used
+    first, skipping pinned pools and pools in use.
+    """
+    backends = {}
+    def make_pool(image: str) -> ContainerPool:
+        backends[image] = FakeBackend()
+        return ContainerPool(backends[image], size=1)
+
+    group = PoolGroup(make_pool, max_pools=1, pinned=["base"])
+    group.get("base")
+    with group.use("a") as pool:
+        group.get("b")
+        # `a` is in use, so it outlives the cap until it is released
+        with pool.lease():
+            pass
+    _wait_for(lambda: backends["a"].removed and not backends["a"].running)
+    group.get("c")
+    _wait_for(lambda: backends["b"].removed and not backends["b"].running)
+    _wait_for(lambda: backends["base"].running and backends["c"].running)
+    group.close_all()
@@ -0,0 +1,85 @@
+# Standard lib
+import os
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.provides import ProvidesIndex, PackageDefinition, strip_constraint
+
+
+def _definition(name: str, subpackages=(), provides=None) -> PackageDefinition:
+    return PackageDefinition(name=name, description="", version="1.0",
+                             subpackages=list(subpackages), provides=provides or {})
+
+
+@pytest.fixture
+def index(tmp_path):
+    """
+    Fixture that creates an index with two package files.
+    """
+    index = ProvidesIndex(os.path.join(tmp_path, "provides.json"))
+    index.set("make.yaml", _definition("make", provides={"make": ["cmd:make"]}))
+    index.set("busybox.yaml", _definition("busybox", ["busybox-full"],
+                                          {"busybox-full": ["cmd:make=1.0"]}))
+    return index
+
+
+def test__strip_constraint():
+    """
+    Checks that version constraints are split from package names.
+    """
+    assert strip_constraint("python-3.12>=3.12.1") == ("python-3.12", ">=3.12.1")
+    assert strip_constraint("git") == ("git", "")
+
+
+def test__lookup__prefixed_names(index):
+    """
+    Checks that bare names match their `cmd:` form across packages.
+    """
+    assert [p.name for p in index.lookup("make")] == ["busybox-full", "make"]
+    assert [p.origin for p in index.lookup("cmd:make")] == ["busybox", "make"]
+
+
+def test__set__replaces_and_removes(index):
+    """
+    Checks that replacing or removing a file drops its old entries.
+    """
+    index.set("busybox.yaml", _definition("busybox"))
+    assert [p.name for p in index.lookup("make")] == ["make"]
+    index.set("make.yaml", None)
+    assert index.lookup("make") == []
+    assert index.packages() == {"busybox": "busybox"}
+
+
+def test__packages__excludes_virtual_names(index):
+    """
+    Checks that only installable names are listed as packages.
+    """
+    assert set(index.packages()) == {"make", "busybox", "busybox-full"}
+
+
+def test__save_load__round_trip(index):
+    """
+    Checks that a saved index loads with the same contents.
+    """
+    index.save()
+    loaded = ProvidesIndex.load(index.path)
+    assert loaded.lookup("make") == index.lookup("make")
+    assert loaded.packages() == index.packages()
+
+
+def test__load__missing(tmp_path):
+    """
+    Checks that `None` is returned if there is no saved index.
+    """
+    assert ProvidesIndex.load(os.path.join(tmp_path, "provides.json")) is None
+
+
+def test__is_installable(index):
+    """
+    Checks that package names and exactly provided names are installable.
+    """
+    assert index.is_installable("busybox-full")
+    assert index.is_installable("cmd:make")
+    assert not index.is_installable("gmake")
@@ -0,0 +1,75 @@
+# Standard lib
+import os
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.reader import TextFileReader
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    """
+    Fixture that writes a file of multibyte characters and returns its path.
+    """
+    path = os.path.join(tmp_path, "text.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("aé漢😀" * 1000)
+    return path
+
+
+class TestTextFileReader:
+    def test__iter__multibyte_split_across_blocks(self, text_file):
+        """
+        Checks that characters split across block boundaries are decoded correctly.
+        """
+        reader = TextFileReader(text_file, block_sz=7)
+        assert "".join(reader) == "aé漢😀" * 1000
+        assert not reader.truncated
+
+
+    def test__iter__truncated(self, text_file):
+        """
+        Checks that at most `max_chars` characters are read and the
+        reader reports the truncation.
+        """
+        reader = TextFileReader(text_file, max_chars=10, block_sz=16)
+        assert "".join(reader) == ("aé漢😀" * 3)[:10]
+        assert reader.truncated
+
+
+    def test__iter__max_chars_eq_file_size(self, text_file):
+        """
+        Checks that reading exactly the whole file is not reported as truncation.
+        """
+        reader = TextFileReader(text_file, max_chars=4000, block_sz=16)
+        assert len("".join(reader)) == 4000
+        assert not reader.truncated
+
+
+    def test__iter__empty_file(self, tmp_path):
+        """
+        Checks that an empty file yields no text.
+        """
+        path = os.path.join(tmp_path, "empty.txt")
+        open(path, "w").close()
+        assert list(TextFileReader(path)) == []
+
+
+    def test__iter__invalid_utf8(self, tmp_path):
+        """
+        Checks that invalid bytes are replaced instead of raising.
+        """
+        path = os.path.join(tmp_path, "binary.bin")
+        with open(path, "wb") as f:
+            f.write(b"ok\xff\xfeok")
+        assert "".join(TextFileReader(path)) == "ok��ok"
+
+
+    def test__iter__file_dne(self, tmp_path):
+        """
+        Checks that a `FileNotFoundError` is raised for a missing file.
+        """
+        with pytest.raises(FileNotFoundError):
+            list(TextFileReader(os.path.join(tmp_path, "dne.txt")))
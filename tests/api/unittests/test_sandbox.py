@@ -0,0 +1,79 @@
+# Standard lib
+import time
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.sandbox import Sandbox
+from tests.api.unittests.utils import FakeBackend
+
+
+@pytest.fixture
+def backend():
+    """
+    Fixture that creates a fake container backend.
+    """
+    return FakeBackend()
+
+
+def test__acquire__creates_container_once(backend):
+    """
+    Checks that the container is created on first use and reused afterwards.
+    """
+    sandbox = Sandbox(backend, idle_timeout=None)
+    with sandbox.acquire() as (first, fresh):
+        assert fresh
+    with sandbox.acquire() as (second, fresh):
+        assert not fresh
+    assert first == second
+    assert backend.next_id == 1
+
+
+def test__reset__removes_container(backend):
+    """
+    Checks that a reset removes the container and forgets its state.
+    """
+    sandbox = Sandbox(backend, idle_timeout=None)
+    with sandbox.acquire() as (container_id, _):
+        sandbox.installed.add("make")
+    sandbox.reset()
+    assert backend.removed == [container_id]
+    assert not sandbox.installed
+    with sandbox.acquire() as (new_id, fresh):
+        assert fresh
+    assert new_id != container_id
+
+
+def test__reset__without_container(backend):
+    """
+    Checks that resetting an unused sandbox does nothing.
+    """
+    Sandbox(backend, idle_timeout=None).reset()
+    assert backend.removed == []
+
+
+def test__idle_timeout__reaps_container(backend):
+    """
+    Checks that the container is removed after being idle for `idle_timeout` seconds.
+    """
+    sandbox = Sandbox(backend, idle_timeout=0.05)
+    with sandbox.acquire() as (container_id, _):
+        pass
+    deadline = time.monotonic() + 5
+    while not backend.removed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.removed == [container_id]
+
+
+def test__idle_timeout__not_while_running(backend):
+    """
+    Checks that a running script keeps the container alive past the idle timeout.
+    """
+    sandbox = Sandbox(backend, idle_timeout=0.05)
+    with sandbox.acquire():
+        pass
+    with sandbox.acquire():
+        time.sleep(0.2)
+        assert backend.removed == []
+    sandbox.close()
@@ -0,0 +1,83 @@
+# Standard lib
+import threading
+import time
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.scheduler import Scheduler, QueueTimeoutError
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test__init__max_concurrent_not_positive():
+    """
+    Checks that a `ValueError` is raised if `max_concurrent` is not positive.
+    """
+    with pytest.raises(ValueError):
+        Scheduler(0)
+
+
+def test__slot__no_wait():
+    """
+    Checks that a free slot is taken right away and released afterwards.
+    """
+    scheduler = Scheduler(2)
+    with scheduler.slot() as wait:
+        assert wait < 1
+        assert scheduler.stats().running == 1
+    stats = scheduler.stats()
+    assert (stats.running, stats.completed, stats.waited) == (0, 1, 0)
+
+
+def test__slot__fifo():
+    """
+    Checks that queued runs start in the order they arrived.
+    """
+    scheduler = Scheduler(1)
+    started = []
+    release = threading.Event()
+
+    def run(name):
+        with scheduler.slot():
+            started.append(name)
+            release.wait()
+
+    first = threading.Thread(target=run, args=("first",))
+    first.start()
+    _wait_for(lambda: started == ["first"])
+    threads = []
+    for i in range(3):
+        thread = threading.Thread(target=run, args=(i,))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: scheduler.stats().queued == i + 1)
+    assert scheduler.stats().max_queued == 3
+    release.set()
+    for thread in [first] + threads:
+        thread.join()
+    assert started == ["first", 0, 1, 2]
+    stats = scheduler.stats()
+    assert (stats.completed, stats.waited, stats.queued) == (4, 3, 0)
+    assert stats.max_wait > 0 and stats.mean_wait > 0
+
+
+def test__slot__queue_timeout():
+    """
+    Checks that a run gives up after `queue_timeout` and leaves the queue.
+    """
+    scheduler = Scheduler(1, queue_timeout=0.05)
+    with scheduler.slot():
+        with pytest.raises(QueueTimeoutError):
+            with scheduler.slot():
+                pass
+    stats = scheduler.stats()
+    assert (stats.queued, stats.timed_out) == (0, 1)
+    with scheduler.slot():
+        pass
@@ -1,10 +1,12 @@
 # Standard lib
+import itertools
+import os
 
 # 3rd party
 import pytest
 
 # Local
-from chaingpt.api import session, workspace
+from chaingpt.api import mirror, session, workspace
 from tests.api.unittests.utils import cleanup_leftover_workspaces
 
 
@@ -43,3 +45,213 @@ def test__get_workspace__invalid_id():
     """
     with pytest.raises(ValueError):
         wk = session.get_workspace("id-1234")
+
+
+class FakeWorkspace():
+    """
+    A workspace whose clone is a directory holding one file of `size` bytes.
+    """
+    def __init__(self, parent_dir: str, size: int, url: str=None):
+        self.url = url
+        self.parent_dir = parent_dir
+        os.makedirs(parent_dir)
+        with open(os.path.join(parent_dir, "file"), "wb") as f:
+            f.write(b"x" * size)
+
+
+@pytest.fixture
+def make_workspace(tmp_path):
+    """
+    Fixture that returns a `make_workspace` creating a `FakeWorkspace`
+    under `tmp_path`. The URL sets the size of the clone in bytes.
+    """
+    counter = itertools.count()
+    def make(url: str) -> FakeWorkspace:
+        return FakeWorkspace(os.path.join(tmp_path, f"ws{next(counter)}"), int(url), url)
+    return make
+
+
+class TestWorkspaceCache:
+    def test__evicts_least_recently_used_beyond_max_sessions(self, make_workspace):
+        """
+        Checks that the least recently used session is evicted
+        and its clone deleted once there are too many sessions.
+        """
+        cache = session.WorkspaceCache(max_sessions=2, max_disk_size=10**6, ttl=None,
+                                       make_workspace=make_workspace)
+        first = cache.new_session("10")
+        second = cache.new_session("10")
+        evicted_dir = cache.get(second).parent_dir
+        cache.get(first)  # `second` becomes the least recently used
+        third = cache.new_session("10")
+        assert cache.get(first) and cache.get(third)
+        with pytest.raises(ValueError):
+            cache.get(second)
+        assert not os.path.exists(evicted_dir)
+        assert cache.stats().evicted == 1
+
+    def test__evicts_beyond_max_disk_size(self, make_workspace):
+        """
+        Checks that sessions are evicted until the clones fit in
+        `max_disk_size`, but the newest session is always kept.
+        """
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=100, ttl=None,
+                                       make_workspace=make_workspace)
+        cache.new_session("60")
+        cache.new_session("30")
+        newest = cache.new_session("500")
+        stats = cache.stats()
+        assert stats.sessions == 1
+        assert stats.disk_size == 500
+        assert cache.get(newest)
+
+    def test__sweep_measures_grown_workspaces(self, make_workspace):
+        """
+        Checks that `sweep` accounts for clones that grew after their
+        session was created and evicts down to `max_disk_size`.
+        """
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=100, ttl=None,
+                                       make_workspace=make_workspace)
+        old = cache.new_session("30")
+        newest = cache.new_session("30")
+        with cache.lease(old) as wk:
+            with open(os.path.join(wk.parent_dir, "output"), "wb") as f:
+                f.write(b"x" * 200)
+        cache.get(newest)
+        assert cache.stats().disk_size == 60
+        cache.sweep()
+        stats = cache.stats()
+        assert stats.sessions == 1
+        assert stats.disk_size == 30
+        assert stats.evicted == 1
+        assert cache.get(newest)
+
+    def test__expires_idle_sessions(self, make_workspace, monkeypatch):
+        """
+        Checks that `sweep` removes sessions idle for longer than `ttl`.
+        """
+        now = [1000.0]
+        monkeypatch.setattr(session.time, "monotonic", lambda: now[0])
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=10**6, ttl=60,
+                                       make_workspace=make_workspace)
+        old = cache.new_session("10")
+        now[0] += 30
+        recent = cache.new_session("10")
+        now[0] += 40
+        cache.sweep()
+        with pytest.raises(ValueError):
+            cache.get(old)
+        assert cache.get(recent)
+        assert cache.stats().expired == 1
+
+    def test__deletes_leased_workspace_after_release(self, make_workspace):
+        """
+        Checks that the clone of a session closed during a request
+        is deleted only once the request finishes.
+        """
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=10**6, ttl=None,
+                                       make_workspace=make_workspace)
+        id = cache.new_session("10")
+        with cache.lease(id) as wk:
+            cache.close_session(id)
+            assert os.path.exists(wk.parent_dir)
+        assert not os.path.exists(wk.parent_dir)
+
+    def test__lease_unknown_session(self, make_workspace):
+        """
+        Checks that leasing an unknown session raises an `UnknownSessionError`.
+        """
+        cache = session.WorkspaceCache(make_workspace=make_workspace)
+        with pytest.raises(session.UnknownSessionError):
+            with cache.lease("id-1234"):
+                pass
+
+    def test__close(self, make_workspace):
+        """
+        Checks that `close` ends every session and deletes their clones.
+        """
+        cache = session.WorkspaceCache(ttl=None, make_workspace=make_workspace)
+        parents = [cache.get(cache.new_session("10")).parent_dir for _ in range(3)]
+        cache.close()
+        assert cache.stats().sessions == 0
+        assert not any(os.path.exists(p) for p in parents)
+
+
+@pytest.fixture
+def make_linked_workspace(tmp_path):
+    """
+    Fixture that returns a `make_workspace` creating a `FakeWorkspace` of 10 bytes
+    whose clone also links a 100 byte file of a fake base checkout in `tmp_path/cache`.
+    """
+    cache_dir = os.path.join(tmp_path, "cache")
+    counter = itertools.count()
+    def make(url: str) -> FakeWorkspace:
+        base = os.path.join(mirror.bases_path(url, cache_dir), "commit")
+        if not os.path.exists(base):
+            os.makedirs(base)
+            with open(os.path.join(base, "shared"), "wb") as f:
+                f.write(b"x" * 100)
+        wk = FakeWorkspace(os.path.join(tmp_path, f"ws{next(counter)}"), 10, url)
+        os.link(os.path.join(base, "shared"), os.path.join(wk.parent_dir, "shared"))
+        return wk
+    return make
+
+
+class TestSharedDiskUsage:
+    def test__shared_files_count_once(self, make_linked_workspace, tmp_path):
+        """
+        Checks that files shared by the sessions of a repository are
+        counted once and charged to the cache.
+        """
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=10**6, ttl=None,
+                                       make_workspace=make_linked_workspace,
+                                       cache_dir=os.path.join(tmp_path, "cache"))
+        for _ in range(3):
+            cache.new_session("https://github.com/test/a.git")
+        cache.sweep()
+        stats = cache.stats()
+        assert stats.shared_disk_size == 100
+        assert stats.disk_size == 3 * 10 + 100
+
+    def test__shared_files_count_towards_max_disk_size(self, make_linked_workspace, tmp_path):
+        """
+        Checks that sessions are evicted when what they share exceeds `max_disk_size`.
+        """
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=150, ttl=None,
+                                       make_workspace=make_linked_workspace,
+                                       cache_dir=os.path.join(tmp_path, "cache"))
+        cache.new_session("https://github.com/test/a.git")
+        newest = cache.new_session("https://github.com/test/b.git")
+        stats = cache.stats()
+        assert stats.sessions == 1
+        assert stats.disk_size == 110
+        assert cache.get(newest)
+
+    def test__sweep_prunes_unused_repositories(self, make_linked_workspace, tmp_path):
+        """
+        Checks that `sweep` removes the cached checkouts of repositories
+        without sessions and keeps those still in use.
+        """
+        cache_dir = os.path.join(tmp_path, "cache")
+        cache = session.WorkspaceCache(max_sessions=10, max_disk_size=10**6, ttl=None,
+                                       make_workspace=make_linked_workspace,
+                                       cache_dir=cache_dir)
+        closed = cache.new_session("https://github.com/test/a.git")
+        cache.new_session("https://github.com/test/b.git")
+        cache.close_session(closed)
+        cache.sweep()
+        assert not os.path.exists(mirror.bases_path("https://github.com/test/a.git", cache_dir))
+        assert os.path.exists(mirror.bases_path("https://github.com/test/b.git", cache_dir))
+        assert cache.stats().shared_disk_size == 100
+
+
+def test__disk_usage__skips_shared_files(tmp_path):
+    """
+    Checks that hardlinked files do not count towards the disk usage.
+    """
+    with open(os.path.join(tmp_path, "private"), "wb") as f:
+        f.write(b"x" * 10)
+    with open(os.path.join(tmp_path, "shared"), "wb") as f:
+        f.write(b"x" * 100)
+    os.link(os.path.join(tmp_path, "shared"), os.path.join(tmp_path, "link"))
+    assert session.disk_usage(tmp_path) == 10
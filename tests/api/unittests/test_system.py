@@ -0,0 +1,347 @@
+# Standard lib
+import time
+
+# 3rd party
+import pytest
+from docker.errors import ImageNotFound
+
+# Local
+from chaingpt.api import system
+from chaingpt.api.pool import ContainerPool, PoolGroup, STDOUT, STDERR
+from chaingpt.api.images import ImageCache, image_tag
+from chaingpt.api.scheduler import Scheduler
+from chaingpt.api.system import SystemEnvironment, IMAGE_NAME
+from tests.api.unittests.utils import FakeBackend, FakeImageBackend, local_repo, \
+    local_repo_url, local_workspace
+
+
+@pytest.fixture
+def pools():
+    """
+    Fixture that creates container pools backed by fake containers.
+    """
+    pools = PoolGroup(lambda image: ContainerPool(FakeBackend(), size=1))
+    yield pools
+    pools.close_all()
+
+
+@pytest.fixture
+def env(pools):
+    """
+    Fixture that creates an environment with fake pools, no image cache and no timeout.
+    """
+    return SystemEnvironment(pools, timeout=None)
+
+
+def test__run__installs_deps(env):
+    """
+    Checks that deps are installed before the script runs.
+    """
+    result = env.run("make test", deps=["make", "git"])
+    assert result.stdout == "c1: sh -c apk add git make && make test"
+
+
+def test__run__quotes_deps(env):
+    """
+    Checks that version constraints and shell syntax in deps
+    reach `apk add` as plain arguments.
+    """
+    result = env.run("python3 -V", deps=["python-3>3.10", "git;rm -rf /"])
+    assert result.stdout == "c1: sh -c apk add 'git;rm -rf /' 'python-3>3.10' && python3 -V"
+
+
+def test__run__no_deps(env):
+    """
+    Checks that no install step runs without deps.
+    """
+    assert env.run("ls", deps=[]).stdout == "c1: sh -c ls"
+
+
+def test__run__script_is_not_str(env):
+    """
+    Checks that a `TypeError` is raised if `script` is not a string.
+    """
+    with pytest.raises(TypeError):
+        env.run(1)
+
+
+def test__run__uses_derived_image(pools):
+    """
+    Checks that the first run installs deps and requests an image, and
+    that later runs use the image without installing anything.
+    """
+    images = ImageCache(FakeImageBackend(), IMAGE_NAME, max_size=1000)
+    env = SystemEnvironment(pools, images, timeout=None)
+    first = env.run("make", deps=["make", "git"])
+    assert "apk add" in first.stdout
+    images.wait()
+    second = env.run("make", deps=["git", "make"])
+    assert second.stdout == "c1: sh -c make"
+    assert pools.get(image_tag(IMAGE_NAME, ["git", "make"])).stats().created == 1
+
+
+def test__run__copies_workspace(pools, local_workspace):
+    """
+    Checks that the repository is copied into the container and
+    that the script runs from it.
+    """
+    env = SystemEnvironment(pools, timeout=None)
+    env.run("pytest", workspace=local_workspace)
+    backend = pools.get(IMAGE_NAME).backend
+    container_id, names = backend.copies[0]
+    assert "workspace/project/src/main.py" in names
+    assert "workspace/project/.git/HEAD" in names
+    assert backend.execs[-1] == (container_id, ["sh", "-c", "pytest"], "/workspace/project")
+
+
+def test__run__reused_container_drops_old_copy(local_workspace):
+    """
+    Checks that a reused container is cleaned before the repository is copied again.
+    """
+    pools = PoolGroup(lambda image: ContainerPool(FakeBackend(), size=1, recycle=False))
+    env = SystemEnvironment(pools, timeout=None)
+    env.run("ls", workspace=local_workspace)
+    env.run("ls", workspace=local_workspace)
+    backend = pools.get(IMAGE_NAME).backend
+    assert [cmd for _, cmd, _ in backend.execs] == [["sh", "-c", "ls"],
+                                                    ["rm", "-rf", "/workspace"],
+                                                    ["sh", "-c", "ls"]]
+    pools.close_all()
+
+
+def test__run__result(pools):
+    """
+    Checks that stdout, stderr and the exit code are reported separately and
+    that multibyte characters split across chunks are decoded.
+    """
+    backend = pools.get(IMAGE_NAME).backend
+    snowman = "\u2603".encode("utf-8")
+    backend.output = [(STDOUT, b"ok " + snowman[:1]), (STDERR, b"warn"), (STDOUT, snowman[1:])]
+    backend.return_code = 3
+    streamed = []
+    result = SystemEnvironment(pools).run("make", on_output=lambda s, t: streamed.append((s, t)))
+    assert (result.return_code, result.stdout, result.stderr) == (3, "ok \u2603", "warn")
+    assert result.duration >= 0
+    assert not result.truncated
+    assert "".join(t for s, t in streamed if s == STDOUT) == "ok \u2603"
+
+
+def test__run__long_output_truncated(pools, monkeypatch):
+    """
+    Checks that only the head and tail of long outputs are kept.
+    """
+    monkeypatch.setattr(system, "OUTPUT_HEAD_CHARS", 5)
+    monkeypatch.setattr(system, "OUTPUT_TAIL_CHARS", 5)
+    backend = pools.get(IMAGE_NAME).backend
+    backend.output = [(STDOUT, b"%05d" % i) for i in range(1000)]
+    result = SystemEnvironment(pools).run("make")
+    assert result.truncated
+    assert result.stdout.startswith("00000")
+    assert result.stdout.endswith("00999")
+
+
+def test__run__timeout_kills_script(env):
+    """
+    Checks that scripts are wrapped to be killed once the timeout expires.
+    """
+    env.timeout = 2.5
+    assert env.run("make").stdout == "c1: timeout -s KILL 3 sh -c make"
+
+
+def test__run__timeout_reported(pools):
+    """
+    Checks that a script killed by `timeout` is reported as timed out.
+    """
+    backend = pools.get(IMAGE_NAME).backend
+    backend.return_code = 137
+    result = SystemEnvironment(pools, timeout=0).run("make")
+    assert result.timed_out
+
+
+def test__run__watchdog_removes_container(pools, monkeypatch):
+    """
+    Checks that a script outliving its timeout loses its container.
+    """
+    monkeypatch.setattr(system, "KILL_GRACE", 0)
+    backend = pools.get(IMAGE_NAME).backend
+
+    def hang():
+        while "c1" in backend.running:
+            time.sleep(0.01)
+        yield STDOUT, b"killed"
+    backend.output = hang()
+    result = SystemEnvironment(pools, timeout=0.05).run("sleep 100")
+    assert result.timed_out
+    assert result.return_code is None
+    assert "c1" in backend.removed
+
+
+def test__run__scheduled(pools):
+    """
+    Checks that runs hold a scheduler slot while they execute.
+    """
+    scheduler = Scheduler(max_concurrent=1)
+    backend = pools.get(IMAGE_NAME).backend
+    running = []
+
+    def output():
+        running.append(scheduler.stats().running)
+        yield STDOUT, b"ok"
+    backend.output = output()
+    SystemEnvironment(pools, scheduler=scheduler).run("make")
+    assert running == [1]
+    assert scheduler.stats().completed == 1
+
+
+class TestSandbox:
+    @pytest.fixture
+    def env(self, pools):
+        """
+        Fixture that creates an environment in sandbox mode.
+        """
+        env = SystemEnvironment(pools, sandbox=True, timeout=None)
+        yield env
+        env.close()
+
+    def test__run__reuses_container(self, env):
+        """
+        Checks that scripts run in the same container, apart from the pool.
+        """
+        env.run("touch a")
+        env.run("ls")
+        backend = env.sandbox.backend
+        assert len({container_id for container_id, _, _ in backend.execs}) == 1
+        # Only the pool's own container was created in the pool
+        assert env.pools.get(IMAGE_NAME).stats().created == 1
+
+    def test__run__installs_missing_deps_once(self, env):
+        """
+        Checks that deps installed by an earlier script are not installed again.
+        """
+        first = env.run("make", deps=["make"])
+        second = env.run("make", deps=["make", "git"])
+        assert "apk add make ||" in first.stdout
+        assert "apk add git ||" in second.stdout
+
+    def test__run__quotes_deps(self, env):
+        """
+        Checks that version constraints reach `apk add` as plain arguments.
+        """
+        assert "apk add 'python-3>3.10' ||" in env.run("python3 -V", deps=["python-3>3.10"]).stdout
+
+    def test__run__failed_install_is_retried(self, env):
+        """
+        Checks that deps of a failed script are installed again by the next one.
+        """
+        env.sandbox.backend.return_code = 1
+        env.run("make", deps=["make"])
+        env.sandbox.backend.return_code = 0
+        assert "apk add make" in env.run("make", deps=["make"]).stdout
+
+    def test__run__persists_cwd_and_env(self, env):
+        """
+        Checks that scripts restore and save the working directory and exported variables.
+        """
+        stdout = env.run("cd src").stdout
+        assert "cwd" in stdout and "export -p" in stdout and "trap" in stdout
+
+    def test__run__copies_workspace_once(self, env, local_workspace):
+        """
+        Checks that the repository is only copied into the sandbox by the first script.
+        """
+        env.run("pytest", workspace=local_workspace)
+        env.run("pytest", workspace=local_workspace)
+        assert len(env.sandbox.backend.copies) == 1
+
+    def test__run__replaces_dead_container(self, env):
+        """
+        Checks that a container that stopped is replaced by the next script.
+        """
+        env.run("make", deps=["make"])
+        backend = env.sandbox.backend
+        dead = backend.execs[-1][0]
+        backend.running.discard(dead)
+        assert "apk add make" in env.run("make", deps=["make"]).stdout
+        assert backend.execs[-1][0] != dead
+
+    def test__reset__starts_over(self, env, local_workspace):
+        """
+        Checks that after a reset the next script gets a new container with a new copy.
+        """
+        env.run("make", deps=["make"], workspace=local_workspace)
+        env.reset()
+        result = env.run("make", deps=["make"], workspace=local_workspace)
+        assert "apk add make" in result.stdout
+        assert len(env.sandbox.backend.copies) == 2
+        assert len(env.sandbox.backend.removed) == 1
+
+
+def test__lazy_environment__created_on_first_run(pools):
+    """
+    Checks that the environment is only created once a script runs,
+    and that a failed creation is retried by the next script.
+    """
+    attempts = []
+    def make_env():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("Docker is not running")
+        return SystemEnvironment(pools, timeout=None)
+
+    env = system.LazyEnvironment(sandbox=False, make_env=make_env)
+    env.close()
+    assert not attempts
+    with pytest.raises(RuntimeError):
+        env.run("make")
+    assert env.run("make").return_code == 0
+    assert len(attempts) == 2
+
+
+class FakeImages():
+    def get(self, name):
+        raise ImageNotFound(f"No such image: {name}")
+
+    def list(self, name, filters=None):
+        return []
+
+
+class FakeClient():
+    images = FakeImages()
+
+
+def test__docker_image_backend__base_image_not_pulled():
+    """
+    Checks that listing images works before the base image was pulled.
+    """
+    backend = system.DockerImageBackend(FakeClient())
+    assert backend.list(IMAGE_NAME) == []
+
+
+def test__init_defaults__failure_leaves_nothing_set(monkeypatch):
+    """
+    Checks that a failed initialization sets none of the defaults,
+    so the next call tries again.
+    """
+    monkeypatch.setattr(system, "_default_pools", None)
+    monkeypatch.setattr(system, "_default_images", None)
+    monkeypatch.setattr(system, "_default_scheduler", None)
+    monkeypatch.setattr(system.docker, "from_env", FakeClient)
+    monkeypatch.setattr(system, "IMAGES_ENABLED", True)
+    def fail(*args, **kwargs):
+        raise RuntimeError("Docker is not running")
+    monkeypatch.setattr(system, "ImageCache", fail)
+
+    with pytest.raises(RuntimeError):
+        system.get_default_pools()
+    assert system._default_pools is None
+    assert system._default_scheduler is None
+
+
+def test__get_scheduler_stats__before_any_environment(monkeypatch):
+    """
+    Checks that no stats are reported, and Docker is not
+    touched, before a script environment exists.
+    """
+    monkeypatch.setattr(system, "_default_scheduler", None)
+    monkeypatch.setattr(system.docker, "from_env", None)
+    assert system.get_scheduler_stats() is None
@@ -0,0 +1,153 @@
+# Standard lib
+import os
+import re
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api.textindex import TextIndex, _required_literals
+
+
+FILES = {
+    "main.go": "package main\n\nfunc main() {\n\trunScanner()\n}\n",
+    "scan/scanner.go": "package scan\n\nfunc runScanner() error {\n\treturn nil\n}\n",
+    "README.md": "# Scanner\nRun the scanner with `grype`.\n",
+}
+
+
+@pytest.fixture
+def root(tmp_path):
+    """
+    Fixture that writes `FILES` and a binary file to a directory and returns its path.
+    """
+    for name, content in FILES.items():
+        path = os.path.join(tmp_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    with open(os.path.join(tmp_path, "binary.bin"), "wb") as f:
+        f.write(b"\0runScanner\0")
+    return str(tmp_path)
+
+
+@pytest.fixture
+def index(root):
+    return TextIndex(root, list(FILES) + ["binary.bin"], max_file_sz=1 << 20)
+
+
+def test___required_literals__plain():
+    """
+    Checks that a pattern without metacharacters is required as a whole.
+    """
+    assert _required_literals("runScanner") == ["runScanner"]
+
+
+def test___required_literals__optional_characters():
+    """
+    Checks that characters made optional by a quantifier are excluded.
+    """
+    assert _required_literals(r"func\s+run(Scanner)?x*y") == ["func", "run", "y"]
+
+
+def test___required_literals__alternation():
+    """
+    Checks that no literal is required when the pattern has alternatives.
+    """
+    assert _required_literals("foo|bar") == []
+
+
+def test___required_literals__escapes():
+    """
+    Checks that escapes other than escaped punctuation end a literal
+    run without leaving their arguments behind as literals.
+    """
+    assert _required_literals(r"\x64ef") == ["ef"]
+    assert _required_literals(r"\144ef") == ["ef"]
+    assert _required_literals(r"\u0064ef") == ["ef"]
+    assert _required_literals(r"\N{LATIN SMALL LETTER D}ef") == ["ef"]
+    assert _required_literals(r"run\.go") == ["run.go"]
+
+
+def test___required_literals__inline_flags():
+    """
+    Checks that no literal is required when the pattern has inline flags.
+    """
+    assert _required_literals("(?x) d e f") == []
+    assert _required_literals("(?i)func") == []
+
+
+class TestTextIndex:
+    def test__search__substring(self, index):
+        """
+        Checks that every line containing the substring is returned
+        with its path and line number.
+        """
+        matches = index.search("runScanner")
+        assert [(m.path, m.line_number) for m in matches] == [
+            ("main.go", 4), ("scan/scanner.go", 3)]
+
+
+    def test__search__regex(self, index):
+        """
+        Checks that regular expressions are matched.
+        """
+        matches = index.search(r"^func \w+\(\) error", regex=True)
+        assert [m.path for m in matches] == ["scan/scanner.go"]
+
+
+    def test__search__ignore_case(self, index):
+        """
+        Checks case insensitive matching.
+        """
+        assert len(index.search("SCANNER", ignore_case=True)) == 4
+        assert index.search("SCANNER") == []
+
+
+    def test__search__skips_binary_files(self, index):
+        """
+        Checks that binary files are not indexed.
+        """
+        assert "binary.bin" not in [m.path for m in index.search("runScanner")]
+
+
+    def test__search__max_results(self, index):
+        """
+        Checks that no more than `max_results` matches are returned.
+        """
+        assert len(index.search("package", max_results=1)) == 1
+
+
+    def test__search__invalid_regex(self, index):
+        """
+        Checks that a `ValueError` is raised for an invalid regular expression.
+        """
+        with pytest.raises(ValueError):
+            index.search("(", regex=True)
+
+
+    def test__refresh__modified_file(self, root, index):
+        """
+        Checks that refreshed files are searched with their new contents.
+        """
+        with open(os.path.join(root, "README.md"), "w") as f:
+            f.write("Nothing to see\n")
+        index.refresh(["README.md"])
+        assert index.search("grype") == []
+        assert [m.path for m in index.search("Nothing")] == ["README.md"]
+
+
+    @pytest.mark.parametrize("pattern", [r"\x72unScanner", r"\162unScanner", r"(?x) run Scanner",
+                                         r"\u0072unScanner", r"(?i)RUNSCANNER"])
+    def test__search__matches_brute_force(self, root, index, pattern):
+        """
+        Checks that the trigram prefilter never drops files that match.
+        """
+        expected = []
+        for name in sorted(FILES):
+            for number, line in enumerate(FILES[name].splitlines(), 1):
+                if re.search(pattern, line):
+                    expected.append((name, number))
+        matches = index.search(pattern, regex=True)
+        assert expected
+        assert sorted((m.path, m.line_number) for m in matches) == expected
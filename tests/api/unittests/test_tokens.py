@@ -0,0 +1,94 @@
+# Standard lib
+
+# 3rd party
+import pytest
+
+# Local
+from chaingpt.api import tokens
+
+
+MODEL = "gpt-3.5-turbo-0125"
+
+
+def test__context_window__known_model():
+    """
+    Checks that the context window of a known model is returned.
+    """
+    assert tokens.context_window("gpt-3.5-turbo-0125") == 16385
+
+
+def test__context_window__unknown_model():
+    """
+    Checks that unknown models fall back to the default context window.
+    """
+    assert tokens.context_window("unknown-model") == tokens.DEFAULT_CONTEXT_WINDOW
+
+
+def test__count_tokens__ascii():
+    """
+    Checks that tokens rather than characters are counted.
+    """
+    assert tokens.count_tokens("hello world", "gpt-3.5-turbo-0125") == 2
+
+
+def test__count_tokens__special_tokens():
+    """
+    Checks that special token markers in file contents are counted as text
+    instead of raising an exception.
+    """
+    assert tokens.count_tokens("<|endoftext|>", "gpt-3.5-turbo-0125") > 1
+
+
+def test__count_tokens__unknown_model():
+    """
+    Checks that unknown models are counted with the default encoding.
+    """
+    assert tokens.count_tokens("hello world", "unknown-model") == 2
+
+
+def test__iter_token_chunks__respects_chunk_tokens():
+    """
+    Checks that no chunk is larger than `chunk_tokens`.
+    """
+    text = "\n".join(f"line {i} é漢字" for i in range(1000))
+    chunks = list(tokens.iter_token_chunks([text], 100, 10, MODEL))
+    assert len(chunks) > 1
+    assert max(tokens.count_tokens(c, MODEL) for c in chunks) <= 100
+
+
+def test__iter_token_chunks__no_overlap_is_lossless():
+    """
+    Checks that joining the chunks reproduces the streamed text when
+    there is no overlap, even if blocks split lines.
+    """
+    text = "\n".join(f"line {i} é漢字" for i in range(1000))
+    blocks = [text[i:i + 77] for i in range(0, len(text), 77)]
+    assert "".join(tokens.iter_token_chunks(blocks, 100, 0, MODEL)) == text
+
+
+def test__iter_token_chunks__long_line():
+    """
+    Checks that a line longer than a chunk is split without
+    corrupting multibyte characters.
+    """
+    text = "漢" * 5000
+    chunks = list(tokens.iter_token_chunks([text], 100, 0, MODEL))
+    assert "".join(chunks) == text
+    assert max(tokens.count_tokens(c, MODEL) for c in chunks) <= 100
+
+
+def test__iter_token_chunks__overlap():
+    """
+    Checks that consecutive chunks share lines when an overlap is requested.
+    """
+    text = "\n".join(f"line {i}" for i in range(100))
+    chunks = list(tokens.iter_token_chunks([text], 50, 10, MODEL))
+    assert chunks[0].splitlines()[-1] in chunks[1]
+
+
+def test__iter_token_chunks__invalid_overlap():
+    """
+    Checks that a `ValueError` is raised if the overlap is not smaller than a chunk.
+    """
+    with pytest.raises(ValueError):
+        list(tokens.iter_token_chunks(["text"], 10, 10, MODEL))
@@ -1,13 +1,115 @@
 # Standard lib
 import os
+import threading
 
 # 3rd party
 import pytest
+from sh import git
 
 # Local
+from chaingpt.api import wolfi
 from chaingpt.api.wolfi import WolfiClient
 
 
+def _package_yaml(name: str, description: str) -> str:
+    return f"package:\n  name: {name}\n  description: {description}\n"
+
+
+def _commit(repo: str, files: dict, removed: list=()):
+    """
+    Writes `files` to `repo`, deletes `removed` and commits the changes.
+    """
+    for name, content in files.items():
+        with open(os.path.join(repo, name), "w") as f:
+            f.write(content)
+    for name in removed:
+        os.remove(os.path.join(repo, name))
+    git("-C", repo, "add", "--all")
+    git("-C", repo, "-c", "user.name=test", "-c", "user.email=test@example.com",
+        "commit", "--quiet", "-m", "Update packages")
+
+
+@pytest.fixture
+def local_wolfi(tmp_path, monkeypatch):
+    """
+    Fixture that points `WolfiClient` at a local stand-in for the
+    Wolfi OS repository and returns its path.
+    """
+    upstream = os.path.join(tmp_path, "upstream")
+    git.init("--quiet", upstream)
+    _commit(upstream, {"zlib.yaml": _package_yaml("zlib", "compression library"),
+                       "curl.yaml": _package_yaml("curl", "transfer tool"),
+                       "README.md": "not a package"})
+    monkeypatch.setattr(wolfi, "OS_URL", upstream)
+    monkeypatch.setattr(wolfi, "OS_DIR", os.path.join(tmp_path, "os"))
+    monkeypatch.setattr(wolfi, "INDEX_DIR", os.path.join(tmp_path, "index"))
+    monkeypatch.setattr(wolfi, "REBUILD_AT_START", True)
+    monkeypatch.setattr(wolfi, "INCREMENTAL", True)
+    return upstream
+
+
+def _names(client: WolfiClient, keyword: str) -> list:
+    return sorted(r.name for r in client.search(keyword))
+
+
+class TestIncrementalUpdate:
+    def test__init__first_start_builds_index(self, local_wolfi):
+        """
+        Checks that the index is built from scratch when there is no previous index.
+        """
+        client = WolfiClient()
+        assert _names(client, "zlib") == ["zlib"]
+        assert client._indexed_commit() == client._head_commit()
+
+    def test__init__applies_changes(self, local_wolfi, monkeypatch):
+        """
+        Checks that added, modified and removed packages are reflected
+        in the index after a restart.
+        """
+        WolfiClient()
+        _commit(local_wolfi, {"jq.yaml": _package_yaml("jq", "json processor"),
+                              "curl.yaml": _package_yaml("curl", "url fetcher")},
+                removed=["zlib.yaml"])
+
+        def fail():
+            raise AssertionError("Unexpected full rebuild")
+        client = WolfiClient()
+        monkeypatch.setattr(client, "_init_index", fail)
+        assert _names(client, "jq") == ["jq"]
+        assert _names(client, "zlib") == []
+        assert _names(client, "fetcher") == ["curl"]
+        assert _names(client, "transfer") == []
+        assert client._indexed_commit() == client._head_commit()
+
+    def test__init__unchanged_does_not_rebuild(self, local_wolfi, monkeypatch):
+        """
+        Checks that restarting without upstream changes reuses the index.
+        """
+        WolfiClient()
+        monkeypatch.setattr(WolfiClient, "_init_index",
+                            lambda self: pytest.fail("Unexpected full rebuild"))
+        assert _names(WolfiClient(), "curl") == ["curl"]
+
+    def test__init__unknown_commit_rebuilds(self, local_wolfi):
+        """
+        Checks that the index is rebuilt if the indexed commit
+        is no longer in the history.
+        """
+        client = WolfiClient()
+        client._write_indexed_commit("0" * 40)
+        assert _names(WolfiClient(), "curl") == ["curl"]
+
+    def test__init__not_incremental_rebuilds(self, local_wolfi, monkeypatch):
+        """
+        Checks that the index is always rebuilt when `INCREMENTAL` is off.
+        """
+        WolfiClient()
+        monkeypatch.setattr(wolfi, "INCREMENTAL", False)
+        monkeypatch.setattr(WolfiClient, "_update_index",
+                            lambda self: pytest.fail("Unexpected incremental update"))
+        assert _names(WolfiClient(), "zlib") == ["zlib"]
+
+
 class TestWolfiClient:
     def test__search__match(self):
         """
@@ -39,3 +141,285 @@ class TestWolfiClient:
         """
         with pytest.raises(TypeError):
             WolfiClient().search(123)
+
+
+def test__parse_package__reads_only_needed_blocks(tmp_path):
+    """
+    Checks that the package and subpackages are read even if the
+    rest of the file is not valid YAML.
+    """
+    path = os.path.join(tmp_path, "make.yaml")
+    with open(path, "w") as f:
+        f.write("package:\n  name: make\n  version: 4.4\n  description: build tool\n"
+                "  dependencies:\n    provides:\n      - cmd:gmake=${{package.version}}\n"
+                "# comment\n\npipeline: [unclosed\n"
+                "subpackages:\n  - name: ${{package.name}}-doc\n"
+                "  - range: extras\n    name: ${{range.key}}\n")
+    package = wolfi._parse_package(path)
+    assert package == wolfi.PackageDefinition(name="make", description="build tool",
+                                              version="4.4", subpackages=["make-doc"],
+                                              provides={"make": ["cmd:gmake=4.4"]})
+
+
+def test__parse_package__anchor_outside_block(tmp_path):
+    """
+    Checks that the whole file is parsed when the `package:` block
+    refers to an anchor defined outside of it.
+    """
+    path = os.path.join(tmp_path, "zlib.yaml")
+    with open(path, "w") as f:
+        f.write("vars:\n  d: &desc compression library\n"
+                "package:\n  name: zlib\n  description: *desc\n")
+    assert wolfi._parse_package(path).description == "compression library"
+
+
+def test__parse_package__not_a_package(tmp_path):
+    """
+    Checks that `None` is returned for files without a `package:` block.
+    """
+    path = os.path.join(tmp_path, "config.yaml")
+    with open(path, "w") as f:
+        f.write("pipeline:\n  - uses: fetch\n")
+    assert wolfi._parse_package(path) is None
+
+
+@pytest.mark.parametrize("procs", [1, 2])
+def test__build_index__all_packages(tmp_path, procs):
+    """
+    Checks that every package file is indexed, serially or in parallel.
+    """
+    os_path = os.path.join(tmp_path, "os")
+    os.makedirs(os_path)
+    for i in range(20):
+        with open(os.path.join(os_path, f"pkg{i}.yaml"), "w") as f:
+            f.write(_package_yaml(f"pkg{i}", f"package {i}"))
+    with open(os.path.join(os_path, "README.md"), "w") as f:
+        f.write("package:\n")
+
+    index = wolfi.build_index(os_path, os.path.join(tmp_path, "index"), procs=procs)
+    with index.searcher() as searcher:
+        names = sorted(doc["package_name"] for doc in searcher.documents())
+    assert names == sorted(f"pkg{i}" for i in range(20))
+
+
+def test__build_index__background_thread(tmp_path):
+    """
+    Checks that the index is built in parallel off the main thread,
+    as it is when the Wolfi client is created in the background.
+    """
+    os_path = os.path.join(tmp_path, "os")
+    os.makedirs(os_path)
+    for i in range(20):
+        with open(os.path.join(os_path, f"pkg{i}.yaml"), "w") as f:
+            f.write(_package_yaml(f"pkg{i}", f"package {i}"))
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        wolfi.build_index(os_path, os.path.join(tmp_path, "index"), procs=2)))
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive()
+    with result[0].searcher() as searcher:
+        assert searcher.doc_count() == 20
+
+
+def test__build_index__reports_progress_quietly(tmp_path, capsys):
+    """
+    Checks that progress goes to `on_progress` instead of a progress bar.
+    """
+    os_path = os.path.join(tmp_path, "os")
+    os.makedirs(os_path)
+    for i in range(3):
+        with open(os.path.join(os_path, f"pkg{i}.yaml"), "w") as f:
+            f.write(_package_yaml(f"pkg{i}", f"package {i}"))
+
+    progress = []
+    wolfi.build_index(os_path, os.path.join(tmp_path, "index"), procs=1,
+                      on_progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    captured = capsys.readouterr()
+    assert captured.out == captured.err == ""
+
+
+class TestSearchCache:
+    @pytest.fixture
+    def client(self, local_wolfi):
+        _commit(local_wolfi, {f"py{i}.yaml": _package_yaml(f"py{i}", "python module")
+                              for i in range(5)})
+        return WolfiClient()
+
+    def test__search__repeat_hits_cache(self, client):
+        """
+        Checks that repeated searches are answered from the cache, ignoring
+        differences in whitespace.
+        """
+        first = client.search("python")
+        assert client.search("  python ") == first
+        stats = client.cache_stats()
+        assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+        assert stats.hit_rate == 0.5
+
+    def test__search__cached_results_are_copies(self, client):
+        """
+        Checks that mutating returned results does not change the cache.
+        """
+        client.search("python").clear()
+        assert len(client.search("python")) == 5
+
+    def test__search__pages(self, client):
+        """
+        Checks that `limit` and `page` split the results into pages.
+        """
+        first = client.search("python", limit=2)
+        second = client.search("python", limit=2, page=2)
+        last = client.search("python", limit=2, page=3)
+        assert (len(first), len(second), len(last)) == (2, 2, 1)
+        names = [r.name for r in first + second + last]
+        assert sorted(names) == [f"py{i}" for i in range(5)]
+
+    def test__search__invalid_limit(self, client):
+        """
+        Checks that a `ValueError` is raised if `limit` or `page` is not positive.
+        """
+        with pytest.raises(ValueError):
+            client.search("python", limit=0)
+        with pytest.raises(ValueError):
+            client.search("python", page=0)
+
+    def test__search__evicts_least_recently_used(self, client, monkeypatch):
+        """
+        Checks that the cache holds at most `SEARCH_CACHE_SZ` results.
+        """
+        monkeypatch.setattr(wolfi, "SEARCH_CACHE_SZ", 2)
+        client.search("python")
+        client.search("zlib")
+        client.search("python")
+        client.search("curl")
+        assert client.cache_stats().size == 2
+        client.search("python")
+        client.search("zlib")
+        assert client.cache_stats().hits == 2
+
+    def test__search__index_change_clears_cache(self, client):
+        """
+        Checks that the cache is dropped when the index is updated.
+        """
+        assert client.search("jq") == []
+        writer = client.index.writer()
+        writer.add_document(package_file="jq.yaml", package_name="jq",
+                            package_desc="json processor")
+        writer.commit()
+        assert [r.name for r in client.search("jq")] == ["jq"]
+        assert client.cache_stats().hits == 0
+
+
+class TestBatchLookup:
+    @pytest.fixture
+    def client(self, local_wolfi):
+        _commit(local_wolfi, {"python-3.12.yaml": _package_yaml("python-3.12", "python 3.12")})
+        return WolfiClient()
+
+    def test__search_many__results_per_keyword(self, client):
+        """
+        Checks that each keyword gets its own results.
+        """
+        results = client.search_many(["zlib", "curl", "nothing"])
+        assert [r.name for r in results["zlib"]] == ["zlib"]
+        assert [r.name for r in results["curl"]] == ["curl"]
+        assert results["nothing"] == []
+
+    def test__search_many__keyword_is_not_str(self, client):
+        """
+        Checks that a `TypeError` is raised if a keyword is not a `str`.
+        """
+        with pytest.raises(TypeError):
+            client.search_many(["zlib", 1])
+
+    def test__check_packages__known(self, client):
+        """
+        Checks that known packages pass unchanged, keeping version constraints.
+        """
+        checks = client.check_packages(["zlib", "python-3.12>=3.12.1", "cmd:make"])
+        assert [c.package for c in checks] == ["zlib", "python-3.12>=3.12.1", "cmd:make"]
+
+    def test__check_packages__corrects_case(self, client):
+        """
+        Checks that names differing only in case are corrected.
+        """
+        assert client.check_packages(["Zlib"])[0].package == "zlib"
+
+    def test__check_packages__unknown(self, client):
+        """
+        Checks that unknown packages are reported with close suggestions.
+        """
+        check, = client.check_packages(["python-3.21"])
+        assert check.package is None
+        assert check.suggestions == ["python-3.12"]
+
+    def test__check_packages__subpackages_and_provides(self, local_wolfi):
+        """
+        Checks that subpackages and provided names are accepted, and that
+        bare names provided by exactly one package are corrected to it.
+        """
+        _commit(local_wolfi, {"openssl.yaml": _OPENSSL_YAML})
+        checks = WolfiClient().check_packages(["openssl-dev", "openssl", "libssl.so.3"])
+        assert [c.package for c in checks] == ["openssl-dev", "openssl", "libssl3"]
+
+
+_OPENSSL_YAML = """package:
+  name: libssl3
+  version: 3.2.1
+  description: TLS library
+  dependencies:
+    provides:
+      - so:libssl.so.3
+      - openssl=${{package.version}}
+subpackages:
+  - name: openssl-dev
+    dependencies:
+      provides:
+        - pc:openssl
+"""
+
+
+class TestLookup:
+    def test__lookup__by_name_and_provides(self, local_wolfi):
+        """
+        Checks that packages are found by name, subpackage name and provided names.
+        """
+        _commit(local_wolfi, {"openssl.yaml": _OPENSSL_YAML})
+        client = WolfiClient()
+        assert [p.name for p in client.lookup("libssl3")] == ["libssl3"]
+        assert [p.name for p in client.lookup("libssl.so.3")] == ["libssl3"]
+        assert [p.name for p in client.lookup("so:libssl.so.3")] == ["libssl3"]
+        assert [(p.name, p.version, p.origin) for p in client.lookup("openssl")] \
+            == [("libssl3", "3.2.1", "libssl3"), ("openssl-dev", "3.2.1", "libssl3")]
+        assert client.lookup("nothing") == []
+
+    def test__lookup__incremental_update(self, local_wolfi):
+        """
+        Checks that the reverse index follows changes to package files.
+        """
+        _commit(local_wolfi, {"openssl.yaml": _OPENSSL_YAML})
+        WolfiClient()
+        _commit(local_wolfi, {"jq.yaml": _package_yaml("jq", "json processor")},
+                removed=["openssl.yaml"])
+        client = WolfiClient()
+        assert [p.name for p in client.lookup("jq")] == ["jq"]
+        assert client.lookup("libssl.so.3") == []
+
+    def test__lookup__rebuilds_missing_provides(self, local_wolfi, monkeypatch):
+        """
+        Checks that an index without a provides index is rebuilt on start.
+        """
+        client = WolfiClient()
+        os.remove(os.path.join(client.index_path, wolfi.PROVIDES_FILE_NAME))
+        monkeypatch.setattr(wolfi, "REBUILD_AT_START", False)
+        assert [p.name for p in WolfiClient().lookup("zlib")] == ["zlib"]
+
+    def test__lookup__name_is_not_str(self, local_wolfi):
+        """
+        Checks that a `TypeError` is raised if `name` is not a `str`.
+        """
+        with pytest.raises(TypeError):
+            WolfiClient().lookup(1)
@@ -1,13 +1,17 @@
 # Standard lib
 import os
 import shutil
+import tarfile
 
 # 3rd party
 import pytest
+from sh import git
 
 # Local
 from chaingpt.api import workspace
-from tests.api.unittests.utils import setup_grype_workspace, cleanup_leftover_workspaces
+from chaingpt.api.llm import LLMResponse
+from tests.api.unittests.utils import setup_grype_workspace, cleanup_leftover_workspaces, \
+    local_repo, local_repo_url, local_workspace
 
 
 def test___random_parent_dir__prefix_provided():
@@ -30,32 +34,41 @@ def test___validate_path_name__is_proper():
     """
     Checks that a properly formed path name does not raise an exception.
     """
-    # TODO
-    pass
+    for path in ["README.md", "src/main.py", "./src/", "*", "src/**/*.py", "a..b"]:
+        workspace._validate_path_name(path)
 
 
 def test___validate_path_name__is_improper():
     """
     Checks that improperly formatted or malicious path names raise an exception.
     """
-    # TODO
-    pass
+    for path in ["/etc/passwd", "..", "../other", "src/../../etc", "src/..", "/*"]:
+        with pytest.raises(ValueError):
+            workspace._validate_path_name(path)
 
 
 def test___validate_git_url__is_proper():
     """
     Checks that a properly formed GitHub URL does not raise an exception.
     """
-    # TODO
-    pass
+    for url in ["https://github.com/anchore/grype.git", "https://github.com/anchore/grype",
+                "https://github.com/some-user/my_project.v2"]:
+        workspace._validate_git_url(url)
 
 
 def test___validate_git_url__is_improper():
     """
     Checks that improperly formatted GitHub URLs raise an exception.
     """
-    # TODO
-    pass
+    for url in ["http://github.com/anchore/grype.git", "https://gitlab.com/anchore/grype.git",
+                "https://github.com/anchore", "https://github.com/anchore/grype/tree/main",
+                "https://github.com/anchore/..", "https://github.com.evil.com/anchore/grype",
+                "git@github.com:anchore/grype.git", "file:///tmp/grype", "/tmp/grype",
+                "https://github.com/anchore/grype.git --upload-pack=touch"]:
+        with pytest.raises(ValueError):
+            workspace._validate_git_url(url)
+    with pytest.raises(TypeError):
+        workspace._validate_git_url(None)
 
 
 def test___repo_name__no_suffix():
@@ -207,10 +220,114 @@ class TestWorkspace:
             wk.search(123)
 
 
-    def test__search__traversal_attack(self):
+    def test__search__traversal_attack(self, local_workspace):
         """
         Checks that attempts to navigate outside of the
         repository fail.
         """
-        # TODO
-        pass
\ No newline at end of file
+        wk = local_workspace
+        os.symlink(os.path.dirname(wk.parent_dir), os.path.join(wk.repo_dir, "escape"))
+        for path in ["..", "../*", "/tmp/*", "src/../../*"]:
+            with pytest.raises(ValueError):
+                wk.search(path)
+        for path in ["../README.md", "/etc/passwd", "escape/passwd"]:
+            with pytest.raises(ValueError):
+                wk.fileqa("What is this?", path)
+            with pytest.raises(ValueError):
+                wk._read_n(10, path)
+
+
+class TestSnapshot:
+    def test__snapshot__contents(self, local_workspace):
+        """
+        Checks that the archive holds the repository under `root`.
+        """
+        path = local_workspace.snapshot("/workspace")
+        with tarfile.open(path) as tar:
+            names = tar.getnames()
+        assert "workspace/project/README.md" in names
+        assert "workspace/project/.git/HEAD" in names
+
+    def test__snapshot__cached_until_commit(self, local_workspace):
+        """
+        Checks that the archive is only rebuilt after the checkout changes.
+        """
+        path = local_workspace.snapshot("/workspace")
+        mtime = os.stat(path).st_mtime_ns
+        assert os.stat(local_workspace.snapshot("/workspace")).st_mtime_ns == mtime
+
+        repo = local_workspace.repo_dir
+        with open(os.path.join(repo, "NEW.md"), "w") as f:
+            f.write("new")
+        git("-C", repo, "add", "NEW.md")
+        git("-C", repo, "-c", "user.name=test", "-c", "user.email=test@example.com",
+            "commit", "--quiet", "-m", "Add NEW.md")
+        with tarfile.open(local_workspace.snapshot("/workspace")) as tar:
+            assert "workspace/project/NEW.md" in tar.getnames()
+
+    def test__snapshot__linked_files_are_writable(self, local_workspace):
+        """
+        Checks that files shared with a read-only checkout are
+        archived with write permission for their owner.
+        """
+        with tarfile.open(local_workspace.snapshot("/workspace")) as tar:
+            assert tar.getmember("workspace/project/README.md").mode & 0o200
+
+
+class TestSharedCheckout:
+    def test__workspaces_share_files(self, local_workspace, local_repo_url):
+        """
+        Checks that workspaces of the same commit hardlink
+        the files of one read-only checkout.
+        """
+        other = workspace.Workspace(local_repo_url)
+        try:
+            a = os.stat(os.path.join(local_workspace.repo_dir, "src", "main.py"))
+            b = os.stat(os.path.join(other.repo_dir, "src", "main.py"))
+            assert a.st_ino == b.st_ino
+            assert a.st_nlink == 3  # The base checkout and both workspaces
+            assert other.search("src/*") == ([], ["src/main.py"])
+        finally:
+            shutil.rmtree(other.parent_dir)
+
+    def test__unshare(self, local_workspace, local_repo_url):
+        """
+        Checks that an unshared file can be modified in place
+        without changing the other workspaces.
+        """
+        other = workspace.Workspace(local_repo_url)
+        try:
+            local_workspace.unshare("README.md")
+            with open(os.path.join(local_workspace.repo_dir, "README.md"), "a") as f:
+                f.write("Changed\n")
+            assert other._read_n(100, "README.md") == "# Project\n"
+        finally:
+            shutil.rmtree(other.parent_dir)
+
+
+class TestFileQACache:
+    def test__fileqa__key_includes_reduce_fanout(self, local_workspace, monkeypatch):
+        """
+        Checks that cached answers are only reused with the same reduce fan-out.
+        """
+        calls = []
+        def text_qa(question, text, file_path):
+            calls.append(file_path)
+            return LLMResponse(output="answer", model="fake", input_tokens=0, output_tokens=0)
+        monkeypatch.setattr(workspace, "text_qa", text_qa)
+
+        local_workspace.fileqa("What is this?", "README.md")
+        assert local_workspace.fileqa("What is this?", "README.md").cache_hits == 1
+        monkeypatch.setattr(workspace, "MAP_REDUCE_REDUCE_FANOUT", 2)
+        local_workspace.fileqa("What is this?", "README.md")
+        assert len(calls) == 2
+
+    def test__cache_is_shared(self, local_workspace, local_repo_url):
+        """
+        Checks that workspaces share one cache connection.
+        """
+        other = workspace.Workspace(local_repo_url)
+        try:
+            assert other.cache is local_workspace.cache
+        finally:
+            shutil.rmtree(other.parent_dir)
@@ -1,12 +1,18 @@
 # Standard lib
+from typing import Iterator, List, Tuple
 import os
 import shutil
+import tarfile
+import threading
 
 # 3rd party
 import pytest
+from sh import git
 
 # Local
 from chaingpt.api import workspace
+from chaingpt.api.pool import ContainerBackend, STDOUT
+from chaingpt.api.images import ImageBackend, CachedImage
 
 
 @pytest.fixture
@@ -30,6 +36,51 @@ def setup_grype_workspace(monkeypatch):
     shutil.rmtree(wk.parent_dir)
 
 
+@pytest.fixture
+def local_repo(tmp_path):
+    """
+    Fixture that creates a local git repository with a README
+    and a small Python package to stand in for a GitHub repository.
+    """
+    repo = os.path.join(tmp_path, "upstream", "project")
+    os.makedirs(os.path.join(repo, "src"))
+    with open(os.path.join(repo, "README.md"), "w") as f:
+        f.write("# Project\n")
+    with open(os.path.join(repo, "src", "main.py"), "w") as f:
+        f.write("def main():\n    print('hello')\n")
+    git.init("--quiet", repo)
+    git("-C", repo, "add", "--all")
+    git("-C", repo, "-c", "user.name=test", "-c", "user.email=test@example.com",
+        "commit", "--quiet", "-m", "Initial commit")
+    return repo
+
+
+LOCAL_REPO_URL = "https://github.com/test/project.git"
+
+
+@pytest.fixture
+def local_repo_url(local_repo, monkeypatch):
+    """
+    Fixture that has git fetch `LOCAL_REPO_URL` from `local_repo`, so that
+    workspaces can be created from a valid GitHub URL without network access.
+    """
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", f"url.{local_repo}.insteadOf")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", LOCAL_REPO_URL)
+    return LOCAL_REPO_URL
+
+
+@pytest.fixture
+def local_workspace(local_repo_url, tmp_path, monkeypatch):
+    """
+    Fixture that creates a workspace cloned from `local_repo`.
+    """
+    monkeypatch.setattr(workspace, "REPOSITORY_DIR", os.path.join(tmp_path, "cache"))
+    wk = workspace.Workspace(local_repo_url)
+    yield wk
+    shutil.rmtree(wk.parent_dir)
+
+
 @pytest.fixture
 def cleanup_leftover_workspaces():
     """
@@ -40,4 +91,76 @@ def cleanup_leftover_workspaces():
     for d in dirs:
         if d.startswith("chaingpt"):
             path = os.path.join("/tmp", d)
-            shutil.rmtree(path)
\ No newline at end of file
+            shutil.rmtree(path)
+
+
+class FakeBackend(ContainerBackend):
+    """
+    An in-memory stand-in for Docker.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.running = set()
+        self.removed = []
+        self.unhealthy = set()
+        self.execs = []
+        self.copies = []
+        self.output = None  # `(stream, data)` chunks of every exec, or the command by default
+        self.return_code = 0
+
+    def create(self) -> str:
+        with self.lock:
+            self.next_id += 1
+            id = f"c{self.next_id}"
+            self.running.add(id)
+            return id
+
+    def exec(self, container_id: str, cmd: List[str],
+             workdir: str=None) -> Tuple[str, Iterator[Tuple[int, bytes]]]:
+        self.execs.append((container_id, cmd, workdir))
+        chunks = self.output
+        if chunks is None:
+            chunks = [(STDOUT, f"{container_id}: {' '.join(cmd)}".encode("utf-8"))]
+        return str(len(self.execs)), iter(chunks)
+
+    def exit_code(self, exec_id: str) -> int:
+        return self.return_code
+
+    def copy_in(self, container_id: str, archive_path: str):
+        with tarfile.open(archive_path) as tar:
+            self.copies.append((container_id, sorted(tar.getnames())))
+
+    def is_healthy(self, container_id: str) -> bool:
+        return container_id in self.running and container_id not in self.unhealthy
+
+    def remove(self, container_id: str):
+        with self.lock:
+            self.running.discard(container_id)
+            self.removed.append(container_id)
+
+
+class FakeImageBackend(ImageBackend):
+    """
+    An in-memory stand-in for Docker images. Each image is `size` bytes.
+    """
+    def __init__(self, size: int=100, existing: List[CachedImage]=()):
+        self.size = size
+        self.images = {image.tag: image for image in existing}
+        self.builds = []
+        self.removed = []
+        self.fail = False
+
+    def build(self, base_image: str, deps: List[str], tag: str) -> int:
+        self.builds.append(deps)
+        if self.fail:
+            raise ValueError("apk add failed")
+        self.images[tag] = CachedImage(tag, deps, self.size, 0)
+        return self.size
+
+    def list(self, base_image: str) -> List[CachedImage]:
+        return list(self.images.values())
+
+    def remove(self, tag: str):
+        self.images.pop(tag, None)
+        self.removed.append(tag)
@@ -0,0 +1,67 @@
+# Standard lib
+import asyncio
+
+# 3rd party
+
+# Local
+from chaingpt.cli import app, display
+
+
+class FakeAgent():
+    def __init__(self):
+        self.prompts = []
+        self.closed = False
+
+    async def aprompt(self, msg, callback=None):
+        self.prompts.append(msg)
+
+    def close(self):
+        self.closed = True
+
+
+def _run_chatloop(monkeypatch, prompts, make_agent):
+    monkeypatch.setattr(app, "_make_agent", make_agent)
+    inputs = iter(prompts)
+    monkeypatch.setattr("builtins.input", lambda _: next(inputs))
+    asyncio.run(app.ChainGPTApp("https://github.com/anchore/grype.git").chatloop())
+
+
+def test__chatloop__agent_fails_to_start(monkeypatch, capsys):
+    """
+    Checks that a failed agent start is reported and retried
+    on the next prompt instead of ending the session.
+    """
+    agent = FakeAgent()
+    attempts = []
+    def make_agent(url):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise RuntimeError("The api_key client option must be set")
+        return agent
+
+    _run_chatloop(monkeypatch, ["hello", "hello again", "exit"], make_agent)
+    assert "The agent could not start: The api_key client option must be set" \
+        in capsys.readouterr().out
+    assert agent.prompts == ["hello again"]
+    assert agent.closed
+
+
+def test__chatloop__exit_after_failed_start(monkeypatch):
+    """
+    Checks that exiting works when the agent never started.
+    """
+    def make_agent(url):
+        raise RuntimeError("No Docker")
+    _run_chatloop(monkeypatch, ["hello", "exit"], make_agent)
+
+
+def test__chatloop__stats_show_index_progress(monkeypatch, capsys):
+    """
+    Checks that `stats` shows how far the Wolfi index has been built.
+    """
+    monkeypatch.setattr(display, "_index_progress", None)
+    display.record_index_progress(5, 10)
+    _run_chatloop(monkeypatch, ["stats", "exit"], lambda url: FakeAgent())
+    out = capsys.readouterr().out
+    assert "Local Wolfi package index: " in out
+    assert "5/10 packages" in out
@@ -0,0 +1,95 @@
+# Standard lib
+import asyncio
+import threading
+import time
+
+# 3rd party
+from docker.errors import DockerException
+
+# Local
+from chaingpt.api.system import LazyEnvironment
+from chaingpt.cli import tools
+from tests.api.unittests.utils import local_repo, local_repo_url, local_workspace
+
+
+class FakeWolfi():
+    def check_packages(self, names):
+        return []
+
+
+def _no_docker():
+    raise DockerException("Error while fetching server API version")
+
+
+def test__get_tools__without_docker(local_workspace, monkeypatch):
+    """
+    Checks that creating the tools does not need Docker and that
+    tools other than run_script keep working without it.
+    """
+    monkeypatch.setattr(tools, "Workspace", lambda url: local_workspace)
+    monkeypatch.setattr(tools, "WolfiClient", FakeWolfi)
+    env = LazyEnvironment(make_env=_no_docker)
+    by_name = {t.name: t for t in tools.get_tools(local_workspace.url, print, env)}
+    assert "Files: [README.md]" in by_name["search_path"].run({"path": "*"})
+
+
+def test__run_script__without_docker():
+    """
+    Checks that run_script reports a missing Docker daemon as an error.
+    """
+    env = LazyEnvironment(make_env=_no_docker)
+    run_script = tools.get_tool_run_script(print, FakeWolfi(), None, env)
+    output = run_script.run({"script": "echo hi", "deps": ""})
+    assert output.startswith("Error: Scripts cannot run because Docker is unavailable")
+
+
+def test__path_tools__reject_escaping_paths(local_workspace):
+    """
+    Checks that paths outside of the workspace come back as tool
+    errors instead of failing the agent's turn.
+    """
+    file_qa = tools.get_tool_file_qa(local_workspace)
+    search_path = tools.get_tool_search_path(local_workspace)
+    for path in ["../README.md", "/etc/passwd"]:
+        assert file_qa.run({"question": "What is this?", "file_path": path}).startswith("Error: ")
+    for path in ["../*", "/etc/*"]:
+        assert search_path.run({"path": path}).startswith("Error: ")
+
+
+class SlowWorkspace():
+    """
+    A workspace whose path searches take a while and record how many run at once.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def search(self, path: str):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return [], [path]
+
+
+def test__get_tools__caps_parallel_tool_calls(monkeypatch):
+    """
+    Checks that tool calls awaited together never run more than `max_parallel`
+    at once and that their results come back in call order.
+    """
+    workspace = SlowWorkspace()
+    monkeypatch.setattr(tools, "Workspace", lambda url: workspace)
+    monkeypatch.setattr(tools, "WolfiClient", FakeWolfi)
+    env = LazyEnvironment(make_env=_no_docker)
+    by_name = {t.name: t for t in tools.get_tools("url", print, env, max_parallel=2)}
+
+    async def search_all():
+        return await asyncio.gather(*(by_name["search_path"].ainvoke({"path": f"f{i}"})
+                                      for i in range(6)))
+
+    results = asyncio.run(search_all())
+    assert results == [f"Directories: []\nFiles: [f{i}]" for i in range(6)]
+    assert workspace.peak == 2